@@ -0,0 +1,42 @@
+"""Helpers shared by the benchmark scripts."""
+from nete.backend.storage.filesystem import FilesystemStorage
+from nete.common.models import Note
+import contextlib
+import datetime
+import time
+import uuid
+
+
+def make_note(text_size=0, text=None):
+    """Returns a new note with a text of `text_size` characters, or
+    `text` if given."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return Note(
+        id=uuid.uuid4(),
+        revision_id=uuid.uuid4(),
+        created_at=now,
+        updated_at=now,
+        title='Benchmark note',
+        text='x' * text_size if text is None else text)
+
+
+@contextlib.contextmanager
+def open_storage(base_dir, **kwargs):
+    """Opens a FilesystemStorage in `base_dir` and closes it afterwards."""
+    storage = FilesystemStorage(base_dir, **kwargs)
+    storage.open()
+    try:
+        yield storage
+    finally:
+        storage.close()
+
+
+class Timer:
+    """Measures the duration of a `with` block in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.start
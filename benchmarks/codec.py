@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+"""Measure the per-note cost of serializing and deserializing notes.
+
+Results can be saved with --save and compared against saved results
+with --baseline, which exits with an error if any measurement got
+slower by more than --tolerance.
+"""
+from _common import make_note
+from nete.common.schemas import note_codec
+from nete.common.schemas.note_index_schema import NoteIndexSchema
+from nete.common.schemas.note_schema import NoteSchema
+from nete.common.schemas.registry import get_schema
+import argparse
+import json
+import sys
+import timeit
+
+
+def benchmarks(note):
+    note_json = get_schema(NoteSchema).dumps(note)
+    index_json = get_schema(NoteIndexSchema).dumps([note], many=True)
+
+    return [
+        ('dumps note', lambda: get_schema(NoteSchema).dumps(note)),
+        ('loads note', lambda: get_schema(NoteSchema).loads(note_json)),
+        ('dumps index item',
+         lambda: get_schema(NoteIndexSchema).dumps([note], many=True)),
+        ('loads index item',
+         lambda: get_schema(NoteIndexSchema).loads(index_json, many=True)),
+        ('dumps note, codec', lambda: note_codec.dumps_note(note)),
+        ('loads note, codec', lambda: note_codec.loads_note(note_json)),
+        ('dumps index item, codec',
+         lambda: note_codec.dumps_notes([note], note_codec.HEADER_FIELDS)),
+        # what every call used to cost before schemas were shared
+        ('dumps note, new schema', lambda: NoteSchema().dumps(note)),
+        ('loads note, new schema', lambda: NoteSchema().loads(note_json)),
+    ]
+
+
+def measure(fn, repeat, number):
+    return min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--text-size', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown relative to the baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    results = {}
+    regressions = []
+    print('{:26} {:>10} {:>10}'.format('benchmark', 'µs/note', 'baseline'))
+    for name, fn in benchmarks(make_note(args.text_size)):
+        results[name] = measure(fn, args.repeat, args.number) * 1e6
+        expected = baseline.get(name)
+        print('{:26} {:10.1f} {:>10}'.format(
+            name,
+            results[name],
+            '' if expected is None else '{:.1f}'.format(expected)))
+        if (expected is not None and
+                results[name] > expected * (1 + args.tolerance)):
+            regressions.append(name)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if regressions:
+        print('Slower than baseline: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+#! /usr/bin/env python3
+"""Measure memory used by note listings of the storage's index."""
+from _common import make_note
+from nete.backend.storage.note_header import note_header
+import argparse
+import tracemalloc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--notes', type=int, default=100000)
+    args = parser.parse_args()
+
+    notes = [make_note() for _ in range(args.notes)]
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    headers = [note_header(note) for note in notes]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{} notes: {:.0f} bytes per listed note'.format(
+        len(headers), (after - before) / len(headers)))
+
+
+if __name__ == '__main__':
+    main()
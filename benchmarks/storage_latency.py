@@ -0,0 +1,94 @@
+#! /usr/bin/env python3
+"""Measure storage operation latency under a mixed, concurrent load.
+
+Writers keep writing large notes while readers read small notes and
+listers list all notes. A probe task measures how late the event loop
+wakes it up, which shows how much blocking work runs on the loop.
+"""
+from _common import Timer, make_note, open_storage
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+
+async def measure(latencies, name, coro):
+    with Timer() as timer:
+        await coro
+    latencies.setdefault(name, []).append(timer.duration)
+
+
+async def writer(storage, latencies, deadline, text_size):
+    while time.perf_counter() < deadline:
+        await measure(latencies, 'write', storage.write(make_note(text_size)))
+
+
+async def reader(storage, latencies, deadline, note_ids):
+    while time.perf_counter() < deadline:
+        note_id = random.choice(note_ids)
+        await measure(latencies, 'read', storage.read(note_id))
+
+
+async def lister(storage, latencies, deadline):
+    while time.perf_counter() < deadline:
+        await measure(latencies, 'list', storage.list())
+        await asyncio.sleep(0.01)
+
+
+async def probe(latencies, deadline):
+    while time.perf_counter() < deadline:
+        await measure(latencies, 'loop lag', asyncio.sleep(0.001))
+
+
+async def run(storage, args):
+    note_ids = []
+    for _ in range(args.notes):
+        note = make_note(args.small_size)
+        await storage.write(note)
+        note_ids.append(note.id)
+
+    latencies = {}
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        probe(latencies, deadline),
+        lister(storage, latencies, deadline),
+        *[writer(storage, latencies, deadline, args.large_size)
+          for _ in range(args.writers)],
+        *[reader(storage, latencies, deadline, note_ids)
+          for _ in range(args.readers)])
+    return latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--notes', type=int, default=1000)
+    parser.add_argument('--small-size', type=int, default=1000)
+    parser.add_argument('--large-size', type=int, default=1000000)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--max-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_dir, \
+            open_storage(base_dir, max_workers=args.max_workers) as storage:
+        loop = asyncio.get_event_loop()
+        latencies = loop.run_until_complete(run(storage, args))
+
+    print('{:10} {:>8} {:>10} {:>10}'.format(
+        'op', 'count', 'p50 ms', 'p99 ms'))
+    for name, values in sorted(latencies.items()):
+        print('{:10} {:8d} {:10.2f} {:10.2f}'.format(
+            name, len(values),
+            percentile(values, 50) * 1000,
+            percentile(values, 99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
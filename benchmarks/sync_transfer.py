@@ -0,0 +1,179 @@
+#! /usr/bin/env python3
+"""Measure sync transfer time over a slow link with and without compression.
+
+A remote nete-backend with many notes listens on a Unix socket behind an
+SSH server, and an empty local storage pulls all notes from it through
+the same SshTunnel a sync to an http+ssh:// URL uses. The SSH server runs
+in this process (with asyncssh, accepting anyone), behind a proxy that
+limits the bandwidth of the SSH connection and counts the bytes it
+forwards, like a slow network would.
+
+Results with the defaults (500 notes of 4000 characters, 1024 KiB/s),
+Python 3.11, aiohttp 3.14, asyncssh 2.24:
+
+    compression     seconds KiB received
+    off                2.79         2122
+    on                 0.96          404
+"""
+from _common import Timer, make_note, open_storage
+from nete.backend.app import create_app
+from nete.backend.connection_method import close_ssh_tunnels
+from nete.backend.nete_client import client_pool
+from nete.backend.sync import Synchronizer
+from nete.common.nete_url import NeteUrl
+from aiohttp import web
+import argparse
+import asyncio
+import asyncssh
+import os
+import os.path
+import random
+import tempfile
+import unittest.mock
+
+WORDS = (
+    'the quick brown fox jumps over lazy dog note text meeting todo '
+    'call buy milk remember project idea draft review release').split()
+
+HOST = '127.0.0.1'
+
+
+def random_text(size):
+    """Returns words of about `size` characters, which compress like
+    real text does."""
+    text = ''
+    while len(text) < size:
+        text += random.choice(WORDS) + ' '
+    return text
+
+
+class SshServer(asyncssh.SSHServer):
+    """Lets anyone in and allows forwarding connections to local sockets."""
+
+    def begin_auth(self, username):
+        return False
+
+    def unix_connection_requested(self, dest_path):
+        return True
+
+
+def socket_command(socket_path):
+    """Returns a process factory answering `nete socket` like the nete
+    command does on a remote host."""
+    def handle(process):
+        process.stdout.write(socket_path + '\n')
+        process.exit(0)
+    return handle
+
+
+class ThrottlingProxy:
+    """Forwards connections to `port`, at most `bandwidth` bytes/s in
+    each direction, and counts the bytes sent to the client."""
+
+    def __init__(self, port, bandwidth):
+        self.port = port
+        self.bandwidth = bandwidth
+        self.bytes_received = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, HOST, 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(
+            HOST, self.port)
+        await asyncio.gather(
+            self.forward(client_reader, server_writer, count=False),
+            self.forward(server_reader, client_writer, count=True))
+
+    async def forward(self, reader, writer, count):
+        try:
+            while True:
+                data = await reader.read(16 * 1024)
+                if not data:
+                    break
+                if count:
+                    self.bytes_received += len(data)
+                await asyncio.sleep(len(data) / self.bandwidth)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def run(remote_storage, args, compress, tmp_dir):
+    socket_path = os.path.join(tmp_dir, 'nete.socket')
+    runner = web.AppRunner(create_app(remote_storage, compress=compress))
+    await runner.setup()
+    site = web.UnixSite(runner, socket_path)
+    await site.start()
+
+    host_key = asyncssh.generate_private_key('ssh-ed25519')
+    ssh_server = await asyncssh.create_server(
+        SshServer, HOST, 0,
+        server_host_keys=[host_key],
+        process_factory=socket_command(socket_path))
+    proxy = ThrottlingProxy(ssh_server.get_port(), args.bandwidth * 1024)
+    proxy_port = await proxy.start()
+    sync_url = NeteUrl.from_string('http+ssh://{}@{}:{}'.format(
+        'nete', HOST, proxy_port))
+
+    # the SSH client reads the host key from ~/.ssh/known_hosts
+    ssh_dir = os.path.join(tmp_dir, '.ssh')
+    os.makedirs(ssh_dir, exist_ok=True)
+    with open(os.path.join(ssh_dir, 'known_hosts'), 'w') as fp:
+        fp.write('[{}]:{} {}\n'.format(
+            HOST, proxy_port,
+            host_key.export_public_key().decode('ascii').strip()))
+
+    with tempfile.TemporaryDirectory(dir='.') as base_dir, \
+            unittest.mock.patch.dict(os.environ, {'HOME': tmp_dir}), \
+            open_storage(base_dir) as storage:
+        try:
+            with Timer() as timer:
+                await Synchronizer(storage, sync_url).synchronize()
+        finally:
+            await client_pool.close()
+            await close_ssh_tunnels()
+
+    ssh_server.close()
+    await ssh_server.wait_closed()
+    await proxy.stop()
+    await runner.cleanup()
+    return timer.duration, proxy.bytes_received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--notes', type=int, default=500)
+    parser.add_argument('--text-size', type=int, default=4000)
+    parser.add_argument('--bandwidth', type=int, default=1024,
+                        help='bandwidth of the link in KiB/s')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    with tempfile.TemporaryDirectory(dir='.') as remote_dir, \
+            open_storage(remote_dir) as remote_storage:
+        for _ in range(args.notes):
+            loop.run_until_complete(remote_storage.write(
+                make_note(text=random_text(args.text_size))))
+
+        print('{:12} {:>10} {:>12}'.format(
+            'compression', 'seconds', 'KiB received'))
+        for compress in (False, True):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                duration, bytes_received = loop.run_until_complete(
+                    run(remote_storage, args, compress, tmp_dir))
+            print('{:12} {:10.2f} {:12.0f}'.format(
+                'on' if compress else 'off', duration,
+                bytes_received / 1024))
+
+
+if __name__ == '__main__':
+    main()
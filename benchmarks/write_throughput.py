@@ -0,0 +1,47 @@
+#! /usr/bin/env python3
+"""Measure FilesystemStorage write throughput for every fsync mode.
+
+A number of concurrent writers (like the note pulls of a sync) each
+write small notes as fast as they can.
+"""
+from _common import Timer, make_note, open_storage
+from nete.backend.storage.filesystem import FilesystemStorage
+import argparse
+import asyncio
+import tempfile
+
+
+async def writer(storage, count, text_size):
+    for _ in range(count):
+        await storage.write(make_note(text_size))
+
+
+async def run(storage, args):
+    with Timer() as timer:
+        await asyncio.gather(*[
+            writer(storage, args.notes // args.writers, args.text_size)
+            for _ in range(args.writers)])
+    return timer.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--text-size', type=int, default=1000)
+    parser.add_argument('--max-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{:8} {:>10}'.format('fsync', 'writes/s'))
+    for fsync in FilesystemStorage.FSYNC_MODES:
+        # the current directory rather than /tmp, which may be a tmpfs
+        with tempfile.TemporaryDirectory(dir='.') as base_dir, \
+                open_storage(base_dir, max_workers=args.max_workers,
+                             fsync=fsync) as storage:
+            loop = asyncio.get_event_loop()
+            duration = loop.run_until_complete(run(storage, args))
+        print('{:8} {:10.0f}'.format(fsync, args.notes / duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+"""Convert the notes of a filesystem storage into the header-first format.
+
+Usage: migrate_format.py BASE_DIR
+
+nete-backend reads notes in both formats and writes the new one, so this
+is optional. Stop nete-backend before running it.
+"""
+from nete.backend.storage.filesystem.note_file import (
+    read_note_file, write_note_file)
+import glob
+import json
+import os
+import os.path
+import sys
+
+
+def migrate(base_dir):
+    filenames = (
+        glob.glob(os.path.join(base_dir, '*.nete')) +
+        glob.glob(os.path.join(base_dir, '*', '*', '*.nete')))
+    for filename in filenames:
+        with open(filename, 'rb') as fp:
+            # in the former format, the first line is the whole note
+            is_former_format = 'text' in json.loads(fp.readline().decode())
+        if is_former_format:
+            migrate_note(filename)
+
+
+def migrate_note(filename):
+    print('Migrating {} ...'.format(filename))
+
+    with open(filename, 'rb') as fp:
+        note = read_note_file(fp)
+
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'wb') as fp:
+        write_note_file(fp, note)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_filename, filename)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    migrate(sys.argv[1])
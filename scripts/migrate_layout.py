@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+"""Move the notes of a filesystem storage into another directory layout.
+
+Usage: migrate_layout.py BASE_DIR flat|sharded
+
+Every note is moved with a single rename, and nete-backend finds notes in
+the place of either layout, so this can run while the backend is using
+the storage. Afterwards, set the storage's layout option to the new
+layout.
+"""
+import glob
+import os
+import os.path
+import sys
+
+LAYOUTS = ('flat', 'sharded')
+
+
+def migrate(base_dir, layout):
+    filenames = (
+        glob.glob(os.path.join(base_dir, '*.nete')) +
+        glob.glob(os.path.join(base_dir, '*', '*', '*.nete')))
+    for filename in filenames:
+        new_filename = layout_filename(
+            base_dir, os.path.basename(filename), layout)
+        if filename != new_filename:
+            move_note(filename, new_filename)
+
+    if layout == 'flat':
+        remove_empty_shard_dirs(base_dir)
+
+
+def layout_filename(base_dir, basename, layout):
+    if layout == 'sharded':
+        return os.path.join(base_dir, basename[0:2], basename[2:4], basename)
+    return os.path.join(base_dir, basename)
+
+
+def move_note(filename, new_filename):
+    print('Moving {} to {} ...'.format(filename, new_filename))
+    os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+    if os.path.exists(new_filename):
+        # written there by the backend in the meantime, which removes the
+        # older copy itself
+        return
+    try:
+        os.rename(filename, new_filename)
+    except FileNotFoundError:
+        # changed or removed by the backend in the meantime
+        pass
+
+
+def remove_empty_shard_dirs(base_dir):
+    for pattern in (('*', '*'), ('*',)):
+        for dirname in glob.glob(os.path.join(base_dir, *pattern, '')):
+            try:
+                os.rmdir(dirname)
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[2] not in LAYOUTS:
+        print(__doc__)
+        sys.exit(1)
+
+    migrate(sys.argv[1], sys.argv[2])
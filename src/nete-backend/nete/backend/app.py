@@ -1,18 +1,37 @@
 from aiohttp import web
+from .connection_method import close_ssh_tunnels
 from .handler import Handler
+from .nete_client import client_pool
+from .sync import Synchronizer
+from .sync_scheduler import SyncScheduler
 from .middleware import (add_server_header, storage_exceptions_middleware,
-                         error_middleware)
+                         error_middleware, compression_middleware)
+import asyncio
 
 
-def create_app(storage, sync_url=None):
+def create_app(storage, sync_url=None, compress=True, sync_concurrency=4,
+               sync_interval=None, sync_debounce=None):
+    middlewares = [add_server_header]
+    if compress:
+        middlewares.append(compression_middleware)
     app = web.Application(
-        middlewares=[
-            add_server_header,
+        middlewares=middlewares + [
             storage_exceptions_middleware,
             error_middleware,
         ])
-    handler = Handler(storage, sync_url)
+    # requests and syncs check and write notes under the same lock
+    write_lock = asyncio.Lock()
+    sync_scheduler = None
+    if sync_url:
+        sync_scheduler = SyncScheduler(
+            Synchronizer(storage, sync_url, sync_concurrency, write_lock),
+            interval=sync_interval,
+            debounce=sync_debounce)
+        app.on_startup.append(lambda app: start_sync_scheduler(sync_scheduler))
+        app.on_cleanup.append(lambda app: sync_scheduler.stop())
+    handler = Handler(storage, sync_scheduler, compress, write_lock)
     setup_routes(app, handler)
+    app.on_cleanup.append(close_connections)
 
     return app
 
@@ -20,7 +39,21 @@ def create_app(storage, sync_url=None):
 def setup_routes(app, handler):
     app.router.add_get('/notes', handler.index)
     app.router.add_post('/notes', handler.create_note)
+    app.router.add_post('/notes/_batch_get', handler.batch_get)
+    app.router.add_post('/notes/_bulk', handler.bulk)
     app.router.add_get('/notes/sync', handler.synchronize)
+    app.router.add_get('/notes/changes', handler.changes)
+    app.router.add_get('/notes/digest', handler.digest)
+    app.router.add_get('/notes/revisions', handler.revisions)
     app.router.add_get('/notes/{note_id}', handler.get_note, name='note')
     app.router.add_put('/notes/{note_id}', handler.update_note)
     app.router.add_delete('/notes/{note_id}', handler.delete_note)
+
+
+async def start_sync_scheduler(sync_scheduler):
+    sync_scheduler.start()
+
+
+async def close_connections(app):
+    await client_pool.close()
+    await close_ssh_tunnels()
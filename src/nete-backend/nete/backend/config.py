@@ -32,11 +32,23 @@ defaults = {
     'logfile': None,
     'storage.type': 'filesystem',
     'storage.base_dir': DEFAULT_STORAGE_BASE_DIR,
+    'storage.max_workers': 4,
+    'storage.fsync': 'group',
+    'storage.layout': 'flat',
+    'storage.history_size': 2,
     'sync.url': None,
+    'sync.concurrency': 4,
+    'sync.interval': None,
+    'sync.debounce': None,
 }
 
 types = {
+    'storage.max_workers': int,
+    'storage.history_size': int,
     'sync.url': NeteUrl.from_string,
+    'sync.concurrency': int,
+    'sync.interval': float,
+    'sync.debounce': float,
 }
 
 
@@ -110,6 +122,71 @@ def build_parser():
         '-D', '--debug',
         action='store_true',
         help='enable debug logging')
+    # options given on the command line take precedence over the config
+    # file; their dest is the name of the config option
+    parser.add_argument(
+        '-S', '--api-socket',
+        dest='api.socket',
+        metavar='FILENAME',
+        help='Unix domain socket to bind to [{}]'.format(
+            DEFAULT_SOCKET_FILENAME))
+    parser.add_argument(
+        '--storage-type',
+        dest='storage.type',
+        choices=('filesystem', 'log', 'sqlite'),
+        help='storage type [{}]'.format(defaults['storage.type']))
+    parser.add_argument(
+        '--storage-base-dir',
+        dest='storage.base_dir',
+        metavar='DIR',
+        help='directory where to store notes [{}]'.format(
+            DEFAULT_STORAGE_BASE_DIR))
+    parser.add_argument(
+        '--storage-max-workers',
+        dest='storage.max_workers',
+        metavar='NUMBER',
+        help='number of threads used for storage I/O [{}]'.format(
+            defaults['storage.max_workers']))
+    parser.add_argument(
+        '--storage-fsync',
+        dest='storage.fsync',
+        choices=('always', 'group', 'never'),
+        help='how writes are made durable [{}]'.format(
+            defaults['storage.fsync']))
+    parser.add_argument(
+        '--storage-layout',
+        dest='storage.layout',
+        choices=('flat', 'sharded'),
+        help='directory layout of the filesystem storage [{}]'.format(
+            defaults['storage.layout']))
+    parser.add_argument(
+        '--storage-history-size',
+        dest='storage.history_size',
+        metavar='NUMBER',
+        help='number of old revisions kept of every note [{}]'.format(
+            defaults['storage.history_size']))
+    parser.add_argument(
+        '--sync-url',
+        dest='sync.url',
+        metavar='URL',
+        help='URL of remote nete instance to synchronize notes with')
+    parser.add_argument(
+        '--sync-concurrency',
+        dest='sync.concurrency',
+        metavar='NUMBER',
+        help='number of reads, requests and writes a sync runs at the '
+             'same time [{}]'.format(defaults['sync.concurrency']))
+    parser.add_argument(
+        '--sync-interval',
+        dest='sync.interval',
+        metavar='SECONDS',
+        help='synchronize in the background every SECONDS seconds')
+    parser.add_argument(
+        '--sync-debounce',
+        dest='sync.debounce',
+        metavar='SECONDS',
+        help='synchronize in the background SECONDS seconds after notes '
+             'were changed')
     parser.add_argument(
         '-V', '--version',
         action='version',
@@ -2,6 +2,7 @@ from nete.common.exceptions import SshError
 from nete.common.nete_url import NeteUrl
 from nete.common.xdg import XDG_RUNTIME_DIR
 import aiohttp
+import asyncio
 import asyncssh
 import logging
 import os.path
@@ -27,8 +28,8 @@ class TcpConnectionMethod(BaseConnectionMethod):
     def base_url(self):
         return self.url.base_url
 
-    def connector(self):
-        return aiohttp.TCPConnector()
+    def connector(self, **kwargs):
+        return aiohttp.TCPConnector(**kwargs)
 
 
 class SocketConnectionMethod(BaseConnectionMethod):
@@ -37,55 +38,133 @@ class SocketConnectionMethod(BaseConnectionMethod):
     def base_url(self):
         return 'http://aiohttp'
 
-    def connector(self):
-        return aiohttp.UnixConnector(self.url.socket_path)
+    def connector(self, **kwargs):
+        return aiohttp.UnixConnector(self.url.socket_path, **kwargs)
 
 
 class SshConnectionMethod(BaseConnectionMethod):
+    """Connects through the SSH tunnel to the URL's host, which is shared
+    with all other connections there and stays open after `stop()`."""
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.tempdir = tempfile.mkdtemp('nete-ssh', dir=XDG_RUNTIME_DIR)
-        self.local_socket = os.path.join(self.tempdir, 'ssh.socket')
+        self.tunnel = ssh_tunnel_for(self.url)
 
     @property
     def base_url(self):
         return 'http://aiohttp'
 
-    def connector(self):
-        return aiohttp.UnixConnector(self.local_socket)
+    def connector(self, **kwargs):
+        return aiohttp.UnixConnector(self.tunnel.local_socket, **kwargs)
 
     async def start(self):
+        await self.tunnel.open()
+
+
+class SshTunnel:
+    """A long-lived SSH connection forwarding a local socket to the socket
+    of the remote nete-backend.
+
+    `open()` reuses the connection as long as it's alive, so repeated syncs
+    don't need a new SSH handshake, and reconnects once it has dropped.
+    Keepalive messages make sure a dead connection is noticed. The remote
+    socket path is looked up once per connection.
+    """
+
+    KEEPALIVE_INTERVAL = 30
+    KEEPALIVE_COUNT_MAX = 3
+
+    def __init__(self, url):
+        self.url = url
+        self.tempdir = tempfile.mkdtemp('nete-ssh', dir=XDG_RUNTIME_DIR)
+        self.local_socket = os.path.join(self.tempdir, 'ssh.socket')
+        self.ssh_conn = None
+        self.closed = None
+        self.remote_socket = None
+        self.lock = None
+
+    @property
+    def is_open(self):
+        return self.closed is not None and not self.closed.done()
+
+    async def open(self):
+        # created on first use, in the event loop running the syncs
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.is_open:
+                return
+            if self.ssh_conn is not None:
+                logger.info('SSH connection to {} has been closed, '
+                            'reconnecting'.format(self.url.ssh_host))
+                self._remove_local_socket()
+            await self._connect()
+
+    async def close(self):
+        if self.ssh_conn is not None:
+            logger.info('Closing SSH connection to {}'.format(
+                self.url.ssh_host))
+            self.ssh_conn.close()
+            await self.closed
+            self.ssh_conn = None
+            self.closed = None
+        self._remove_local_socket()
+        os.rmdir(self.tempdir)
+
+    async def _connect(self):
         logger.info('Opening SSH connection {}@{}:{}'.format(
             self.url.username, self.url.ssh_host, self.url.ssh_port))
         self.ssh_conn = await asyncssh.connect(
             self.url.ssh_host,
             self.url.ssh_port,
-            username=self.url.username)
-        remote_socket = await self._get_remote_socket()
-
-        await self.ssh_conn.forward_local_path(
-            self.local_socket, remote_socket)
-
-    async def stop(self):
-        logger.info('Closing SSH connection')
-
-        self.ssh_conn.close()
-        os.remove(self.local_socket)
-        os.removedirs(self.tempdir)
+            username=self.url.username,
+            keepalive_interval=self.KEEPALIVE_INTERVAL,
+            keepalive_count_max=self.KEEPALIVE_COUNT_MAX)
+        self.closed = asyncio.ensure_future(self.ssh_conn.wait_closed())
+        try:
+            self.remote_socket = await self._get_remote_socket()
+            await self.ssh_conn.forward_local_path(
+                self.local_socket, self.remote_socket)
+        except BaseException:
+            self.ssh_conn.close()
+            raise
+
+    def _remove_local_socket(self):
+        try:
+            os.remove(self.local_socket)
+        except FileNotFoundError:
+            pass
 
     async def _get_remote_socket(self):
         try:
             result = await self.ssh_conn.run(
                 command='nete socket', check=True)
-            remote_socket = result.stdout.strip()
-            logger.debug('remote socket is »{}«'.format(
-                remote_socket))
-            return remote_socket
-        except asyncssh.ProcessError:
+        except asyncssh.ProcessError as e:
             message = (
                 'Could not find out socket path on '
                 'remote side '
                 '(output of »nete socket« was: {}'.format(
-                    result.stdout))
+                    e.stdout))
             raise SshError(message)
+
+        remote_socket = result.stdout.strip()
+        logger.debug('remote socket is »{}«'.format(
+            remote_socket))
+        return remote_socket
+
+
+# the SSH tunnels to every host, by user name, host and port
+ssh_tunnels = {}
+
+
+def ssh_tunnel_for(url):
+    key = (url.username, url.ssh_host, url.ssh_port)
+    if key not in ssh_tunnels:
+        ssh_tunnels[key] = SshTunnel(url)
+    return ssh_tunnels[key]
+
+
+async def close_ssh_tunnels():
+    for tunnel in ssh_tunnels.values():
+        await tunnel.close()
+    ssh_tunnels.clear()
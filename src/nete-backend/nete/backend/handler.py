@@ -1,7 +1,17 @@
 from nete.backend.storage.exceptions import NotFound
-from nete.backend.sync import Synchronizer
+from nete.backend.storage.revision_digest import is_prefix
+from nete.backend.storage.sorted_index import (
+    decode_cursor, encode_cursor, parse_sort, sort_key)
+from nete.common.schemas.note_codec import (
+    HEADER_FIELDS, dumps_note, iter_dumps_notes, note_to_dict)
 from nete.common.schemas.note_schema import NoteSchema
+from nete.common.schemas.registry import get_schema
+from nete.common.text_delta import apply_delta, make_delta
 from aiohttp import web
+from marshmallow.exceptions import ValidationError
+import asyncio
+import hashlib
+import json
 import logging
 import uuid
 
@@ -9,24 +19,150 @@ logger = logging.getLogger(__name__)
 
 IMMUTABLE_FIELDS = ('id', 'created_at',)
 
+# the maximum number of notes that can be requested or changed in a batch
+MAX_BATCH_SIZE = 1000
+# notes are read concurrently and sent in groups of this size
+BATCH_READ_SIZE = 50
+
 
 class Handler:
-    def __init__(self, storage, sync_url=None):
+    def __init__(self, storage, sync_scheduler=None, compress=True,
+                 write_lock=None):
         self.storage = storage
-        self.sync_url = sync_url
-        self.note_schema = NoteSchema()
-        self.note_index_schema = NoteSchema(exclude=['text'])
+        self.sync_scheduler = sync_scheduler
+        self.compress = compress
+        # held while preconditions of writes are checked and the notes
+        # written, so concurrent requests cannot pass the same If-Match;
+        # shared with the synchronizer, which writes the same storage
+        self.write_lock = write_lock or asyncio.Lock()
+        self.note_schema = get_schema(NoteSchema)
 
     async def index(self, request):
-        notes = await self.storage.list()
-        body = self.note_index_schema.dumps(notes, many=True)
-        return web.Response(
-            status=200,
-            content_type='application/json',
-            body=body)
+        etag = await self._index_etag(request)
+        if _matches_if_none_match(request, etag):
+            return self._not_modified(etag)
+
+        query = request.query
+        headers = self._etag_headers(etag)
+        if not {'sort', 'cursor', 'limit'} & query.keys():
+            notes = await self.storage.list()
+        else:
+            try:
+                sort, reverse = parse_sort(query.get('sort', 'id'))
+                limit = _parse_limit(query.get('limit'))
+                after = (decode_cursor(query['cursor'], sort)
+                         if 'cursor' in query else None)
+            except ValueError as e:
+                raise web.HTTPBadRequest(reason=str(e))
+
+            # fetch one more note to find out whether there's a next page
+            notes = await self.storage.list(
+                sort=sort,
+                reverse=reverse,
+                after=after,
+                limit=None if limit is None else limit + 1)
+            if limit is not None and len(notes) > limit:
+                notes = notes[:limit]
+                cursor = encode_cursor(sort, sort_key(notes[-1], sort))
+                headers['link'] = '<{}>; rel="next"'.format(
+                    request.rel_url.update_query(cursor=cursor))
+
+        response = web.StreamResponse(status=200, headers=headers)
+        response.content_type = 'application/json'
+        response.enable_chunked_encoding()
+        if self.compress:
+            response.enable_compression()
+        await response.prepare(request)
+        for chunk in iter_dumps_notes(notes, HEADER_FIELDS):
+            await response.write(chunk.encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    async def changes(self, request):
+        """Returns the changes following the sequence number `since`,
+        oldest first, and the sequence number to continue from.
+
+        If `epoch` is given and the storage's sequence has been restarted
+        since, the changes cannot be followed and 410 Gone is returned.
+        """
+        query = request.query
+        try:
+            since = int(query.get('since', 0))
+            limit = _parse_limit(query.get('limit'))
+        except ValueError as e:
+            raise web.HTTPBadRequest(reason=str(e))
+
+        epoch, seq = await self.storage.change_sequence()
+        if 'epoch' in query and query['epoch'] != epoch:
+            raise web.HTTPGone(reason='Change sequence has been restarted')
+
+        changes = await self.storage.changes(
+            since, None if limit is None else limit + 1)
+        headers = {}
+        if limit is not None and len(changes) > limit:
+            changes = changes[:limit]
+            seq = changes[-1].seq
+            headers['link'] = '<{}>; rel="next"'.format(
+                request.rel_url.update_query(since=seq))
+        elif changes:
+            seq = max(seq, changes[-1].seq)
+
+        return web.json_response(
+            {
+                'epoch': epoch,
+                'seq': seq,
+                'changes': [
+                    {
+                        'seq': change.seq,
+                        'id': change.note_id,
+                        'note': (None if change.note is None
+                                 else note_to_dict(change.note,
+                                                   HEADER_FIELDS)),
+                    }
+                    for change in changes
+                ],
+            },
+            headers=headers)
+
+    async def digest(self, request):
+        """Returns the revision digest of all notes and the digests of the
+        buckets one level below the buckets given by `prefix` (which may
+        be repeated), along with the current change sequence."""
+        prefixes = _parse_prefixes(request.query)
+        epoch, seq = await self.storage.change_sequence()
+        tree = await self.storage.revision_tree()
+        return web.json_response({
+            'epoch': epoch,
+            'seq': seq,
+            'digest': tree.hexdigest(),
+            'buckets': {
+                prefix: {'digest': digest, 'count': count}
+                for prefix, (digest, count) in tree.children(prefixes).items()
+            },
+        })
+
+    async def revisions(self, request):
+        """Returns the revision ids of the notes in the buckets given by
+        `prefix` (which may be repeated)."""
+        prefixes = _parse_prefixes(request.query)
+        tree = await self.storage.revision_tree()
+        return web.json_response({
+            'revisions': {
+                str(note_id): str(revision_id)
+                for note_id, revision_id in tree.revisions(prefixes).items()
+            },
+        })
 
     async def get_note(self, request):
         note_id = request.match_info['note_id']
+        if 'if-none-match' in request.headers:
+            # the revision is looked up in the index first, so a 304
+            # response doesn't need to read the note
+            revision_id = await self._indexed_revision(note_id)
+            if (revision_id is not None and
+                    _matches_if_none_match(request, _etag(revision_id))):
+                return self._not_modified(_etag(revision_id))
+
         try:
             note = await self.storage.read(note_id)
         except NotFound:
@@ -35,16 +171,105 @@ class Handler:
         return web.Response(
             status=200,
             content_type='application/json',
-            headers={
-                'etag': str(note.revision_id),
-            },
-            body=self.note_schema.dumps(note))
+            headers=self._etag_headers(_etag(note.revision_id)),
+            body=self.note_schema.dumps(note).encode('utf-8'))
+
+    async def _indexed_revision(self, note_id):
+        try:
+            note_id = uuid.UUID(note_id)
+        except ValueError:
+            return None
+        tree = await self.storage.revision_tree()
+        return tree.revision(note_id)
+
+    async def batch_get(self, request):
+        """Streams the notes whose ids are given as `{"ids": [...]}` in
+        the request body. Notes that don't exist are left out.
+
+        If the request body has `"bases": {NOTE_ID: REVISION_ID, ...}` with
+        revisions the client has, notes may be sent as a delta against them
+        instead, with `delta` and `base_revision_id` instead of `text`.
+        """
+        note_ids, bases = _parse_note_ids(await request.text())
+
+        response = web.StreamResponse(status=200)
+        response.content_type = 'application/json'
+        response.enable_chunked_encoding()
+        if self.compress:
+            response.enable_compression()
+        await response.prepare(request)
+
+        separator = '['
+        for start in range(0, len(note_ids), BATCH_READ_SIZE):
+            notes = await asyncio.gather(*[
+                self._dumps_note_or_none(note_id, bases.get(note_id))
+                for note_id in note_ids[start:start + BATCH_READ_SIZE]])
+            notes = [note for note in notes if note is not None]
+            if notes:
+                await response.write('{}{}'.format(
+                    separator,
+                    ','.join(notes),
+                ).encode('utf-8'))
+                separator = ','
+        await response.write(b'[]' if separator == '[' else b']')
+        await response.write_eof()
+        return response
+
+    async def _dumps_note_or_none(self, note_id, base_revision_id=None):
+        """Returns the note with `note_id` as JSON, as a delta against its
+        revision `base_revision_id` if that's still known and smaller."""
+        note = await self._read_or_none(note_id)
+        if note is None:
+            return None
+        if (base_revision_id is not None and
+                base_revision_id != note.revision_id):
+            try:
+                base_note = await self.storage.read_revision(
+                    note_id, base_revision_id)
+            except NotFound:
+                base_note = None
+            if base_note is not None:
+                delta = await asyncio.get_event_loop().run_in_executor(
+                    None, make_delta, base_note.text, note.text)
+                if delta is not None:
+                    return json.dumps(dict(
+                        note_to_dict(note, HEADER_FIELDS),
+                        base_revision_id=str(base_revision_id),
+                        delta=delta))
+        return dumps_note(note)
+
+    async def _read_or_none(self, note_id):
+        try:
+            return await self.storage.read(note_id)
+        except NotFound:
+            return None
+
+    async def _index_etag(self, request):
+        digest = await self.storage.revision_digest()
+        query_string = request.rel_url.query_string
+        if not query_string:
+            return _etag(digest)
+        # pages and orderings of the same notes are different resources
+        return _etag(hashlib.sha1('{}?{}'.format(digest, query_string).encode(
+            'utf-8')).hexdigest())
+
+    def _etag_headers(self, etag):
+        headers = {'etag': etag}
+        if self.compress:
+            # the same representation may be sent compressed or not
+            headers['vary'] = 'Accept-Encoding'
+        return headers
+
+    def _not_modified(self, etag):
+        return web.Response(status=304, headers=self._etag_headers(etag))
 
     async def create_note(self, request):
         note = self.note_schema.loads(
             await request.text())
 
-        await self.storage.write(note)
+        async with self.write_lock:
+            await self.storage.write(note)
+        self._notify_change()
         note_url = request.app.router['note'].url_for(note_id=str(note.id))
         return web.Response(
             status=201,
@@ -52,7 +277,7 @@ class Handler:
             headers={
                 'location': str(note_url)
             },
-            body=self.note_schema.dumps(note))
+            body=self.note_schema.dumps(note).encode('utf-8'))
 
     async def update_note(self, request):
         if 'if-match' not in request.headers:
@@ -65,12 +290,24 @@ class Handler:
             raise web.HTTPUnprocessableEntity(
                 reason='Ids from path and from JSON body don’t match')
 
-        old_note = await self.storage.read(note_id)
+        async with self.write_lock:
+            await self._check_update(note, request.headers['if-match'])
+            await self.storage.write(note)
+        self._notify_change()
+
+        return web.Response(
+            status=200,
+            content_type='application/json',
+            body=self.note_schema.dumps(note).encode('utf-8'))
+
+    async def _check_update(self, note, if_match):
+        """Raises an HTTPException unless `note` may replace the stored
+        note with the revision id `if_match`."""
+        old_note = await self._read_or_none(note.id)
+        if old_note is None:
+            raise web.HTTPNotFound()
 
-        if old_note.revision_id != uuid.UUID(request.headers.get('if-match')):
-            raise web.HTTPConflict(
-                reason='Edit conflict, resource has been changed '
-                'since last update')
+        _check_revision(old_note, if_match)
 
         if note.revision_id == old_note.revision_id:
             raise web.HTTPUnprocessableEntity(
@@ -86,25 +323,218 @@ class Handler:
                 reason=('Tried to update immutable attributes: {!r}'
                         .format(changed_immutable_attributes)))
 
-        await self.storage.write(note)
-
-        return web.Response(
-            status=200,
-            content_type='application/json',
-            body=self.note_schema.dumps(note))
-
     async def delete_note(self, request):
         note_id = request.match_info['note_id']
         try:
-            await self.storage.delete(note_id)
+            async with self.write_lock:
+                await self.storage.delete(note_id)
+            self._notify_change()
             return web.Response(status=204)
         except NotFound:
             return web.HTTPNotFound()
 
+    async def bulk(self, request):
+        """Applies the operations given as `{"operations": [...]}` in the
+        request body and returns a result for each of them.
+
+        Operations are `{"op": "create", "note": {...}}`,
+        `{"op": "update", "note": {...}, "if_match": REVISION_ID}` and
+        `{"op": "delete", "id": NOTE_ID}` with an optional `if_match`.
+        Instead of the note's text, an update may have a `delta` against
+        the revision `if_match`.
+        All operations whose preconditions hold are written to storage
+        together. Every result has the status code the single request
+        would have had, and a reason if the operation failed.
+        """
+        operations = _parse_operations(await request.text())
+
+        results = []
+        notes = []
+        deleted_ids = []
+        seen_ids = set()
+        async with self.write_lock:
+            for operation in operations:
+                try:
+                    note_id, note, status = await self._check_operation(
+                        operation)
+                    if note_id in seen_ids:
+                        raise web.HTTPUnprocessableEntity(
+                            reason='Note is changed more than once')
+                except web.HTTPException as e:
+                    results.append({'status': e.status, 'reason': e.reason})
+                    continue
+
+                seen_ids.add(note_id)
+                if note is None:
+                    deleted_ids.append(note_id)
+                else:
+                    notes.append(note)
+                results.append({'id': str(note_id), 'status': status})
+
+            await self.storage.write_many(notes, deleted_ids)
+        if notes or deleted_ids:
+            self._notify_change()
+
+        return web.json_response({'results': results})
+
+    async def _check_operation(self, operation):
+        """Returns the id of the note changed by a bulk operation, the
+        note to write (None for deletions) and the status code, or raises
+        an HTTPException if the operation cannot be applied."""
+        op = operation.get('op')
+        if op == 'create':
+            note = self._load_note(operation.get('note'))
+            return note.id, note, 201
+        elif op == 'update':
+            if 'if_match' not in operation:
+                raise web.HTTPBadRequest(reason='if_match is missing')
+            if 'delta' in operation:
+                note = await self._load_delta(
+                    operation.get('note'), operation['delta'],
+                    operation['if_match'])
+            else:
+                note = self._load_note(operation.get('note'))
+            await self._check_update(note, operation['if_match'])
+            return note.id, note, 200
+        elif op == 'delete':
+            try:
+                note_id = uuid.UUID(operation.get('id'))
+            except (TypeError, ValueError):
+                raise web.HTTPBadRequest(reason='Invalid note id')
+            old_note = await self._read_or_none(note_id)
+            if old_note is None:
+                raise web.HTTPNotFound()
+            if 'if_match' in operation:
+                _check_revision(old_note, operation['if_match'])
+            return note_id, None, 204
+
+        raise web.HTTPBadRequest(reason='Unknown operation {!r}'.format(op))
+
+    async def _load_delta(self, data, delta, if_match):
+        """Returns the note given as `data` without its text, with the text
+        made from `delta` and the stored note's revision `if_match`."""
+        try:
+            note_id = uuid.UUID(data['id'])
+        except (KeyError, TypeError, ValueError):
+            raise web.HTTPUnprocessableEntity(reason='Invalid note id')
+        old_note = await self._read_or_none(note_id)
+        if old_note is None:
+            raise web.HTTPNotFound()
+        _check_revision(old_note, if_match)
+
+        try:
+            text = apply_delta(old_note.text, delta)
+        except ValueError as e:
+            raise web.HTTPUnprocessableEntity(
+                reason='Invalid delta: {}'.format(e))
+        return self._load_note(dict(data, text=text))
+
+    def _load_note(self, data):
+        try:
+            return self.note_schema.load(data)
+        except ValidationError as e:
+            raise web.HTTPUnprocessableEntity(reason=str(e))
+
     async def synchronize(self, request):
-        if not self.sync_url:
+        if self.sync_scheduler is None:
             raise web.HTTPInternalServerError(text='No sync URL defined')
 
-        synchronizer = Synchronizer(self.storage, self.sync_url)
-        await synchronizer.synchronize()
+        await self.sync_scheduler.sync()
         return web.Response(status=204)
+
+    def _notify_change(self):
+        if self.sync_scheduler is not None:
+            self.sync_scheduler.notify_change()
+
+
+def _parse_limit(value):
+    if value is None:
+        return None
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return limit
+
+
+def _parse_prefixes(query):
+    prefixes = query.getall('prefix', [''])
+    if not all(is_prefix(prefix) for prefix in prefixes):
+        raise web.HTTPBadRequest(reason='Invalid prefix')
+    if len(prefixes) > MAX_BATCH_SIZE:
+        raise web.HTTPBadRequest(
+            reason='Cannot get more than {} buckets at once'.format(
+                MAX_BATCH_SIZE))
+    return prefixes
+
+
+def _parse_note_ids(body):
+    """Returns the note ids and the base revisions by note id."""
+    try:
+        data = json.loads(body)
+        note_ids = data['ids']
+        if not isinstance(note_ids, list):
+            raise ValueError('ids must be a list')
+        note_ids = [uuid.UUID(note_id) for note_id in note_ids]
+        bases = {
+            uuid.UUID(note_id): uuid.UUID(revision_id)
+            for note_id, revision_id in data.get('bases', {}).items()
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(reason='Invalid note ids: {}'.format(e))
+    if len(note_ids) > MAX_BATCH_SIZE:
+        raise web.HTTPBadRequest(
+            reason='Cannot get more than {} notes at once'.format(
+                MAX_BATCH_SIZE))
+    return note_ids, bases
+
+
+def _parse_operations(body):
+    try:
+        operations = json.loads(body)['operations']
+    except (KeyError, TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(reason='Invalid operations: {}'.format(e))
+    if (not isinstance(operations, list) or
+            not all(isinstance(operation, dict) for operation in operations)):
+        raise web.HTTPBadRequest(reason='Operations must be a list of objects')
+    if len(operations) > MAX_BATCH_SIZE:
+        raise web.HTTPBadRequest(
+            reason='Cannot apply more than {} operations at once'.format(
+                MAX_BATCH_SIZE))
+    return operations
+
+
+def _check_revision(old_note, if_match):
+    try:
+        revision_id = uuid.UUID(if_match)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='Invalid revision id')
+    if old_note.revision_id != revision_id:
+        raise web.HTTPConflict(
+            reason='Edit conflict, resource has been changed '
+            'since last update')
+
+
+def _etag(value):
+    """Returns a weak entity tag for `value`, as the representation is
+    the same whether it is sent compressed or not, but not the bytes."""
+    return 'W/"{}"'.format(value)
+
+
+def _opaque_tag(etag):
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def _matches_if_none_match(request, etag):
+    """Compares the entity tags in If-None-Match weakly with `etag`, as
+    RFC 7232 requires."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is None:
+        return False
+
+    for value in if_none_match.split(','):
+        value = value.strip()
+        if value == '*' or _opaque_tag(value) == _opaque_tag(etag):
+            return True
+    return False
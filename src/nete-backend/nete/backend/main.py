@@ -1,7 +1,10 @@
 from .app import create_app
 from .config import config
 from .storage.filesystem import FilesystemStorage
+from .storage.log import LogStorage
+from .storage.sqlite import SqliteStorage
 from aiohttp import web
+import inspect
 import logging
 import os
 import os.path
@@ -15,6 +18,8 @@ logger = logging.getLogger(__name__)
 
 STORAGES = {
     'filesystem': FilesystemStorage,
+    'log': LogStorage,
+    'sqlite': SqliteStorage,
 }
 
 
@@ -28,7 +33,10 @@ def main():
     storage = build_storage()
     storage.open()
 
-    app = create_app(storage, config['sync.url'])
+    app = create_app(storage, config['sync.url'],
+                     sync_concurrency=config['sync.concurrency'],
+                     sync_interval=config['sync.interval'],
+                     sync_debounce=config['sync.debounce'])
 
     if config['debug'] and aioreloader:
         aioreloader.start(hook=storage.close)
@@ -61,8 +69,13 @@ def print_config():
 
 def build_storage():
     kwargs = config.attributes('storage')
-    storage_type = kwargs.pop('type')
-    return STORAGES[storage_type](**kwargs)
+    storage_class = STORAGES[kwargs.pop('type')]
+    parameters = inspect.signature(storage_class).parameters
+    return storage_class(**{
+        key: value
+        for key, value in kwargs.items()
+        if key in parameters
+    })
 
 
 def create_missing_dirs():
@@ -5,8 +5,16 @@ import json
 import logging
 import traceback
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 logger = logging.getLogger(__name__)
 
+# smaller responses aren't worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
 
 @web.middleware
 async def add_server_header(request, handler):
@@ -35,3 +43,42 @@ async def error_middleware(request, handler):
         logger.error(e)
         logger.error(traceback.format_exc())
         raise web.HTTPBadRequest(body=str(e))
+
+
+@web.middleware
+async def compression_middleware(request, handler):
+    """Compresses responses with a body of at least COMPRESSION_MIN_SIZE
+    bytes if the client accepts it.
+
+    Brotli is used if available and accepted, otherwise aiohttp negotiates
+    gzip or deflate. Streamed responses are already sent by the handler,
+    which needs to enable compression itself.
+    """
+    response = await handler(request)
+    if (not isinstance(response, web.Response) or response.prepared or
+            'content-encoding' in response.headers):
+        return response
+
+    body = response.body
+    size = (len(body) if isinstance(body, bytes)
+            else getattr(body, 'size', None))
+    if size is None or size < COMPRESSION_MIN_SIZE:
+        return response
+
+    if 'accept-encoding' not in response.headers.get('vary', '').lower():
+        response.headers.add('vary', 'Accept-Encoding')
+    if (brotli is not None and isinstance(body, bytes) and
+            _accepts_encoding(request, 'br')):
+        response.body = brotli.compress(body)
+        response.headers['content-encoding'] = 'br'
+    else:
+        response.enable_compression()
+    return response
+
+
+def _accepts_encoding(request, encoding):
+    for value in request.headers.get('accept-encoding', '').split(','):
+        coding, _, params = value.strip().partition(';')
+        if coding.strip().lower() == encoding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
@@ -1,17 +1,39 @@
 from .connection_method import (
     TcpConnectionMethod, SocketConnectionMethod, SshConnectionMethod)
 from nete.common.nete_url import ConnectionType
-from nete.common.exceptions import ServerError
+from nete.common.exceptions import SequenceRestarted, ServerError
+from nete.common.json_stream import JsonArrayDecoder
 from nete.common.schemas.note_schema import NoteSchema
 from nete.common.schemas.note_index_schema import NoteIndexSchema
-from urllib.parse import urljoin
+from nete.common.schemas.registry import get_schema
+from nete.common.text_delta import apply_delta
+from urllib.parse import urlencode, urljoin
 import aiohttp
+import asyncio
+import json
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
-note_index_schema = NoteIndexSchema()
-note_schema = NoteSchema()
+note_index_schema = get_schema(NoteIndexSchema)
+note_schema = get_schema(NoteSchema)
+
+LIST_PAGE_SIZE = 1000
+CHANGES_PAGE_SIZE = 1000
+BATCH_GET_SIZE = 500
+BULK_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+# request bodies of at least this size are sent compressed
+COMPRESSION_MIN_SIZE = 1024
+
+# connections kept open per remote, and how long idle ones are kept
+CONNECTION_LIMIT = 10
+KEEPALIVE_TIMEOUT = 60
+
+# the pages of the latest listing of every remote, by first page URL
+listing_cache = {}
 
 CONNECTION_TYPE_MAPPING = {
     ConnectionType.TCP: TcpConnectionMethod,
@@ -20,6 +42,38 @@ CONNECTION_TYPE_MAPPING = {
 }
 
 
+class ClientPool:
+    """Keeps a session with a pool of keep-alive connections per remote,
+    shared by all clients in the process, so syncs don't need to set up
+    new connections."""
+
+    def __init__(self):
+        # (event loop, session) by remote URL
+        self.sessions = {}
+
+    def session(self, remote_url, connection_method):
+        loop = asyncio.get_event_loop()
+        key = str(remote_url)
+        entry = self.sessions.get(key)
+        if entry is None or entry[0] is not loop or entry[1].closed:
+            session = aiohttp.ClientSession(
+                connector=connection_method.connector(
+                    limit=CONNECTION_LIMIT,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT))
+            self.sessions[key] = entry = (loop, session)
+        return entry[1]
+
+    async def close(self):
+        loop = asyncio.get_event_loop()
+        for session_loop, session in self.sessions.values():
+            if session_loop is loop:
+                await session.close()
+        self.sessions.clear()
+
+
+client_pool = ClientPool()
+
+
 class NeteClient:
 
     def __init__(self, remote_url):
@@ -31,58 +85,203 @@ class NeteClient:
 
     async def __aenter__(self):
         await self.connection_method.start()
-        self.session = aiohttp.ClientSession(
-            connector=self.connection_method.connector())
+        self.session = client_pool.session(
+            self.remote_url, self.connection_method)
         return self
 
     async def __aexit__(self, *args):
-        await self.session.close()
         await self.connection_method.stop()
 
     def build_url(self, path):
         return urljoin(self.connection_method.base_url, path)
 
     async def list_notes(self):
-        response = await self.session.get(self.build_url('/notes'))
-        text = await response.text()
-        return note_index_schema.loads(text, many=True)
-
-    async def create_note(self, note):
-        url = self.build_url('/notes')
-        data = note_schema.dumps(note)
-        response = await self.session.post(
-            url,
-            headers={
-                'content-type': 'application/json',
-            },
-            data=data)
-        if response.status >= 400:
-            raise ServerError(
-                'Error during sync (create {}):\n{}'.format(
-                    note.id, await response.text()))
-
-    async def update_note(self, note, old_revision_id):
-        url = self.build_url('/notes/{}'.format(note.id))
-        data = note_schema.dumps(note)
-        response = await self.session.put(
-            url,
-            headers={
-                'content-type': 'application/json',
-                'if-match': str(old_revision_id),
-            },
-            data=data)
-        if response.status >= 400:
-            raise ServerError(
-                'Error updating note ({}):\n{}'.format(
-                    note.id, await response.text()))
-
-    async def get_note(self, note_id):
-        url = self.build_url('/notes/{}'.format(str(note_id)))
-        response = await self.session.get(url)
-
-        if response.status >= 400:
-            raise ServerError(
-                'Error getting note ({}):\n{}'.format(
-                    note_id, await response.text()))
-
-        return note_schema.loads(await response.text())
+        """Returns all notes, fetching them page by page. Pages that
+        haven't changed since the last listing are taken from the cache.
+        """
+        notes = []
+        first_url = self.build_url('/notes?limit={}'.format(LIST_PAGE_SIZE))
+        cached_pages = listing_cache.get(first_url, {})
+        pages = {}
+        url = first_url
+        while url is not None:
+            cached_page = cached_pages.get(url)
+            headers = ({} if cached_page is None
+                       else {'if-none-match': cached_page['etag']})
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and cached_page is not None:
+                    page = cached_page
+                else:
+                    page = {
+                        'etag': response.headers.get('etag'),
+                        'notes': await self._read_notes(
+                            response, note_index_schema),
+                        'next_url': _next_url(response),
+                    }
+            if page['etag'] is not None:
+                pages[url] = page
+            notes.extend(page['notes'])
+            url = page['next_url']
+
+        listing_cache[first_url] = pages
+        return notes
+
+    async def changes(self, since=0, epoch=None):
+        """Returns the epoch and sequence number of the remote change feed
+        and the changes following `since`, as (note id, revision id)
+        tuples with a revision id of None for deleted notes.
+
+        Raises SequenceRestarted if `epoch` isn't the current epoch.
+        """
+        params = {'since': since, 'limit': CHANGES_PAGE_SIZE}
+        if epoch is not None:
+            params['epoch'] = epoch
+        url = self.build_url('/notes/changes?{}'.format(urlencode(params)))
+        changes = []
+        while url is not None:
+            async with self.session.get(url) as response:
+                if response.status == 410:
+                    raise SequenceRestarted(
+                        'Remote change sequence has been restarted')
+                if response.status >= 400:
+                    raise ServerError(
+                        'Error getting changes:\n{}'.format(
+                            await response.text()))
+
+                data = await response.json()
+                url = _next_url(response)
+            epoch, seq = data['epoch'], data['seq']
+            changes.extend(
+                (uuid.UUID(change['id']),
+                 None if change['note'] is None
+                 else uuid.UUID(change['note']['revision_id']))
+                for change in data['changes'])
+
+        return epoch, seq, changes
+
+    async def revision_buckets(self, prefixes):
+        """Returns the epoch and sequence number of the remote change feed,
+        its revision digest of all notes and the buckets one level below
+        the buckets with `prefixes`, as a dict mapping their prefixes to
+        (hex digest, number of notes) tuples."""
+        url = self.build_url('/notes/digest?{}'.format(
+            urlencode([('prefix', prefix) for prefix in prefixes])))
+        async with self.session.get(url) as response:
+            if response.status >= 400:
+                raise ServerError(
+                    'Error getting revision digest:\n{}'.format(
+                        await response.text()))
+
+            data = await response.json()
+        return data['epoch'], data['seq'], data['digest'], {
+            prefix: (bucket['digest'], bucket['count'])
+            for prefix, bucket in data['buckets'].items()
+        }
+
+    async def revisions(self, prefixes):
+        """Returns a dict mapping the ids of the remote notes in the buckets
+        with `prefixes` to their revision ids."""
+        url = self.build_url('/notes/revisions?{}'.format(
+            urlencode([('prefix', prefix) for prefix in prefixes])))
+        async with self.session.get(url) as response:
+            if response.status >= 400:
+                raise ServerError(
+                    'Error getting revisions:\n{}'.format(
+                        await response.text()))
+
+            data = await response.json()
+        return {
+            uuid.UUID(note_id): uuid.UUID(revision_id)
+            for note_id, revision_id in data['revisions'].items()
+        }
+
+    async def _read_notes(self, response, schema=note_schema,
+                          base_notes=None):
+        notes = []
+        decoder = JsonArrayDecoder()
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            items = decoder.feed(chunk)
+            if base_notes:
+                items = [_apply_delta(item, base_notes) for item in items]
+            notes.extend(schema.load(items, many=True))
+        decoder.close()
+        return notes
+
+    async def bulk(self, operations):
+        """Applies up to `BULK_SIZE` operations in a single request and
+        returns their results. Notes in operations are given as Note
+        objects."""
+        url = self.build_url('/notes/_bulk')
+        data = json.dumps({'operations': [
+            _encode_operation(operation) for operation in operations]})
+        async with self.session.post(
+                url,
+                headers={
+                    'content-type': 'application/json',
+                },
+                data=data,
+                compress=_compression_for(data)) as response:
+            if response.status >= 400:
+                raise ServerError(
+                    'Error during sync (bulk):\n{}'.format(
+                        await response.text()))
+
+            return (await response.json())['results']
+
+    async def get_notes(self, note_ids, base_notes=None):
+        """Returns the notes with the given ids, at most `BATCH_GET_SIZE`
+        of them. Notes that don't exist are left out.
+
+        `base_notes` maps note ids to older revisions of the notes, which
+        the remote may send deltas against instead of the full texts.
+        """
+        url = self.build_url('/notes/_batch_get')
+        data = {'ids': [str(note_id) for note_id in note_ids]}
+        if base_notes:
+            data['bases'] = {
+                str(note_id): str(note.revision_id)
+                for note_id, note in base_notes.items()
+            }
+        async with self.session.post(url, json=data) as response:
+            if response.status >= 400:
+                raise ServerError(
+                    'Error getting notes:\n{}'.format(await response.text()))
+
+            return await self._read_notes(response, note_schema, base_notes)
+
+
+def _next_url(response):
+    next_link = response.links.get('next')
+    return None if next_link is None else str(next_link['url'])
+
+
+def _encode_operation(operation):
+    if 'note' not in operation:
+        return operation
+    note = note_schema.dump(operation['note'])
+    if 'delta' in operation:
+        del note['text']
+    return dict(operation, note=note)
+
+
+def _apply_delta(data, base_notes):
+    if 'delta' not in data:
+        return data
+    base_note = base_notes.get(uuid.UUID(data['id']))
+    if (base_note is None or
+            str(base_note.revision_id) != data['base_revision_id']):
+        raise ServerError(
+            'Got delta against unknown revision of note {}'.format(
+                data['id']))
+    try:
+        text = apply_delta(base_note.text, data['delta'])
+    except ValueError as e:
+        raise ServerError('Got invalid delta for note {}: {}'.format(
+            data['id'], e))
+    data = dict(data, text=text)
+    del data['delta'], data['base_revision_id']
+    return data
+
+
+def _compression_for(data):
+    return 'gzip' if len(data) >= COMPRESSION_MIN_SIZE else None
@@ -0,0 +1,103 @@
+"""Feeds of changed notes.
+
+Every write and delete of a storage gets the next sequence number, and
+consumers ask for the changes following the last sequence number they've
+seen. Only the latest change of a note is kept; deleted notes are kept as
+changes without a note (tombstones).
+
+Sequence numbers are only comparable within an epoch. A storage starts a
+new epoch whenever it cannot continue its sequence, e.g. when its index
+had to be rebuilt, and consumers then have to start from scratch.
+"""
+import bisect
+import collections
+import os
+import uuid
+
+Change = collections.namedtuple('Change', ('seq', 'note_id', 'note'))
+
+
+def new_epoch():
+    return uuid.uuid4().hex
+
+
+def load_epoch(filename):
+    """Returns the epoch stored in `filename`, starting a new one if there
+    is none yet."""
+    try:
+        with open(filename) as fp:
+            epoch = fp.read().strip()
+        if epoch:
+            return epoch
+    except FileNotFoundError:
+        pass
+
+    epoch = new_epoch()
+    save_epoch(filename, epoch)
+    return epoch
+
+
+def save_epoch(filename, epoch):
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'w') as fp:
+        fp.write(epoch)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class ChangeFeed:
+    """Keeps the latest change of every note, ordered by sequence number."""
+
+    def __init__(self, epoch=None):
+        self.epoch = epoch or new_epoch()
+        self.seq = 0
+        self.changes = {}
+        self.order = []
+
+    def __len__(self):
+        return len(self.changes)
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def add(self, note_id, note, seq=None):
+        """Records that the note with `note_id` was changed to `note` (a
+        note header, or None if it was deleted) with sequence number `seq`,
+        by default the next one."""
+        if seq is None:
+            seq = self.next_seq()
+        else:
+            self.seq = max(self.seq, seq)
+
+        note_id = str(note_id)
+        old_change = self.changes.get(note_id)
+        if old_change is not None:
+            del self.order[bisect.bisect_left(
+                self.order, (old_change.seq, note_id))]
+        change = Change(seq, note_id, note)
+        self.changes[note_id] = change
+        bisect.insort(self.order, (seq, note_id))
+        return change
+
+    def add_many(self, changes):
+        """Records many `Change`s at once, e.g. when loading a saved feed.
+
+        The order is sorted once at the end instead of inserting every
+        change into it."""
+        for change in changes:
+            self.changes[change.note_id] = change
+            self.seq = max(self.seq, change.seq)
+        self.order = sorted(
+            (change.seq, note_id) for note_id, change in self.changes.items())
+
+    def since(self, seq=0, limit=None):
+        """Returns the changes with a sequence number greater than `seq`,
+        oldest first."""
+        start = bisect.bisect_left(self.order, (seq + 1,))
+        end = None if limit is None else start + limit
+        return [
+            self.changes[note_id]
+            for _, note_id in self.order[start:end]
+        ]
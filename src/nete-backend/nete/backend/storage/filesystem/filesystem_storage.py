@@ -1,13 +1,19 @@
-from .lockable import Lockable
-from nete.backend.schemas import StatusItemSchema
+from .note_file import read_note_file, read_note_header, write_note_file
+from .note_index import NoteIndex
+from nete.backend.storage.change_feed import new_epoch
 from nete.backend.storage.exceptions import NotFound
-from nete.common.schemas.note_schema import NoteSchema
+from nete.backend.storage.group_commit import GroupCommit
+from nete.backend.storage.lockable import Lockable
+from nete.backend.storage.status_file import (
+    StatusFile, read_sync_checkpoint, write_sync_checkpoint)
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import glob
 import logging
 import os
 import os.path
+import shutil
+import uuid
 
 
 logger = logging.getLogger(__name__)
@@ -16,83 +22,403 @@ logger = logging.getLogger(__name__)
 class FilesystemStorage(Lockable):
 
     STATUS_FILENAME = 'status.json'
+    SYNC_CHECKPOINT_FILENAME = 'sync_checkpoint.json'
+    INDEX_FILENAME = 'index.json'
+    HISTORY_DIRNAME = 'history'
+    FSYNC_MODES = ('always', 'group', 'never')
+    LAYOUTS = ('flat', 'sharded')
+
+    def __init__(self, base_dir, max_workers=None, fsync='group',
+                 layout='flat', history_size=2):
+        if fsync not in self.FSYNC_MODES:
+            raise ValueError('fsync must be one of {}, not {!r}'.format(
+                ', '.join(self.FSYNC_MODES), fsync))
+        if layout not in self.LAYOUTS:
+            raise ValueError('layout must be one of {}, not {!r}'.format(
+                ', '.join(self.LAYOUTS), layout))
 
-    def __init__(self, base_dir):
         self.base_dir = base_dir
         os.makedirs(self.base_dir, exist_ok=True)
-        self.executor = ThreadPoolExecutor()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.index = NoteIndex()
+        self.fsync = fsync
+        self.layout = layout
+        self.history_size = history_size
+        self.group_commit = GroupCommit(self._run, self._commit_files)
+        self.status_file = StatusFile(self._status_filename())
 
     def open(self):
         logger.info('Opening storage in directory {}'.format(self.base_dir))
         self.lock(os.path.join(self.base_dir, '.lock'))
+        self._remove_temporary_files()
+        self._build_index()
+        self.index.open_journal(self._index_filename())
 
     def close(self):
+        if self.is_locked():
+            self.index.save(self._index_filename())
+            self.index.close_journal()
         self.unlock()
 
     @Lockable.ensure_lock
-    async def list(self):
-        note_list = []
-        for filename in glob.glob(os.path.join(self.base_dir, '*.nete')):
-            note = await self._read_file(filename)
-            note_list.append(note)
+    async def list(self, sort=None, reverse=False, after=None, limit=None):
+        if sort is None and after is None and limit is None:
+            return self.index.notes()
+        return self.index.page(sort or 'id', reverse, after, limit)
+
+    @Lockable.ensure_lock
+    async def revision_digest(self):
+        return self.index.revision_digest.hexdigest()
+
+    @Lockable.ensure_lock
+    async def revision_tree(self):
+        return self.index.revision_digest
+
+    @Lockable.ensure_lock
+    async def changes(self, since=0, limit=None):
+        return self.index.feed.since(since, limit)
 
-        return note_list
+    @Lockable.ensure_lock
+    async def change_sequence(self):
+        return self.index.feed.epoch, self.index.feed.seq
 
     @Lockable.ensure_lock
     async def read(self, id):
-        return await self._read_file(self._filename(id))
+        return await self._run(self._read_note, id)
+
+    @Lockable.ensure_lock
+    async def read_revision(self, note_id, revision_id):
+        """Returns the note with `note_id` in the revision `revision_id`,
+        which is either the current or one of the last `history_size`
+        revisions."""
+        entry = self.index.get(note_id)
+        if entry is not None and entry.note.revision_id == revision_id:
+            return await self.read(note_id)
+        return await self._run(self._read_history, note_id, revision_id)
 
     @Lockable.ensure_lock
     async def write(self, note):
-        filename = self._filename(note.id)
-        logger.debug('Opening file {} for writing'.format(filename))
-        note_schema = NoteSchema()
-        with open(filename, 'w') as fp:
-            fp.write(note_schema.dumps(note))
+        filename, other_filename = self._filenames(note.id)
+        await self._keep_history([note])
+        tmp_filename = await self._run(
+            self._write_temporary_file, filename, note)
+        stat, = await self._commit([
+            (tmp_filename, filename, other_filename)])
+        self.index.add(note, stat.st_size, stat.st_mtime_ns)
+
+    @Lockable.ensure_lock
+    async def write_many(self, notes, deleted_ids=()):
+        """Writes `notes` and deletes the notes with `deleted_ids`, making
+        all changes durable together."""
+        notes = list(notes)
+        deleted_ids = [
+            note_id for note_id in deleted_ids if note_id in self.index]
+
+        filenames = [self._filenames(note.id) for note in notes]
+        await self._keep_history(notes)
+        tmp_filenames = await asyncio.gather(*[
+            self._run(self._write_temporary_file, filename, note)
+            for (filename, _), note in zip(filenames, notes)
+        ])
+        operations = [
+            (tmp_filename, filename, other_filename)
+            for tmp_filename, (filename, other_filename) in zip(
+                tmp_filenames, filenames)
+        ]
+        operations += [
+            (None,) + tuple(self._filenames(note_id))
+            for note_id in deleted_ids
+        ]
+
+        results = await self._commit(operations)
+        for note, stat in zip(notes, results):
+            self.index.add(note, stat.st_size, stat.st_mtime_ns)
+        for note_id in deleted_ids:
+            self.index.remove(note_id)
+            await self._run(self._remove_history, note_id)
 
     @Lockable.ensure_lock
     async def delete(self, note_id):
-        filename = self._filename(note_id)
-        if not os.path.exists(filename):
+        if note_id not in self.index:
             raise NotFound()
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(self.executor, os.unlink, filename)
+        await self._commit([(None,) + tuple(self._filenames(note_id))])
+        self.index.remove(note_id)
+        await self._run(self._remove_history, note_id)
 
-    # TODO: locking
-    def load_status(self):
-        if not os.path.exists(self._status_filename()):
-            return {}
+    @Lockable.ensure_lock
+    async def load_status(self, note_ids=None):
+        return await self._run(self.status_file.load, note_ids)
 
-        with open(self._status_filename()) as f:
-            status_items = StatusItemSchema().loads(f.read(), many=True)
-            return {
-                status_item['note_id']: status_item['revision_id']
-                for status_item in status_items
-            }
+    @Lockable.ensure_lock
+    async def update_status(self, revision_ids, replace=False):
+        """Records the revisions in `revision_ids`, which maps note ids to
+        revision ids, or None for notes that don't exist anymore, as
+        synced. With `replace`, the status of all other notes is removed."""
+        await self._run(self.status_file.update, revision_ids, replace)
 
     @Lockable.ensure_lock
-    async def update_status(self):
-        status_items = [
-            {
-                'note_id': note.id,
-                'revision_id': note.revision_id,
-            } for note in await self.list()
-        ]
-        with open(self._status_filename(), 'w') as f:
-            f.write(StatusItemSchema().dumps(status_items, many=True))
+    async def load_sync_checkpoint(self):
+        return await self._run(
+            read_sync_checkpoint, self._sync_checkpoint_filename())
 
-    async def _read_file(self, filename):
-        logger.debug('Opening file {} for reading'.format(filename))
-        note_schema = NoteSchema()
+    @Lockable.ensure_lock
+    async def save_sync_checkpoint(self, checkpoint):
+        await self._run(
+            write_sync_checkpoint, self._sync_checkpoint_filename(),
+            checkpoint)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def _commit(self, operations):
+        if self.fsync == 'group':
+            return await self.group_commit.commit(operations)
+        return await self._run(self._commit_files, operations)
+
+    async def _keep_history(self, notes):
+        """Keeps the current revisions of the notes replaced by `notes` in
+        their history."""
+        if not self.history_size:
+            return
+        replaced = []
+        for note in notes:
+            entry = self.index.get(note.id)
+            if (entry is not None and
+                    entry.note.revision_id != note.revision_id):
+                replaced.append((
+                    entry.note,
+                    self.index.feed.changes[str(note.id)].seq))
+        await asyncio.gather(*[
+            self._run(self._add_to_history, note.id, note.revision_id, seq)
+            for note, seq in replaced
+        ])
+
+    def _add_to_history(self, note_id, revision_id, seq):
+        """Links the current file of a note into its history directory,
+        named after its change sequence number and revision id, and removes
+        all but the latest `history_size` revisions there."""
+        history_dir = self._history_dir(note_id)
+        os.makedirs(history_dir, exist_ok=True)
+        history_filename = os.path.join(
+            history_dir, '{:012d}-{!s}'.format(seq, revision_id))
+        for filename in self._filenames(note_id):
+            if not os.path.exists(filename):
+                continue
+            # the file is replaced, not changed, by the write, so a hard
+            # link keeps the old revision without copying it
+            try:
+                os.link(filename, history_filename)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copy2(filename, history_filename)
+            break
+
+        for name in sorted(os.listdir(history_dir))[:-self.history_size]:
+            os.unlink(os.path.join(history_dir, name))
+
+    def _read_history(self, note_id, revision_id):
+        suffix = '-{!s}'.format(revision_id)
         try:
-            note_data = open(filename).read()
-            return note_schema.loads(note_data)
+            names = os.listdir(self._history_dir(note_id))
         except FileNotFoundError:
             raise NotFound()
+        for name in names:
+            if name.endswith(suffix):
+                return self._read_file(
+                    os.path.join(self._history_dir(note_id), name))
+        raise NotFound()
+
+    def _remove_history(self, note_id):
+        shutil.rmtree(self._history_dir(note_id), ignore_errors=True)
+
+    def _read_note(self, note_id):
+        # during a layout migration, the note may still be in the other
+        # layout's place, or be moved there from this layout's place while
+        # it's looked for, or back
+        current_filename, other_filename = self._filenames(note_id)
+        for filename in (current_filename, other_filename, current_filename):
+            try:
+                return self._read_file(filename)
+            except FileNotFoundError:
+                pass
+        raise NotFound()
 
-    def _filename(self, note_id):
-        return os.path.join(self.base_dir, '{!s}.nete'.format(note_id))
+    def _read_file(self, filename):
+        logger.debug('Opening file {} for reading'.format(filename))
+        with open(filename, 'rb') as fp:
+            return read_note_file(fp)
+
+    def _read_header(self, filename):
+        with open(filename, 'rb') as fp:
+            return read_note_header(fp)
+
+    def _write_temporary_file(self, filename, note):
+        self._make_dirs(os.path.dirname(filename))
+        tmp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        logger.debug('Opening file {} for writing'.format(tmp_filename))
+        with open(tmp_filename, 'wb') as fp:
+            write_note_file(fp, note)
+            if self.fsync != 'never':
+                fp.flush()
+                os.fsync(fp.fileno())
+        return tmp_filename
+
+    def _commit_files(self, operations):
+        """Moves written temporary files into place or removes notes.
+
+        `operations` is a list of (tmp_filename, filename, other_filename)
+        tuples, with the places of a note in this storage's layout and in
+        the other one. The temporary file is moved to `filename` and an
+        older copy in `other_filename` is removed; if `tmp_filename` is
+        None, the note is removed from both places. Returns the stat results
+        of the files moved into place. Unless fsync is disabled, the changes
+        are made durable with a single fsync per directory.
+
+        A layout migration may move notes between both places at any time,
+        so a note just written may already have been moved to the other
+        place, and a removed note may reappear in the first place.
+        """
+        results = []
+        changed_dirs = set()
+        for tmp_filename, filename, other_filename in operations:
+            if tmp_filename is None:
+                for name in (filename, other_filename, filename):
+                    if _unlink(name):
+                        changed_dirs.add(os.path.dirname(name))
+                results.append(None)
+            else:
+                # moving a file keeps its inode, size and modification time
+                stat = os.stat(tmp_filename)
+                os.replace(tmp_filename, filename)
+                changed_dirs.add(os.path.dirname(filename))
+                if _remove_older_copy(other_filename, stat.st_ino):
+                    changed_dirs.add(os.path.dirname(other_filename))
+                results.append(stat)
+
+        if self.fsync != 'never':
+            for dirname in changed_dirs:
+                _fsync_dir(dirname)
+
+        return results
+
+    def _make_dirs(self, dirname):
+        if os.path.isdir(dirname):
+            return
+
+        os.makedirs(dirname, exist_ok=True)
+        if self.fsync != 'never':
+            while dirname != self.base_dir:
+                dirname = os.path.dirname(dirname)
+                _fsync_dir(dirname)
+
+    def _remove_temporary_files(self):
+        for filename in self._glob('*.tmp'):
+            os.unlink(filename)
+
+    def _build_index(self):
+        self.index = NoteIndex.load(self._index_filename())
+        seen_ids = set()
+        updated_count = 0
+
+        for filename in self._glob('*.nete'):
+            note_id = os.path.basename(filename)[:-len('.nete')]
+            if note_id in seen_ids:
+                # already seen in the other layout's place
+                continue
+            seen_ids.add(note_id)
+            entry = self.index.get(note_id)
+            if entry is not None and entry.is_current(os.stat(filename)):
+                continue
+
+            note = self._read_header(filename)
+            self._index_file(filename, note)
+            updated_count += 1
+
+        stale_ids = self.index.ids() - seen_ids
+        for note_id in stale_ids:
+            self.index.remove(note_id)
+
+        logger.info('Indexed {} notes ({} updated, {} removed)'.format(
+            len(self.index), updated_count, len(stale_ids)))
+
+        if updated_count or stale_ids:
+            # the notes may have been changed after the index was saved,
+            # with sequence numbers that are now handed out again
+            self.index.feed.epoch = new_epoch()
+        if updated_count or stale_ids or self.index.journal_id is None:
+            self.index.save(self._index_filename())
+
+    def _index_file(self, filename, note):
+        stat = os.stat(filename)
+        self.index.add(note, stat.st_size, stat.st_mtime_ns)
+
+    def _glob(self, pattern):
+        return (glob.glob(os.path.join(self.base_dir, pattern)) +
+                glob.glob(os.path.join(self.base_dir, '*', '*', pattern)))
+
+    def _filenames(self, note_id):
+        """Returns the filename of a note in this storage's layout and in
+        the other one."""
+        return [
+            self._filename(note_id, layout)
+            for layout in sorted(self.LAYOUTS,
+                                 key=lambda layout: layout != self.layout)
+        ]
+
+    def _filename(self, note_id, layout=None):
+        basename = '{!s}.nete'.format(note_id)
+        if (layout or self.layout) == 'sharded':
+            return os.path.join(
+                self.base_dir, basename[0:2], basename[2:4], basename)
+        return os.path.join(self.base_dir, basename)
+
+    def _history_dir(self, note_id):
+        return os.path.join(
+            self.base_dir, self.HISTORY_DIRNAME, str(note_id))
 
     def _status_filename(self):
         return os.path.join(self.base_dir, self.STATUS_FILENAME)
+
+    def _sync_checkpoint_filename(self):
+        return os.path.join(self.base_dir, self.SYNC_CHECKPOINT_FILENAME)
+
+    def _index_filename(self):
+        return os.path.join(self.base_dir, self.INDEX_FILENAME)
+
+
+def _unlink(filename):
+    try:
+        os.unlink(filename)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _remove_older_copy(filename, inode):
+    """Removes the file `filename` unless it's the file with `inode`, which
+    a layout migration has moved there. Returns whether it was removed."""
+    try:
+        if os.stat(filename).st_ino == inode:
+            return False
+        # the file is moved out of the way first, so it can be put back if
+        # it has been replaced by the file with `inode` in the meantime
+        tmp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        os.rename(filename, tmp_filename)
+    except FileNotFoundError:
+        return False
+    if os.stat(tmp_filename).st_ino == inode:
+        os.rename(tmp_filename, filename)
+        return False
+    os.unlink(tmp_filename)
+    return True
+
+
+def _fsync_dir(dirname):
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
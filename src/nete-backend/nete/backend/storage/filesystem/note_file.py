@@ -0,0 +1,36 @@
+"""Reading and writing note files.
+
+A note file starts with a line containing the note's header (everything
+except the text) as JSON, followed by the text as UTF-8. This way, the
+header can be read without reading the text.
+
+Files in the former format, a single JSON object including the text, can
+still be read.
+"""
+from nete.common.models import Note
+from nete.common.schemas.note_codec import (
+    HEADER_FIELDS, dumps_note, loads_note)
+
+ENCODING = 'utf-8'
+
+
+def write_note_file(fp, note):
+    """Writes `note` to the file object `fp` opened in binary mode."""
+    fp.write(dumps_note(note, HEADER_FIELDS).encode(ENCODING))
+    fp.write(b'\n')
+    fp.write((note.text or '').encode(ENCODING))
+
+
+def read_note_file(fp):
+    """Reads a note from the file object `fp` opened in binary mode."""
+    note = read_note_header(fp)
+    if isinstance(note, Note):
+        return note
+    return Note(text=fp.read().decode(ENCODING), **note.__dict__)
+
+
+def read_note_header(fp):
+    """Reads the header of a note from the file object `fp` opened in
+    binary mode. For files in the former format, this is the whole note.
+    """
+    return loads_note(fp.readline().decode(ENCODING))
@@ -0,0 +1,318 @@
+from nete.backend.storage.change_feed import Change, ChangeFeed
+from nete.backend.storage.note_header import note_header
+from nete.backend.storage.revision_digest import RevisionDigest, leaf_prefix
+from nete.backend.storage.sorted_index import SortedIndex
+from nete.common.models import NoteHeader
+import contextlib
+import datetime
+import gc
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class IndexEntry:
+
+    def __init__(self, note, size, mtime):
+        self.note = note
+        self.size = size
+        self.mtime = mtime
+
+    def is_current(self, stat):
+        return self.size == stat.st_size and self.mtime == stat.st_mtime_ns
+
+
+class NoteIndex:
+    """In-memory index of all notes of a storage.
+
+    For every note, it holds the note's metadata (everything except the
+    text) together with size and modification time of the note file, so
+    listing notes doesn't need to touch any file.
+
+    The index can be saved to and loaded from an index file, so it doesn't
+    need to be rebuilt from scratch on every start. This includes the
+    change feed, so its sequence continues after a restart, and the bucket
+    digests of the revision digest, so they needn't be hashed again.
+
+    Once the journal is opened, every change is also appended to a journal
+    next to the index file, which loading the index replays. So a storage
+    that crashed continues its change sequence, too, instead of rebuilding
+    the index from the note files and restarting the sequence. The index
+    file is saved again on close and whenever the journal has grown larger
+    than the index. The journal isn't synced to disk, so if the whole
+    system crashes, its last changes may be lost; the storage then finds
+    the note files changed and restarts the sequence.
+
+    With 100,000 notes, the index file has about 15 MB, loading it takes
+    about 2 s and saving it about 1 s, and journaling a change about
+    0.05 ms. The first page sorted by a field takes another 0.05 s.
+    """
+
+    VERSION = 3
+
+    # the journal is compacted into the index file once it has more
+    # changes than this and than the index has notes
+    MIN_JOURNAL_SIZE = 1000
+
+    def __init__(self):
+        self.entries = {}
+        self.sorted = SortedIndex()
+        self.revision_digest = RevisionDigest()
+        self.feed = ChangeFeed()
+        # identifies the saved index file the journal file belongs to, None
+        # if there is no such journal file
+        self.journal_id = None
+        self.journal = None
+        self.journal_size = 0
+        self.filename = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, note_id):
+        return str(note_id) in self.entries
+
+    def ids(self):
+        return set(self.entries.keys())
+
+    def get(self, note_id):
+        return self.entries.get(str(note_id))
+
+    def notes(self):
+        return [entry.note for entry in self.entries.values()]
+
+    def page(self, sort='id', reverse=False, after=None, limit=None):
+        return self.sorted.page(sort, reverse, after, limit)
+
+    def add(self, note, size, mtime):
+        entry = IndexEntry(note_header(note), size, mtime)
+        change = self._add_entry(entry)
+        self._append_to_journal(_entry_row(change.note_id, entry, change.seq))
+
+    def remove(self, note_id):
+        if self._remove_entry(note_id):
+            change = self.feed.add(note_id, None)
+            self._append_to_journal([change.note_id, change.seq])
+
+    def open_journal(self, filename):
+        """Appends all further changes to the journal of the index file
+        `filename`, which must have been loaded with its journal or saved
+        before."""
+        self.filename = filename
+        self.journal = open(_journal_filename(filename), 'a')
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _add_entry(self, entry, seq=None):
+        self._remove_entry(entry.note.id)
+        self.entries[str(entry.note.id)] = entry
+        self.sorted.add(entry.note)
+        self.revision_digest.add(entry.note.id, entry.note.revision_id)
+        return self.feed.add(entry.note.id, entry.note, seq)
+
+    def _remove_entry(self, note_id):
+        entry = self.entries.pop(str(note_id), None)
+        if entry is None:
+            return False
+        self.sorted.remove(note_id)
+        self.revision_digest.remove(entry.note.id, entry.note.revision_id)
+        return True
+
+    @classmethod
+    def load(cls, filename):
+        index = cls()
+        try:
+            with open(filename) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return index
+        except ValueError as e:
+            logger.warning('Ignoring corrupt index file {}: {}'.format(
+                filename, e))
+            return index
+
+        if data.get('version') != cls.VERSION:
+            logger.info('Ignoring index file {} with version {}'.format(
+                filename, data.get('version')))
+            return index
+
+        with _garbage_collection_paused():
+            index._restore(data)
+
+        rows = _read_journal(_journal_filename(filename), data.get('journal'))
+        if rows is not None:
+            index._replay(rows)
+            index.journal_id = data['journal']
+            index.journal_size = len(rows)
+            if rows:
+                logger.info('Replayed {} changes from the index journal'
+                            .format(len(rows)))
+        return index
+
+    def _restore(self, data):
+        # everything is built in bulk, as adding the entries one by one
+        # takes seconds for large indexes
+        notes = {}
+        leaves = {}
+        changes = []
+        for (id, revision_id, title, created_at, updated_at,
+             size, mtime, seq) in data['notes']:
+            note = NoteHeader(id=uuid.UUID(id),
+                              revision_id=uuid.UUID(revision_id),
+                              created_at=_from_timestamp(created_at),
+                              updated_at=_from_timestamp(updated_at),
+                              title=title)
+            self.entries[id] = IndexEntry(note, size, mtime)
+            notes[id] = note
+            leaves.setdefault(leaf_prefix(id), {})[note.id] = note.revision_id
+            changes.append(Change(seq, id, note))
+        changes.extend(Change(seq, id, None) for id, seq in data['deleted'])
+
+        self.sorted.add_many(notes)
+        self.revision_digest = RevisionDigest.restore(data['digest'], leaves)
+        self.feed = ChangeFeed(data['epoch'])
+        self.feed.add_many(changes)
+        self.feed.seq = data['seq']
+
+    def _replay(self, rows):
+        for row in rows:
+            if len(row) == 2:
+                id, seq = row
+                self._remove_entry(id)
+                self.feed.add(id, None, seq)
+            else:
+                self._add_entry(_entry_from_row(row), row[-1])
+
+    def save(self, filename):
+        changes = self.feed.changes
+        journal_id = uuid.uuid4().hex
+        data = {
+            'version': self.VERSION,
+            'epoch': self.feed.epoch,
+            'seq': self.feed.seq,
+            'journal': journal_id,
+            'notes': [
+                _entry_row(id, entry, changes[id].seq)
+                for id, entry in self.entries.items()
+            ],
+            'deleted': [
+                [id, change.seq]
+                for id, change in changes.items()
+                if change.note is None
+            ],
+            'digest': self.revision_digest.dump(),
+        }
+        tmp_filename = '{}.tmp'.format(filename)
+        with open(tmp_filename, 'w') as fp:
+            # json.dump() doesn't use the much faster C encoder
+            fp.write(json.dumps(data, separators=(',', ':')))
+        os.replace(tmp_filename, filename)
+
+        # the changes in the journal are in the index file now
+        is_journal_open = self.journal is not None
+        self.close_journal()
+        with open(_journal_filename(filename), 'w') as fp:
+            fp.write(json.dumps({'journal': journal_id}) + '\n')
+        self.journal_id = journal_id
+        self.journal_size = 0
+        if is_journal_open:
+            self.open_journal(filename)
+
+    def _append_to_journal(self, row):
+        if self.journal is None:
+            return
+        # written right away, so the change isn't lost if the process
+        # crashes, but not fsynced
+        self.journal.write(json.dumps(row, separators=(',', ':')) + '\n')
+        self.journal.flush()
+        self.journal_size += 1
+        if self.journal_size > max(self.MIN_JOURNAL_SIZE, len(self)):
+            self.save(self.filename)
+
+
+@contextlib.contextmanager
+def _garbage_collection_paused():
+    # creating hundreds of thousands of objects that all stay alive would
+    # otherwise run the garbage collector over and over for nothing
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _entry_row(id, entry, seq):
+    return [
+        id,
+        str(entry.note.revision_id),
+        entry.note.title,
+        _to_timestamp(entry.note.created_at),
+        _to_timestamp(entry.note.updated_at),
+        entry.size,
+        entry.mtime,
+        seq,
+    ]
+
+
+def _entry_from_row(row):
+    id, revision_id, title, created_at, updated_at, size, mtime, _ = row
+    return IndexEntry(
+        NoteHeader(id=uuid.UUID(id),
+                   revision_id=uuid.UUID(revision_id),
+                   created_at=_from_timestamp(created_at),
+                   updated_at=_from_timestamp(updated_at),
+                   title=title),
+        size,
+        mtime)
+
+
+def _journal_filename(filename):
+    return '{}.journal'.format(filename)
+
+
+def _read_journal(filename, journal_id):
+    """Returns the rows of the journal `filename` if it belongs to the index
+    file with `journal_id`, and None otherwise."""
+    try:
+        with open(filename) as fp:
+            lines = fp.read().splitlines()
+    except FileNotFoundError:
+        return None
+    try:
+        if not lines or json.loads(lines[0]).get('journal') != journal_id:
+            return None
+    except ValueError:
+        return None
+
+    rows = []
+    for line in lines[1:]:
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            # the last change may have been written only partly in a crash
+            logger.warning('Ignoring corrupt line in index journal {}'.format(
+                filename))
+            break
+    return rows
+
+
+def _to_timestamp(dt):
+    if dt is None:
+        return None
+    return (dt - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _from_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=timestamp)
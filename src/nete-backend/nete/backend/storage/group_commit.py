@@ -0,0 +1,46 @@
+import asyncio
+
+
+class GroupCommit:
+    """Commits operations of concurrent callers together.
+
+    Operations arriving while a commit is running are collected and
+    committed together in a single call of `commit_fn` (run via `run`)
+    as soon as the running commit is finished. Every caller gets the
+    results for its own operations.
+    """
+
+    def __init__(self, run, commit_fn):
+        self.run = run
+        self.commit_fn = commit_fn
+        self.operations = []
+        self.future = None
+        self.task = None
+
+    async def commit(self, operations):
+        if self.future is None:
+            self.future = asyncio.get_event_loop().create_future()
+        future = self.future
+        start = len(self.operations)
+        self.operations.extend(operations)
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._commit_pending())
+
+        results = await asyncio.shield(future)
+        return results[start:start + len(operations)]
+
+    async def _commit_pending(self):
+        try:
+            # give callers that are ready to run a chance to join the batch
+            await asyncio.sleep(0)
+            while self.future is not None:
+                operations, future = self.operations, self.future
+                self.operations, self.future = [], None
+                try:
+                    future.set_result(
+                        await self.run(self.commit_fn, operations))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            self.task = None
@@ -0,0 +1 @@
+from .log_storage import LogStorage   # noqa: F401
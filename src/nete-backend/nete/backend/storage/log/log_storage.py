@@ -0,0 +1,462 @@
+from .segment import Segment, encode_record, iter_records
+from nete.backend.storage.change_feed import (
+    ChangeFeed, load_epoch, new_epoch)
+from nete.backend.storage.exceptions import NotFound
+from nete.backend.storage.lockable import Lockable
+from nete.backend.storage.note_header import note_header
+from nete.backend.storage.revision_digest import RevisionDigest
+from nete.backend.storage.sorted_index import SortedIndex
+from nete.backend.storage.status_file import (
+    StatusFile, read_sync_checkpoint, write_sync_checkpoint)
+from nete.common.schemas.note_codec import note_from_dict, note_to_dict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import glob
+import json
+import logging
+import os
+import os.path
+
+logger = logging.getLogger(__name__)
+
+
+class LogEntry:
+
+    def __init__(self, note, segment, offset, length):
+        self.note = note
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+
+
+class LogStorage(Lockable):
+    """Stores notes as records appended to a log of segment files.
+
+    An in-memory index maps every note id to the location of its latest
+    record and is rebuilt by replaying the log on open(). Appends are
+    fsynced in batches, and sealed segments are compacted in the background
+    once enough of their records have been superseded or deleted.
+
+    All file operations run in a single thread, one after another, which
+    keeps appends, reads and compaction in order.
+
+    Every record carries its change sequence number. Delete records are
+    kept as tombstones by compaction, so the change feed survives it.
+
+    The records of the last `history_size` revisions of every note are
+    kept reachable until compaction removes them.
+    """
+
+    STATUS_FILENAME = 'status.json'
+    SYNC_CHECKPOINT_FILENAME = 'sync_checkpoint.json'
+    EPOCH_FILENAME = 'epoch'
+    SEGMENTS_DIRNAME = 'segments'
+    SEGMENT_SIZE = 16 * 1024 * 1024
+    COMPACTION_THRESHOLD = 4 * 1024 * 1024
+    FLUSH_DELAY = 0.005
+
+    def __init__(self, base_dir, history_size=2):
+        self.base_dir = base_dir
+        self.history_size = history_size
+        self.segments_dir = os.path.join(base_dir, self.SEGMENTS_DIRNAME)
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self.executor = None
+        self.segments = []
+        self.entries = {}
+        self.tombstones = {}
+        self.history = {}
+        self.sorted_index = SortedIndex()
+        self.digest = RevisionDigest()
+        self.feed = ChangeFeed()
+        self.status_file = StatusFile(self._status_filename())
+        self.flush_future = None
+        self.compaction = None
+
+    def open(self):
+        logger.info('Opening storage in directory {}'.format(self.base_dir))
+        self.lock(os.path.join(self.base_dir, '.lock'))
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._recover_compaction()
+        self.feed = ChangeFeed(load_epoch(self._epoch_filename()))
+        self._replay()
+
+    def close(self):
+        if self.compaction is not None:
+            self.compaction.cancel()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for segment in self.segments:
+            segment.sync()
+            segment.close()
+        self.segments = []
+        self.entries = {}
+        self.tombstones = {}
+        self.history = {}
+        self.sorted_index = SortedIndex()
+        self.digest = RevisionDigest()
+        self.feed = ChangeFeed()
+        self.unlock()
+
+    @Lockable.ensure_lock
+    async def list(self, sort=None, reverse=False, after=None, limit=None):
+        if sort is None and after is None and limit is None:
+            return [entry.note for entry in self.entries.values()]
+        return self.sorted_index.page(sort or 'id', reverse, after, limit)
+
+    @Lockable.ensure_lock
+    async def revision_digest(self):
+        return self.digest.hexdigest()
+
+    @Lockable.ensure_lock
+    async def revision_tree(self):
+        return self.digest
+
+    @Lockable.ensure_lock
+    async def changes(self, since=0, limit=None):
+        return self.feed.since(since, limit)
+
+    @Lockable.ensure_lock
+    async def change_sequence(self):
+        return self.feed.epoch, self.feed.seq
+
+    @Lockable.ensure_lock
+    async def read(self, id):
+        entry = self.entries.get(str(id))
+        if entry is None:
+            raise NotFound()
+
+        return await self._read_entry(entry)
+
+    @Lockable.ensure_lock
+    async def read_revision(self, note_id, revision_id):
+        """Returns the note with `note_id` in the revision `revision_id`,
+        which is either the current or one of the last `history_size`
+        revisions."""
+        for entry in ([self.entries.get(str(note_id))] +
+                      self.history.get(str(note_id), [])):
+            if entry is not None and entry.note.revision_id == revision_id:
+                return await self._read_entry(entry)
+        raise NotFound()
+
+    @Lockable.ensure_lock
+    async def write(self, note):
+        record = {
+            'op': 'put',
+            'seq': self.feed.next_seq(),
+            'note': note_to_dict(note),
+        }
+        segment, offset, length = await self._run(self._append, record)
+        self._set_entry(
+            str(note.id),
+            LogEntry(note_header(note), segment, offset, length),
+            record['seq'])
+        await self._flush()
+        self._schedule_compaction()
+
+    @Lockable.ensure_lock
+    async def write_many(self, notes, deleted_ids=()):
+        """Writes `notes` and deletes the notes with `deleted_ids`, making
+        all changes durable together."""
+        notes = list(notes)
+        deleted_ids = [
+            str(note_id) for note_id in deleted_ids
+            if str(note_id) in self.entries]
+
+        records = (
+            [{'op': 'put', 'seq': self.feed.next_seq(),
+              'note': note_to_dict(note)}
+             for note in notes] +
+            [{'op': 'delete', 'seq': self.feed.next_seq(), 'id': note_id}
+             for note_id in deleted_ids])
+        locations = await self._run(self._append_many, records)
+        for note, record, (segment, offset, length) in zip(
+                notes, records, locations):
+            self._set_entry(
+                str(note.id),
+                LogEntry(note_header(note), segment, offset, length),
+                record['seq'])
+        for note_id, record, (segment, offset, length) in zip(
+                deleted_ids, records[len(notes):], locations[len(notes):]):
+            self._set_tombstone(
+                note_id, LogEntry(None, segment, offset, length),
+                record['seq'])
+        await self._flush()
+        self._schedule_compaction()
+
+    @Lockable.ensure_lock
+    async def delete(self, note_id):
+        if str(note_id) not in self.entries:
+            raise NotFound()
+
+        record = {
+            'op': 'delete',
+            'seq': self.feed.next_seq(),
+            'id': str(note_id),
+        }
+        segment, offset, length = await self._run(self._append, record)
+        self._set_tombstone(
+            str(note_id), LogEntry(None, segment, offset, length),
+            record['seq'])
+        await self._flush()
+        self._schedule_compaction()
+
+    @Lockable.ensure_lock
+    async def load_status(self, note_ids=None):
+        return await self._run(self.status_file.load, note_ids)
+
+    @Lockable.ensure_lock
+    async def update_status(self, revision_ids, replace=False):
+        """Records the revisions in `revision_ids`, which maps note ids to
+        revision ids, or None for notes that don't exist anymore, as
+        synced. With `replace`, the status of all other notes is removed."""
+        await self._run(self.status_file.update, revision_ids, replace)
+
+    @Lockable.ensure_lock
+    async def load_sync_checkpoint(self):
+        return await self._run(
+            read_sync_checkpoint, self._sync_checkpoint_filename())
+
+    @Lockable.ensure_lock
+    async def save_sync_checkpoint(self, checkpoint):
+        await self._run(
+            write_sync_checkpoint, self._sync_checkpoint_filename(),
+            checkpoint)
+
+    async def compact(self):
+        sealed = self.segments[:-1]
+        if not sealed:
+            return
+
+        sealed_set = set(sealed)
+        live = [
+            (note_id, entry)
+            for entries in (self.entries, self.tombstones)
+            for note_id, entry in entries.items()
+            if entry.segment in sealed_set
+        ]
+        logger.info('Compacting {} segments with {} live records'.format(
+            len(sealed), len(live)))
+
+        segment, offsets = await self._run(
+            self._write_compacted_segment, sealed[-1].number, live)
+        # old revisions are only kept in the segments being replaced
+        for note_id, history in list(self.history.items()):
+            history = [
+                entry for entry in history
+                if entry.segment not in sealed_set]
+            if history:
+                self.history[note_id] = history
+            else:
+                del self.history[note_id]
+        for (note_id, entry), offset in zip(live, offsets):
+            entries = (self.tombstones if entry.note is None
+                       else self.entries)
+            if entries.get(note_id) is entry:
+                entries[note_id] = LogEntry(
+                    entry.note, segment, offset, entry.length)
+            else:
+                segment.dead_bytes += entry.length
+        await self._run(self._replace_segments, sealed, segment)
+
+    async def _read_entry(self, entry):
+        payload = await self._run(
+            entry.segment.read_payload, entry.offset, entry.length)
+        return note_from_dict(_decode(payload)['note'])
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def _flush(self):
+        if self.flush_future is None:
+            self.flush_future = asyncio.ensure_future(self._sync_later())
+        await asyncio.shield(self.flush_future)
+
+    async def _sync_later(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        self.flush_future = None
+        await self._run(self._sync_active_segment)
+
+    def _schedule_compaction(self):
+        if self.compaction is not None and not self.compaction.done():
+            return
+
+        sealed = self.segments[:-1]
+        dead_bytes = sum(segment.dead_bytes for segment in sealed)
+        if (dead_bytes >= self.COMPACTION_THRESHOLD and
+                dead_bytes * 2 >= sum(segment.size for segment in sealed)):
+            self.compaction = asyncio.ensure_future(self._compact_safely())
+
+    async def _compact_safely(self):
+        try:
+            await self.compact()
+        except Exception:
+            logger.exception('Compaction failed')
+
+    def _set_entry(self, note_id, entry, seq=None):
+        old_entry = self.entries.get(note_id)
+        if (self.history_size and old_entry is not None and
+                old_entry.note.revision_id != entry.note.revision_id):
+            self.history[note_id] = (
+                [old_entry] +
+                self.history.get(note_id, []))[:self.history_size]
+        self._remove_entry(note_id)
+        self.entries[note_id] = entry
+        self.sorted_index.add(entry.note)
+        self.digest.add(entry.note.id, entry.note.revision_id)
+        self.feed.add(note_id, entry.note, seq)
+
+    def _set_tombstone(self, note_id, entry, seq=None):
+        self.history.pop(note_id, None)
+        self._remove_entry(note_id)
+        self.tombstones[note_id] = entry
+        self.feed.add(note_id, None, seq)
+
+    def _remove_entry(self, note_id):
+        old_entry = (self.entries.pop(note_id, None) or
+                     self.tombstones.pop(note_id, None))
+        if old_entry is None:
+            return
+        old_entry.segment.dead_bytes += old_entry.length
+        if old_entry.note is not None:
+            self.sorted_index.remove(note_id)
+            self.digest.remove(
+                old_entry.note.id, old_entry.note.revision_id)
+
+    def _replay(self):
+        is_sequenced = True
+        numbers = sorted(
+            Segment.number_of(filename)
+            for filename in os.listdir(self.segments_dir)
+            if filename.endswith(Segment.SUFFIX))
+
+        for number in numbers:
+            segment = Segment.open(
+                Segment.filename_for(self.segments_dir, number), number)
+            self.segments.append(segment)
+            end = 0
+            for offset, length, payload in iter_records(segment.read_all()):
+                record = _decode(payload)
+                is_sequenced = is_sequenced and 'seq' in record
+                self._replay_record(segment, offset, length, record)
+                end = offset + length
+            if end < segment.size:
+                logger.warning(
+                    'Truncating damaged segment {} from {} to {} bytes'
+                    .format(segment.filename, segment.size, end))
+                segment.truncate(end)
+
+        if not self.segments or self.segments[-1].size >= self.SEGMENT_SIZE:
+            self._add_segment()
+
+        if not is_sequenced:
+            # records written by earlier versions get sequence numbers in
+            # log order, which compaction may change
+            self.feed.epoch = new_epoch()
+
+        logger.info('Replayed {} segments with {} notes'.format(
+            len(numbers), len(self.entries)))
+
+    def _replay_record(self, segment, offset, length, record):
+        seq = record.get('seq')
+        if record['op'] == 'put':
+            note = note_header(note_from_dict(record['note']))
+            self._set_entry(
+                str(note.id), LogEntry(note, segment, offset, length), seq)
+        elif record['op'] == 'delete':
+            self._set_tombstone(
+                record['id'], LogEntry(None, segment, offset, length), seq)
+
+    def _recover_compaction(self):
+        pattern = os.path.join(self.segments_dir, '*' + Segment.SUFFIX)
+        for filename in glob.glob(pattern + '.compact.tmp'):
+            os.unlink(filename)
+
+        for filename in glob.glob(pattern + '.compact'):
+            number = Segment.number_of(filename)
+            logger.info('Finishing interrupted compaction of segment {}'
+                        .format(number))
+            for segment_filename in glob.glob(pattern):
+                if Segment.number_of(segment_filename) <= number:
+                    os.unlink(segment_filename)
+            os.rename(filename,
+                      Segment.filename_for(self.segments_dir, number))
+            self._sync_segments_dir()
+
+    def _add_segment(self):
+        number = self.segments[-1].number + 1 if self.segments else 1
+        self.segments.append(Segment.open(
+            Segment.filename_for(self.segments_dir, number), number))
+
+    def _append(self, record):
+        if self.segments[-1].size >= self.SEGMENT_SIZE:
+            self.segments[-1].sync()
+            self._add_segment()
+
+        segment = self.segments[-1]
+        data = encode_record(json.dumps(record).encode('utf-8'))
+        return segment, segment.append(data), len(data)
+
+    def _append_many(self, records):
+        return [self._append(record) for record in records]
+
+    def _sync_active_segment(self):
+        self.segments[-1].sync()
+
+    def _write_compacted_segment(self, number, live):
+        filename = Segment.filename_for(self.segments_dir, number)
+        tmp_filename = filename + '.compact.tmp'
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+
+        segment = Segment.open(tmp_filename, number)
+        offsets = [
+            segment.append(entry.segment.read_record(
+                entry.offset, entry.length))
+            for _, entry in live
+        ]
+        segment.sync()
+
+        # once renamed, the compaction is committed and will be finished
+        # by _recover_compaction() if we crash before _replace_segments()
+        os.rename(tmp_filename, filename + '.compact')
+        segment.filename = filename + '.compact'
+        self._sync_segments_dir()
+        return segment, offsets
+
+    def _replace_segments(self, old_segments, segment):
+        for old_segment in old_segments:
+            old_segment.close()
+            os.unlink(old_segment.filename)
+
+        filename = Segment.filename_for(self.segments_dir, segment.number)
+        os.rename(segment.filename, filename)
+        segment.filename = filename
+        self._sync_segments_dir()
+
+        self.segments = [segment] + [
+            other_segment
+            for other_segment in self.segments
+            if other_segment not in old_segments
+        ]
+
+    def _sync_segments_dir(self):
+        fd = os.open(self.segments_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _status_filename(self):
+        return os.path.join(self.base_dir, self.STATUS_FILENAME)
+
+    def _sync_checkpoint_filename(self):
+        return os.path.join(self.base_dir, self.SYNC_CHECKPOINT_FILENAME)
+
+    def _epoch_filename(self):
+        return os.path.join(self.base_dir, self.EPOCH_FILENAME)
+
+
+def _decode(payload):
+    return json.loads(payload.decode('utf-8'))
@@ -0,0 +1,83 @@
+import os
+import os.path
+import struct
+import zlib
+
+RECORD_HEADER = struct.Struct('>II')
+
+
+def encode_record(payload):
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def iter_records(data):
+    """Yields (offset, length, payload) for every intact record in `data`.
+
+    Stops at the first truncated or corrupt record, which is what a crash
+    during an append leaves behind.
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        payload_length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + payload_length]
+        if len(payload) < payload_length or zlib.crc32(payload) != checksum:
+            return
+        length = RECORD_HEADER.size + payload_length
+        yield offset, length, payload
+        offset += length
+
+
+class Segment:
+    """An append-only file of records."""
+
+    SUFFIX = '.log'
+
+    def __init__(self, number, filename, fd, size):
+        self.number = number
+        self.filename = filename
+        self.fd = fd
+        self.size = size
+        self.dead_bytes = 0
+
+    @classmethod
+    def filename_for(cls, directory, number):
+        return os.path.join(directory, '{:08d}{}'.format(number, cls.SUFFIX))
+
+    @staticmethod
+    def number_of(filename):
+        return int(os.path.basename(filename).split('.')[0])
+
+    @classmethod
+    def open(cls, filename, number):
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        return cls(number, filename, fd, os.fstat(fd).st_size)
+
+    def read_all(self):
+        return os.pread(self.fd, self.size, 0)
+
+    def read_payload(self, offset, length):
+        return os.pread(self.fd, length - RECORD_HEADER.size,
+                        offset + RECORD_HEADER.size)
+
+    def read_record(self, offset, length):
+        return os.pread(self.fd, length, offset)
+
+    def append(self, record):
+        offset = self.size
+        view = memoryview(record)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        self.size += len(record)
+        return offset
+
+    def truncate(self, size):
+        os.ftruncate(self.fd, size)
+        self.size = size
+
+    def sync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,18 @@
+from nete.common.models import NoteHeader
+import datetime
+
+
+def note_header(note):
+    """Returns the header of `note`, as kept in indexes."""
+    return NoteHeader(id=note.id,
+                      revision_id=note.revision_id,
+                      created_at=_as_utc(note.created_at),
+                      updated_at=_as_utc(note.updated_at),
+                      title=note.title)
+
+
+def _as_utc(dt):
+    # naive datetimes are stored as UTC, see NoteSchema
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
@@ -0,0 +1,113 @@
+import hashlib
+
+# the number of hex digits of note ids the deepest buckets are named after
+DEPTH = 3
+
+HEX_DIGITS = '0123456789abcdef'
+
+
+class RevisionDigest:
+    """Digest of the current revisions of a set of notes.
+
+    It's the XOR of a hash of every note's id and revision id, so it
+    doesn't depend on the order of notes and can be updated in constant
+    time when a note is added or removed.
+
+    The same kind of digest is kept for every bucket of notes whose ids
+    start with the same hex digits, up to `DEPTH` digits, so two sets of
+    notes can be compared by walking down only into the buckets whose
+    digests differ.
+    """
+
+    def __init__(self):
+        # prefix -> [digest value, number of notes]
+        self.buckets = {}
+        # prefix of DEPTH digits -> {note id: revision id}
+        self.leaves = {}
+
+    @classmethod
+    def restore(cls, buckets, leaves):
+        """Returns a digest with the buckets returned by `dump()` and the
+        given leaves, without hashing every note again."""
+        digest = cls()
+        digest.buckets = {
+            prefix: [int(value, 16), count]
+            for prefix, (value, count) in buckets.items()
+        }
+        digest.leaves = leaves
+        return digest
+
+    def dump(self):
+        """Returns the non-empty buckets as a dict mapping prefixes to
+        [hex digest, number of notes] lists."""
+        return {
+            prefix: [_hex(value), count]
+            for prefix, (value, count) in self.buckets.items()
+            if count
+        }
+
+    def add(self, note_id, revision_id):
+        self._toggle(note_id, revision_id, 1)
+        self.leaves.setdefault(leaf_prefix(note_id), {})[note_id] = revision_id
+
+    def remove(self, note_id, revision_id):
+        self._toggle(note_id, revision_id, -1)
+        leaf = self.leaves.get(leaf_prefix(note_id), {})
+        leaf.pop(note_id, None)
+        if not leaf:
+            self.leaves.pop(leaf_prefix(note_id), None)
+
+    def hexdigest(self, prefix=''):
+        return _hex(self.buckets.get(prefix, (0, 0))[0])
+
+    def children(self, prefixes):
+        """Returns the non-empty buckets one level below the buckets with
+        `prefixes`, as a dict mapping their prefixes to (hex digest, number
+        of notes) tuples."""
+        children = {}
+        for prefix in prefixes:
+            for digit in HEX_DIGITS:
+                value, count = self.buckets.get(prefix + digit, (0, 0))
+                if count:
+                    children[prefix + digit] = (_hex(value), count)
+        return children
+
+    def revision(self, note_id):
+        """Returns the revision id of the note with `note_id`, or None if
+        there is no such note."""
+        return self.leaves.get(leaf_prefix(note_id), {}).get(note_id)
+
+    def revisions(self, prefixes):
+        """Returns a dict mapping the ids of the notes in the buckets with
+        `prefixes` to their revision ids."""
+        prefixes = tuple(prefixes)
+        revisions = {}
+        for leaf, notes in self.leaves.items():
+            if leaf.startswith(prefixes):
+                revisions.update(notes)
+        return revisions
+
+    def _toggle(self, note_id, revision_id, count):
+        value = _hash(note_id, revision_id)
+        prefix = leaf_prefix(note_id)
+        for length in range(DEPTH + 1):
+            bucket = self.buckets.setdefault(prefix[:length], [0, 0])
+            bucket[0] ^= value
+            bucket[1] += count
+
+
+def is_prefix(value):
+    return len(value) <= DEPTH and all(c in HEX_DIGITS for c in value)
+
+
+def leaf_prefix(note_id):
+    return str(note_id)[:DEPTH]
+
+
+def _hex(value):
+    return '{:040x}'.format(value)
+
+
+def _hash(note_id, revision_id):
+    data = '{!s}:{!s}'.format(note_id, revision_id).encode('ascii')
+    return int.from_bytes(hashlib.sha1(data).digest(), 'big')
@@ -0,0 +1,128 @@
+"""Sorted, paged listings of notes.
+
+Notes can be listed sorted by one of `SORT_FIELDS`. Ties are broken by
+the note id, so every note has a unique position, and a page is given
+by the sort key of the last note of the previous page (`after`). Cursors
+handed out to clients encode such a sort key.
+"""
+from nete.common.schemas.note_codec import format_datetime, parse_datetime
+import base64
+import bisect
+import datetime
+import json
+
+SORT_FIELDS = ('id', 'title', 'created_at', 'updated_at')
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+MIN_DATETIME = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def parse_sort(value):
+    """Parses a sort parameter like `title` or `-updated_at` (descending)
+    into a (field, reverse) tuple."""
+    field = value[1:] if value.startswith('-') else value
+    if field not in SORT_FIELDS:
+        raise ValueError('Cannot sort by {!r}'.format(value))
+    return field, value.startswith('-')
+
+
+def sort_key(note, sort):
+    return (sort_value(note, sort), str(note.id))
+
+
+def sort_value(note, sort):
+    value = getattr(note, sort)
+    if sort == 'id':
+        value = str(value)
+    elif sort == 'title':
+        value = value or ''
+    elif value is None:
+        value = MIN_DATETIME
+    elif value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def encode_cursor(sort, key):
+    value, note_id = key
+    if sort in DATETIME_FIELDS:
+        value = format_datetime(value)
+    data = json.dumps([sort, value, note_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort):
+    """Returns the sort key encoded in `cursor`, which must have been
+    created for `sort`. Raises ValueError for invalid cursors."""
+    try:
+        cursor_sort, value, note_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError('Invalid cursor {!r}'.format(cursor)) from e
+
+    if cursor_sort != sort:
+        raise ValueError('Cursor is not for sorting by {}'.format(sort))
+    if not isinstance(value, str) or not isinstance(note_id, str):
+        raise ValueError('Invalid cursor {!r}'.format(cursor))
+    if sort in DATETIME_FIELDS:
+        value = parse_datetime(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+    return (value, note_id)
+
+
+class SortedIndex:
+    """Keeps notes sorted by any of `SORT_FIELDS`.
+
+    The sorted keys for a field are built when notes are first listed by
+    that field and are kept up to date on every change afterwards.
+    """
+
+    def __init__(self):
+        self.notes = {}
+        self.keys = {}
+
+    def add(self, note):
+        self.remove(note.id)
+        self.notes[str(note.id)] = note
+        for sort, keys in self.keys.items():
+            bisect.insort(keys, sort_key(note, sort))
+
+    def add_many(self, notes):
+        """Adds `notes`, a dict mapping note ids to notes, dropping the
+        sorted keys so they're rebuilt once when they're next needed."""
+        self.notes.update(notes)
+        self.keys = {}
+
+    def remove(self, note_id):
+        note = self.notes.pop(str(note_id), None)
+        if note is None:
+            return
+        for sort, keys in self.keys.items():
+            del keys[bisect.bisect_left(keys, sort_key(note, sort))]
+
+    def page(self, sort='id', reverse=False, after=None, limit=None):
+        """Returns up to `limit` notes sorted by `sort`, following the
+        note with the sort key `after`."""
+        keys = self._keys(sort)
+        if reverse:
+            end = len(keys) if after is None else bisect.bisect_left(
+                keys, after)
+            start = 0 if limit is None else max(0, end - limit)
+            selected = reversed(keys[start:end])
+        else:
+            start = 0 if after is None else bisect.bisect_right(keys, after)
+            end = None if limit is None else start + limit
+            selected = keys[start:end]
+        return [self.notes[note_id] for _, note_id in selected]
+
+    def _keys(self, sort):
+        if sort not in SORT_FIELDS:
+            raise ValueError('Cannot sort by {!r}'.format(sort))
+        if sort not in self.keys:
+            # the note ids are taken from the keys of `notes`, as formatting
+            # every note's UUID again takes most of the time otherwise
+            self.keys[sort] = sorted(
+                (note_id if sort == 'id' else sort_value(note, sort), note_id)
+                for note_id, note in self.notes.items())
+        return self.keys[sort]
@@ -0,0 +1 @@
+from .sqlite_storage import SqliteStorage   # noqa: F401
@@ -0,0 +1,363 @@
+from nete.backend.storage.change_feed import Change, new_epoch
+from nete.backend.storage.exceptions import NotFound
+from nete.backend.storage.lockable import Lockable
+from nete.backend.storage.revision_digest import RevisionDigest
+from nete.backend.storage.sorted_index import SORT_FIELDS
+from nete.common.schemas.note_codec import (
+    format_datetime, note_from_dict, note_to_dict)
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import datetime
+import json
+import logging
+import os.path
+import sqlite3
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS notes (
+    id TEXT PRIMARY KEY,
+    revision_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_revision_id ON notes (revision_id);
+CREATE INDEX IF NOT EXISTS notes_updated_at ON notes (updated_at);
+CREATE INDEX IF NOT EXISTS notes_title_id ON notes (title, id);
+CREATE INDEX IF NOT EXISTS notes_created_at_id ON notes (created_at, id);
+CREATE INDEX IF NOT EXISTS notes_updated_at_id ON notes (updated_at, id);
+CREATE TABLE IF NOT EXISTS status (
+    note_id TEXT PRIMARY KEY,
+    revision_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    note_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS changes_seq ON changes (seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id TEXT NOT NULL,
+    revision_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_id_revision_id
+    ON history (id, revision_id);
+'''
+
+HEADER_COLUMNS = ('id', 'revision_id', 'created_at', 'updated_at', 'title')
+NOTE_COLUMNS = HEADER_COLUMNS + ('text',)
+
+# the maximum number of ids in a single query
+QUERY_BATCH_SIZE = 500
+
+INSERT_NOTE = 'INSERT OR REPLACE INTO notes ({}) VALUES ({})'.format(
+    ', '.join(NOTE_COLUMNS), ', '.join('?' for _ in NOTE_COLUMNS))
+# the latest change of a note; a change of a note that doesn't exist
+# anymore is a deletion
+RECORD_CHANGE = (
+    'INSERT OR REPLACE INTO changes (note_id, seq) '
+    'VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM changes))')
+# the current revision of a note, before it's replaced by another one
+ADD_TO_HISTORY = (
+    'INSERT INTO history ({0}) SELECT {0} FROM notes '
+    'WHERE id = ? AND revision_id != ?'.format(', '.join(NOTE_COLUMNS)))
+# all but the latest revisions in a note's history
+PRUNE_HISTORY = (
+    'DELETE FROM history WHERE id = ? AND rowid NOT IN '
+    '(SELECT rowid FROM history WHERE id = ? ORDER BY rowid DESC LIMIT ?)')
+
+
+class SqliteStorage(Lockable):
+    """Stores all notes in a single SQLite database.
+
+    Queries run in a dedicated thread, one at a time, so they never block
+    the event loop.
+    """
+
+    DATABASE_FILENAME = 'notes.sqlite'
+
+    def __init__(self, base_dir, history_size=2):
+        self.base_dir = base_dir
+        self.history_size = history_size
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection = None
+        self.digest = None
+        self.epoch = None
+
+    def open(self):
+        filename = os.path.join(self.base_dir, self.DATABASE_FILENAME)
+        logger.info('Opening storage in database {}'.format(filename))
+        self.lock(os.path.join(self.base_dir, '.lock'))
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.epoch = self._load_epoch()
+        self._record_unrecorded_changes()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.unlock()
+
+    @Lockable.ensure_lock
+    async def list(self, sort=None, reverse=False, after=None, limit=None):
+        query = 'SELECT {} FROM notes'.format(', '.join(HEADER_COLUMNS))
+        params = []
+        if sort is not None or after is not None or limit is not None:
+            sort = sort or 'id'
+            if sort not in SORT_FIELDS:
+                raise ValueError('Cannot sort by {!r}'.format(sort))
+            if after is not None:
+                value, note_id = after
+                if isinstance(value, datetime.datetime):
+                    value = format_datetime(value)
+                query += ' WHERE ({}, id) {} (?, ?)'.format(
+                    sort, '<' if reverse else '>')
+                params += [value, note_id]
+            query += ' ORDER BY {0} {1}, id {1}'.format(
+                sort, 'DESC' if reverse else 'ASC')
+            if limit is not None:
+                query += ' LIMIT ?'
+                params.append(limit)
+
+        rows = await self._run(self._fetchall, query, tuple(params))
+        return [note_from_dict(dict(zip(HEADER_COLUMNS, row))) for row in rows]
+
+    @Lockable.ensure_lock
+    async def changes(self, since=0, limit=None):
+        query = (
+            'SELECT changes.seq, changes.note_id, {} FROM changes '
+            'LEFT JOIN notes ON notes.id = changes.note_id '
+            'WHERE changes.seq > ? ORDER BY changes.seq'.format(
+                ', '.join('notes.{}'.format(column)
+                          for column in HEADER_COLUMNS)))
+        params = [since]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        rows = await self._run(self._fetchall, query, tuple(params))
+        return [
+            Change(row[0], row[1],
+                   None if row[2] is None
+                   else note_from_dict(dict(zip(HEADER_COLUMNS, row[2:]))))
+            for row in rows
+        ]
+
+    @Lockable.ensure_lock
+    async def change_sequence(self):
+        rows = await self._run(
+            self._fetchall, 'SELECT COALESCE(MAX(seq), 0) FROM changes')
+        return self.epoch, rows[0][0]
+
+    @Lockable.ensure_lock
+    async def read(self, id):
+        rows = await self._run(
+            self._fetchall,
+            'SELECT {} FROM notes WHERE id = ?'.format(
+                ', '.join(NOTE_COLUMNS)),
+            (str(id),))
+        if not rows:
+            raise NotFound()
+        return note_from_dict(dict(zip(NOTE_COLUMNS, rows[0])))
+
+    @Lockable.ensure_lock
+    async def read_revision(self, note_id, revision_id):
+        """Returns the note with `note_id` in the revision `revision_id`,
+        which is either the current or one of the last `history_size`
+        revisions."""
+        rows = await self._run(
+            self._fetchall,
+            'SELECT {0} FROM notes WHERE id = ? AND revision_id = ? '
+            'UNION ALL '
+            'SELECT {0} FROM history WHERE id = ? AND revision_id = ? '
+            'LIMIT 1'.format(', '.join(NOTE_COLUMNS)),
+            (str(note_id), str(revision_id)) * 2)
+        if not rows:
+            raise NotFound()
+        return note_from_dict(dict(zip(NOTE_COLUMNS, rows[0])))
+
+    @Lockable.ensure_lock
+    async def revision_digest(self):
+        return (await self.revision_tree()).hexdigest()
+
+    @Lockable.ensure_lock
+    async def revision_tree(self):
+        if self.digest is None:
+            digest = RevisionDigest()
+            for note_id, revision_id in await self._run(
+                    self._fetchall, 'SELECT id, revision_id FROM notes'):
+                digest.add(uuid.UUID(note_id), uuid.UUID(revision_id))
+            self.digest = digest
+        return self.digest
+
+    @Lockable.ensure_lock
+    async def write(self, note):
+        self._update_digest(
+            await self._run(self._write_many, [_note_row(note)], []))
+
+    @Lockable.ensure_lock
+    async def write_many(self, notes, deleted_ids=()):
+        """Writes `notes` and deletes the notes with `deleted_ids` in a
+        single transaction."""
+        self._update_digest(await self._run(
+            self._write_many,
+            [_note_row(note) for note in notes],
+            [str(note_id) for note_id in deleted_ids]))
+
+    @Lockable.ensure_lock
+    async def delete(self, note_id):
+        revisions = await self._run(self._write_many, [], [str(note_id)])
+        self._update_digest(revisions)
+        if not revisions:
+            raise NotFound()
+
+    @Lockable.ensure_lock
+    async def load_status(self, note_ids=None):
+        if note_ids is None:
+            rows = await self._run(
+                self._fetchall, 'SELECT note_id, revision_id FROM status')
+        else:
+            rows = await self._run(self._load_status, [
+                str(note_id) for note_id in note_ids])
+        return {
+            uuid.UUID(note_id): uuid.UUID(revision_id)
+            for note_id, revision_id in rows
+        }
+
+    @Lockable.ensure_lock
+    async def update_status(self, revision_ids, replace=False):
+        """Records the revisions in `revision_ids`, which maps note ids to
+        revision ids, or None for notes that don't exist anymore, as
+        synced. With `replace`, the status of all other notes is removed."""
+        await self._run(self._update_status, [
+            (str(note_id), None if revision_id is None else str(revision_id))
+            for note_id, revision_id in revision_ids.items()
+        ], replace)
+
+    @Lockable.ensure_lock
+    async def load_sync_checkpoint(self):
+        rows = await self._run(
+            self._fetchall,
+            "SELECT value FROM meta WHERE key = 'sync_checkpoint'")
+        return json.loads(rows[0][0]) if rows else None
+
+    @Lockable.ensure_lock
+    async def save_sync_checkpoint(self, checkpoint):
+        await self._run(self._save_sync_checkpoint, json.dumps(checkpoint))
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _fetchall(self, sql, parameters=()):
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def _write_many(self, rows, deleted_ids):
+        """Writes and deletes notes in a single transaction and returns a
+        (note id, old revision id, new revision id) tuple for every note
+        written or deleted, with None for a revision that doesn't exist."""
+        revisions = []
+        with self.connection:
+            for row in rows:
+                revisions.append(
+                    (row[0], self._revision_id(row[0]), row[1]))
+            if self.history_size:
+                self.connection.executemany(
+                    ADD_TO_HISTORY, [(row[0], row[1]) for row in rows])
+                self.connection.executemany(
+                    PRUNE_HISTORY,
+                    [(row[0], row[0], self.history_size) for row in rows])
+            self.connection.executemany(INSERT_NOTE, rows)
+            self.connection.executemany(
+                RECORD_CHANGE, [(row[0],) for row in rows])
+            for note_id in deleted_ids:
+                revision_id = self._revision_id(note_id)
+                if revision_id is not None:
+                    self.connection.execute(
+                        'DELETE FROM notes WHERE id = ?', (note_id,))
+                    self.connection.execute(RECORD_CHANGE, (note_id,))
+                    self.connection.execute(
+                        'DELETE FROM history WHERE id = ?', (note_id,))
+                    revisions.append((note_id, revision_id, None))
+        return revisions
+
+    def _revision_id(self, note_id):
+        row = self.connection.execute(
+            'SELECT revision_id FROM notes WHERE id = ?',
+            (note_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def _update_digest(self, revisions):
+        """Replaces the old revisions of written or deleted notes in the
+        digest, unless it hasn't been built yet."""
+        if self.digest is None:
+            return
+        for note_id, old_revision_id, new_revision_id in revisions:
+            note_id = uuid.UUID(note_id)
+            if old_revision_id is not None:
+                self.digest.remove(note_id, uuid.UUID(old_revision_id))
+            if new_revision_id is not None:
+                self.digest.add(note_id, uuid.UUID(new_revision_id))
+
+    def _load_epoch(self):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                (new_epoch(),))
+            return self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _record_unrecorded_changes(self):
+        """Gives notes written by earlier versions a sequence number."""
+        with self.connection:
+            self.connection.executemany(RECORD_CHANGE, self.connection.execute(
+                'SELECT id FROM notes WHERE id NOT IN '
+                '(SELECT note_id FROM changes)').fetchall())
+
+    def _load_status(self, note_ids):
+        rows = []
+        for start in range(0, len(note_ids), QUERY_BATCH_SIZE):
+            batch = note_ids[start:start + QUERY_BATCH_SIZE]
+            rows += self.connection.execute(
+                'SELECT note_id, revision_id FROM status '
+                'WHERE note_id IN ({})'.format(', '.join('?' for _ in batch)),
+                batch).fetchall()
+        return rows
+
+    def _update_status(self, revision_ids, replace):
+        with self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM status')
+            else:
+                self.connection.executemany(
+                    'DELETE FROM status WHERE note_id = ?',
+                    [(note_id,) for note_id, _ in revision_ids])
+            self.connection.executemany(
+                'INSERT INTO status (note_id, revision_id) VALUES (?, ?)',
+                [row for row in revision_ids if row[1] is not None])
+
+    def _save_sync_checkpoint(self, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('sync_checkpoint', ?)", (value,))
+
+
+def _note_row(note):
+    data = note_to_dict(note)
+    return tuple(data[column] for column in NOTE_COLUMNS)
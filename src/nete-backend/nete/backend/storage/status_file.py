@@ -0,0 +1,73 @@
+import json
+import os
+import os.path
+import uuid
+
+
+class StatusFile:
+    """The revision ids of all notes at the end of the last sync.
+
+    The file is a JSON list of `{"note_id": ..., "revision_id": ...}`
+    objects. It's read once and then kept in memory, so a sync only
+    needs to look up the notes it has to compare.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.status = None
+
+    def load(self, note_ids=None):
+        """Returns a dict mapping the ids of notes (all or `note_ids`) to
+        their revision ids at the last sync."""
+        status = self._status()
+        if note_ids is None:
+            return dict(status)
+        return {
+            note_id: status[note_id]
+            for note_id in note_ids
+            if note_id in status
+        }
+
+    def update(self, revision_ids, replace=False):
+        """Sets the revision ids of the notes in `revision_ids`, which maps
+        note ids to revision ids, or None for notes that don't exist
+        anymore. With `replace`, all other notes are removed."""
+        status = {} if replace else self._status()
+        for note_id, revision_id in revision_ids.items():
+            if revision_id is None:
+                status.pop(note_id, None)
+            else:
+                status[note_id] = revision_id
+        self.status = status
+
+        tmp_filename = '{}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w') as fp:
+            json.dump([
+                {'note_id': str(note_id), 'revision_id': str(revision_id)}
+                for note_id, revision_id in status.items()
+            ], fp)
+        os.replace(tmp_filename, self.filename)
+
+    def _status(self):
+        if self.status is None:
+            self.status = {}
+            if os.path.exists(self.filename):
+                with open(self.filename) as fp:
+                    for item in json.load(fp):
+                        self.status[uuid.UUID(item['note_id'])] = uuid.UUID(
+                            item['revision_id'])
+        return self.status
+
+
+def read_sync_checkpoint(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def write_sync_checkpoint(filename, checkpoint):
+    tmp_filename = '{}.tmp'.format(filename)
+    with open(tmp_filename, 'w') as fp:
+        json.dump(checkpoint, fp)
+    os.replace(tmp_filename, filename)
@@ -1,30 +1,94 @@
-from .nete_client import NeteClient
+from .nete_client import BATCH_GET_SIZE, BULK_SIZE, NeteClient
+from nete.backend.storage.revision_digest import DEPTH
+from nete.backend.storage.exceptions import NotFound
+from nete.common.exceptions import SequenceRestarted, ServerError
+from nete.common.text_delta import make_delta
+import asyncio
 import logging
 import uuid
 
 logger = logging.getLogger(__name__)
 
+# buckets of revision digests with at most this many remote notes are
+# compared note by note
+LEAF_SIZE = 100
+# all notes are compared if more buckets than this differ on one level of
+# the digest trees, or if more remote revisions than this would have to be
+# fetched from the differing buckets
+MAX_DIFFERING_BUCKETS = 256
+MAX_TREE_REVISIONS = 10000
+
 
 class Synchronizer:
+    """Synchronizes a storage with a remote nete-backend.
+
+    If the revision digests of both sides are equal, there is nothing to
+    compare. After every sync, the change sequence numbers of both sides
+    are saved as a checkpoint, and the next sync only compares the notes
+    changed since then. Without a valid checkpoint, e.g. on the first sync
+    or after a change sequence has been restarted, the digest trees of both
+    sides are walked down into the buckets that differ, and all notes are
+    compared only if too many of them differ.
+
+    Notes are transferred in batches, and up to `concurrency` storage reads,
+    requests and batches of storage writes run at the same time, so the
+    round trips to the remote overlap with each other and with local I/O.
+    Notes changed on one side only are sent as deltas against their
+    revision at the last sync if both sides still know it.
 
-    def __init__(self, storage, sync_url):
+    Notes are written locally under `write_lock`, which the request handler
+    holds while it checks and writes notes, too. A note changed locally
+    since it was compared is not overwritten by its remote revision, but
+    kept as a conflict copy first.
+    """
+
+    def __init__(self, storage, sync_url, concurrency=4, write_lock=None):
         self.storage = storage
         self.sync_url = sync_url
+        self.concurrency = concurrency
+        self.write_lock = write_lock or asyncio.Lock()
 
     async def synchronize(self):
         logger.info('Starting sync')
+        self.semaphore = asyncio.Semaphore(self.concurrency)
 
-        status = self.storage.load_status()
+        local_epoch, local_seq = await self.storage.change_sequence()
+        checkpoint = await self._load_checkpoint(local_epoch)
+        local_tree = await self.storage.revision_tree()
 
         async with NeteClient(self.sync_url) as client:
-            local_revisions = {
-                note.id: note.revision_id
-                for note in await self.storage.list()
-            }
-            remote_revisions = {
-                note.id: note.revision_id
-                for note in await client.list_notes()
-            }
+            remote_epoch, remote_seq, remote_digest, remote_buckets = (
+                await client.revision_buckets(['']))
+
+            # the revisions of all local notes when they are compared, which
+            # are synced unless they are compared one by one
+            local_snapshot = None
+            comparison = None
+            if remote_digest == local_tree.hexdigest():
+                if checkpoint is None:
+                    local_snapshot = local_tree.revisions([''])
+                comparison = await self._compare_nothing(
+                    checkpoint, local_tree, remote_digest)
+            if comparison is None:
+                if checkpoint is not None:
+                    if checkpoint['remote_epoch'] == remote_epoch:
+                        comparison = await self._compare_changes(
+                            client, checkpoint)
+                    else:
+                        logger.info(
+                            'Remote change sequence has been restarted')
+                if comparison is None:
+                    local_snapshot = local_tree.revisions([''])
+                    comparison = await self._compare_trees(
+                        client, local_tree, remote_buckets)
+                if comparison is None:
+                    comparison = await self._compare_all(client)
+            local_revisions, remote_revisions, status, changed_ids = (
+                comparison)
+            compared_ids = local_revisions.keys() | remote_revisions.keys()
+
+            local_revisions = _existing(local_revisions)
+            remote_revisions = _existing(remote_revisions)
 
             created_there = (
                 remote_revisions.keys() -
@@ -40,8 +104,12 @@ class Synchronizer:
             updated_there = set()
             updated_here_and_there = set()
             for note_id in both:
-                is_changed_here = (local_revisions[note_id] != status[note_id])
-                is_changed_there = (remote_revisions[note_id] != status[note_id])
+                if local_revisions[note_id] == remote_revisions[note_id]:
+                    continue
+                is_changed_here = (
+                    local_revisions[note_id] != status.get(note_id))
+                is_changed_there = (
+                    remote_revisions[note_id] != status.get(note_id))
                 if (is_changed_here and not is_changed_there):
                     updated_here.add(note_id)
                 elif (not is_changed_here and is_changed_there):
@@ -62,49 +130,344 @@ class Synchronizer:
                     len(updated_there),
                     len(updated_here_and_there)))
 
-            conflict_copy_ids = await self._create_conflict_copies(
-                updated_here_and_there)
+            written_here = await self._create_conflict_copies(
+                updated_here_and_there, local_revisions)
+            conflict_copy_ids = set(written_here)
+
+            # pushed and pulled notes are disjoint, so both can run at once
+            written_there, pulled = await asyncio.gather(
+                self._push_notes(
+                    client,
+                    created_here | conflict_copy_ids,
+                    [(note_id, status[note_id])
+                     for note_id in updated_here]),
+                self._pull_notes(
+                    client,
+                    created_there | updated_there | updated_here_and_there,
+                    local_revisions,
+                    updated_there))
+            written_here.update(pulled)
+
+            # the changes made by this sync don't need to be compared again
+            local_seq = await self._skip_own_local_changes(
+                local_seq, written_here)
+            remote_seq = await self._skip_own_remote_changes(
+                client, remote_epoch, remote_seq, written_there)
+
+        # notes may have been changed locally during the sync, so only the
+        # revisions that have been compared or transferred are synced
+        synced = dict.fromkeys(compared_ids)
+        synced.update(
+            (note_id, revision_id)
+            for note_id, revision_id in local_revisions.items()
+            if remote_revisions.get(note_id) == revision_id)
+        synced.update(written_here)
+        synced.update(written_there)
+        if changed_ids is None:
+            for note_id, revision_id in local_snapshot.items():
+                synced.setdefault(note_id, revision_id)
+            await self.storage.update_status(synced, replace=True)
+        elif synced:
+            await self.storage.update_status(synced)
+        await self.storage.save_sync_checkpoint({
+            'sync_url': str(self.sync_url),
+            'local_epoch': local_epoch,
+            'local_seq': local_seq,
+            'remote_epoch': remote_epoch,
+            'remote_seq': remote_seq,
+        })
+
+    async def _load_checkpoint(self, local_epoch):
+        checkpoint = await self.storage.load_sync_checkpoint()
+        if checkpoint is None:
+            return None
+        if checkpoint.get('sync_url') != str(self.sync_url):
+            logger.info('Sync URL has changed')
+            return None
+        if checkpoint.get('local_epoch') != local_epoch:
+            logger.info('Local change sequence has been restarted')
+            return None
+        return checkpoint
+
+    async def _compare_nothing(self, checkpoint, local_tree, remote_digest):
+        """Compares no notes as both sides are in sync, only recording the
+        notes changed since the checkpoint as synced. Returns None if notes
+        have been changed locally in the meantime."""
+        if checkpoint is None:
+            logger.info('Notes are in sync')
+            return {}, {}, {}, None
+        changes = await self.storage.changes(checkpoint['local_seq'])
+        if local_tree.hexdigest() != remote_digest:
+            return None
+        logger.info('Notes are in sync')
+        revision_ids = dict(_revision_ids(changes))
+        return revision_ids, dict(revision_ids), {}, set(revision_ids)
+
+    async def _compare_changes(self, client, checkpoint):
+        """Compares the notes changed on either side since the checkpoint.
+        Returns None if the remote change sequence has been restarted."""
+        try:
+            _, _, remote_changes = await client.changes(
+                checkpoint['remote_seq'], checkpoint['remote_epoch'])
+        except SequenceRestarted:
+            logger.info('Remote change sequence has been restarted')
+            return None
+
+        local_revisions = dict(_revision_ids(await self.storage.changes(
+            checkpoint['local_seq'])))
+        remote_revisions = dict(remote_changes)
+        changed_ids = local_revisions.keys() | remote_revisions.keys()
+        status = await self.storage.load_status(changed_ids)
+        # a note that hasn't changed on one side is still in the state of
+        # the last sync there
+        for note_id in changed_ids:
+            local_revisions.setdefault(note_id, status.get(note_id))
+            remote_revisions.setdefault(note_id, status.get(note_id))
+        return local_revisions, remote_revisions, status, changed_ids
+
+    async def _compare_trees(self, client, local_tree, remote_buckets):
+        """Compares the notes in the buckets whose revision digests differ,
+        walking down both digest trees one level at a time, starting with
+        the `remote_buckets` below the root. Returns None if too many notes
+        differ for this to be any faster than comparing all notes."""
+        async def children(prefixes):
+            if not prefixes:
+                return {}
+            return (await self._limited(client.revision_buckets(prefixes)))[3]
+
+        async def revisions(prefixes):
+            if not prefixes:
+                return {}
+            return await self._limited(client.revisions(prefixes))
+
+        local_revisions = {}
+        remote_revisions = {}
+        remote_count = 0
+        prefixes = ['']
+        while prefixes:
+            local_buckets = local_tree.children(prefixes)
+            differing = [
+                prefix
+                for prefix in local_buckets.keys() | remote_buckets.keys()
+                if local_buckets.get(prefix) != remote_buckets.get(prefix)
+            ]
+            if len(differing) > MAX_DIFFERING_BUCKETS:
+                return None
+
+            # buckets that are small or empty on one side are compared
+            # note by note instead of walking further down
+            leaves = [
+                prefix for prefix in differing
+                if len(prefix) == DEPTH or
+                prefix not in local_buckets or
+                remote_buckets.get(prefix, (None, 0))[1] <= LEAF_SIZE
+            ]
+            remote_leaves = [
+                prefix for prefix in leaves if prefix in remote_buckets]
+            remote_count += sum(
+                remote_buckets[prefix][1] for prefix in remote_leaves)
+            if remote_count > MAX_TREE_REVISIONS:
+                return None
+
+            prefixes = [prefix for prefix in differing if prefix not in leaves]
+            logger.debug('Comparing {} buckets, walking into {}'.format(
+                len(leaves), len(prefixes)))
+            local_revisions.update(local_tree.revisions(leaves))
+            leaf_revisions, remote_buckets = await asyncio.gather(
+                revisions(remote_leaves), children(prefixes))
+            remote_revisions.update(leaf_revisions)
+
+        compared_ids = local_revisions.keys() | remote_revisions.keys()
+        status = await self.storage.load_status(compared_ids)
+        return local_revisions, remote_revisions, status, None
 
-            await self._create_notes(
-                client,
-                [note_id for note_id in created_here | conflict_copy_ids])
-            await self._update_notes(
-                client,
-                [(note_id, status[note_id])
-                 for note_id in updated_here])
-            await self._pull_notes(
-                client,
-                created_there | updated_there | updated_here_and_there)
+    async def _compare_all(self, client):
+        logger.info('Comparing all notes')
+        _, _, remote_changes = await client.changes()
+        local_revisions = dict(_revision_ids(await self.storage.changes()))
+        status = await self.storage.load_status()
+        return local_revisions, dict(remote_changes), status, None
 
-        await self.storage.update_status()
+    async def _skip_own_local_changes(self, seq, written):
+        """Returns the sequence number of the latest local change if all
+        changes since `seq` are the writes in `written`, which maps note ids
+        to revision ids, and `seq` otherwise."""
+        if not written:
+            return seq
+        changes = await self.storage.changes(seq)
+        if changes and _are_own_changes(_revision_ids(changes), written):
+            return changes[-1].seq
+        return seq
 
-    async def _create_notes(self, client, note_ids):
-        for note_id in note_ids:
+    async def _skip_own_remote_changes(self, client, epoch, seq, written):
+        if not written:
+            return seq
+        try:
+            _, latest_seq, changes = await client.changes(seq, epoch)
+        except SequenceRestarted:
+            return seq
+        return latest_seq if _are_own_changes(changes, written) else seq
+
+    async def _push_notes(self, client, created_ids,
+                          note_ids_and_revision_ids):
+        async def create(note_id):
             logger.debug('Creating note {}'.format(note_id))
             note = await self.storage.read(note_id)
-            await client.create_note(note)
+            return {'op': 'create', 'note': note}
 
-    async def _update_notes(self, client, note_ids_and_revision_ids):
-        for (note_id, old_revision_id) in note_ids_and_revision_ids:
+        async def update(note_id, old_revision_id):
             note = await self.storage.read(note_id)
             logger.debug('Updating note {} (rev id: {}, old rev id: {})'
                          .format(note.id, note.revision_id, old_revision_id))
-            await client.update_note(note, old_revision_id)
-
-    async def _pull_notes(self, client, note_ids):
-        for note_id in note_ids:
-            logger.debug('Pulling note {}'.format(note_id))
-            note = await client.get_note(note_id)
-            await self.storage.write(note)
-            logger.debug('write note: {!r}'.format(note))
-
-    async def _create_conflict_copies(self, note_ids):
-        conflict_copy_ids = set()
-        for note_id in note_ids:
-            note = await self.storage.read(note_id)
-            note.id = uuid.uuid4()
-            note.revision_id = uuid.uuid4()
-            await self.storage.write(note)
-            conflict_copy_ids.add(note.id)
+            operation = {
+                'op': 'update',
+                'note': note,
+                'if_match': str(old_revision_id),
+            }
+            delta = await self._delta(note, old_revision_id)
+            if delta is not None:
+                operation['delta'] = delta
+            return operation
+
+        async def push(batch):
+            # the notes of a batch are read while earlier batches are sent,
+            # and only as many batches as run at the same time are kept
+            async with self.semaphore:
+                operations = await asyncio.gather(*[
+                    update(note_id, old_revision_id)
+                    if old_revision_id is not None else create(note_id)
+                    for note_id, old_revision_id in batch])
+                results = await client.bulk(operations)
+            errors = [
+                '{} {}: {} {}'.format(
+                    operation['op'], operation['note'].id,
+                    result['status'], result.get('reason'))
+                for operation, result in zip(operations, results)
+                if result['status'] >= 400
+            ]
+            return operations, errors
+
+        note_ids_and_revision_ids = (
+            [(note_id, None) for note_id in created_ids] +
+            list(note_ids_and_revision_ids))
+        batches = await asyncio.gather(*[
+            push(note_ids_and_revision_ids[start:start + BULK_SIZE])
+            for start in range(0, len(note_ids_and_revision_ids), BULK_SIZE)
+        ])
+        errors = [error for _, errors in batches for error in errors]
+        if errors:
+            raise ServerError(
+                'Error during sync:\n{}'.format('\n'.join(errors)))
+
+        return {
+            operation['note'].id: operation['note'].revision_id
+            for operations, _ in batches
+            for operation in operations
+        }
+
+    async def _pull_notes(self, client, note_ids, local_revisions,
+                          unchanged_ids=()):
+        """Pulls the notes with `note_ids` from the remote. `local_revisions`
+        are the revisions of the local notes that have been compared. The
+        notes with `unchanged_ids` are still in the revision of the last sync
+        here and may be sent as deltas against it."""
+        async def pull(batch):
+            logger.debug('Pulling {} notes'.format(len(batch)))
+            base_notes = await asyncio.gather(*[
+                self._limited(self.storage.read(note_id))
+                for note_id in batch if note_id in unchanged_ids])
+            notes = await self._limited(client.get_notes(
+                batch, {note.id: note for note in base_notes}))
+            if len(notes) < len(batch):
+                logger.warning('{} notes have been deleted remotely'.format(
+                    len(batch) - len(notes)))
+            # written while the next batches are still being transferred
+            async with self.semaphore, self.write_lock:
+                conflict_copies = await self._copy_changed_notes(
+                    [note.id for note in notes], local_revisions)
+                await self.storage.write_many(conflict_copies + notes)
+            return notes
+
+        note_ids = list(note_ids)
+        batches = await asyncio.gather(*[
+            pull(note_ids[start:start + BATCH_GET_SIZE])
+            for start in range(0, len(note_ids), BATCH_GET_SIZE)
+        ])
+        return {
+            note.id: note.revision_id
+            for notes in batches
+            for note in notes
+        }
+
+    async def _create_conflict_copies(self, note_ids, local_revisions):
+        async with self.write_lock:
+            # notes changed since they were compared are copied when they
+            # are pulled
+            tree = await self.storage.revision_tree()
+            notes = await asyncio.gather(*[
+                self.storage.read(note_id) for note_id in note_ids
+                if tree.revision(note_id) == local_revisions[note_id]
+            ])
+            notes = [_conflict_copy(note) for note in notes]
+            if notes:
+                await self.storage.write_many(notes)
+
+        return {note.id: note.revision_id for note in notes}
+
+    async def _copy_changed_notes(self, note_ids, local_revisions):
+        """Returns conflict copies of the local notes with `note_ids` that
+        have been changed since they were compared, so pulling them doesn't
+        overwrite the changes. The copies are pushed by the next sync."""
+        tree = await self.storage.revision_tree()
+        changed_ids = [
+            note_id for note_id in note_ids
+            if tree.revision(note_id) not in (
+                None, local_revisions.get(note_id))
+        ]
+        if changed_ids:
+            logger.info('{} notes have been changed during the sync'.format(
+                len(changed_ids)))
+        notes = await asyncio.gather(*[
+            self.storage.read(note_id) for note_id in changed_ids])
+        return [_conflict_copy(note) for note in notes]
+
+    async def _delta(self, note, revision_id):
+        """Returns a delta from the revision `revision_id` of `note` to the
+        note, or None if that revision isn't known anymore or the delta
+        wouldn't be smaller than the text."""
+        try:
+            old_note = await self.storage.read_revision(note.id, revision_id)
+        except NotFound:
+            return None
+        return await asyncio.get_event_loop().run_in_executor(
+            None, make_delta, old_note.text, note.text)
+
+    async def _limited(self, coro):
+        async with self.semaphore:
+            return await coro
+
+
+def _conflict_copy(note):
+    note.id = uuid.uuid4()
+    note.revision_id = uuid.uuid4()
+    return note
+
+
+def _existing(revision_ids):
+    return {
+        note_id: revision_id
+        for note_id, revision_id in revision_ids.items()
+        if revision_id is not None
+    }
+
+
+def _revision_ids(changes):
+    for change in changes:
+        yield (uuid.UUID(change.note_id),
+               None if change.note is None else change.note.revision_id)
+
 
-        return conflict_copy_ids
+def _are_own_changes(changes, written):
+    return all(
+        written.get(note_id) == revision_id
+        for note_id, revision_id in changes)
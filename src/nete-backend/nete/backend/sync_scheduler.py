@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SyncScheduler:
+    """Runs syncs in the background, one at a time.
+
+    A sync runs every `interval` seconds and `debounce` seconds after the
+    last of a burst of local changes reported by `notify_change()`; either
+    is disabled if None. `sync()` runs a sync as soon as possible and waits
+    for it; requests made while a sync is running share the next one.
+    """
+
+    def __init__(self, synchronizer, interval=None, debounce=None):
+        self.synchronizer = synchronizer
+        self.interval = interval
+        self.debounce = debounce
+        self.interval_due = None
+        self.change_due = None
+        self.waiters = []
+        self.wakeup = None
+        self.task = None
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        if self.interval:
+            self.interval_due = self._time() + self.interval
+        self.task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        for waiter in self.waiters:
+            waiter.cancel()
+        self.waiters = []
+
+    def notify_change(self):
+        if self.debounce is None or self.task is None:
+            return
+        self.change_due = self._time() + self.debounce
+        self.wakeup.set()
+
+    async def sync(self):
+        if self.task is None:
+            raise RuntimeError('Sync scheduler has not been started')
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        self.wakeup.set()
+        await waiter
+
+    async def _run_forever(self):
+        while True:
+            due = self._next_due()
+            timeout = None if due is None else due - self._time()
+            if timeout is None or timeout > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_once()
+
+    def _next_due(self):
+        # requests that have been cancelled don't need a sync anymore
+        self.waiters = [waiter for waiter in self.waiters if not waiter.done()]
+        if self.waiters:
+            return self._time()
+        return min(
+            (due for due in (self.interval_due, self.change_due)
+             if due is not None),
+            default=None)
+
+    async def _run_once(self):
+        waiters, self.waiters = self.waiters, []
+        self.change_due = None
+        if self.interval:
+            self.interval_due = self._time() + self.interval
+
+        try:
+            await self.synchronizer.synchronize()
+        except Exception as e:
+            logger.exception('Sync failed')
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _time(self):
+        return asyncio.get_event_loop().time()
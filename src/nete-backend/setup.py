@@ -36,6 +36,8 @@ setup(
         'nete.backend',
         'nete.backend.storage',
         'nete.backend.storage.filesystem',
+        'nete.backend.storage.log',
+        'nete.backend.storage.sqlite',
     ],
     entry_points={
         'console_scripts': [
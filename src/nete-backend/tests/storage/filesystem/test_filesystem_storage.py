@@ -1,10 +1,16 @@
 from nete.backend.storage.filesystem import FilesystemStorage
 from nete.backend.storage.exceptions import NotFound
+from nete.backend.storage.filesystem.note_file import read_note_header
 from nete.common.schemas.note_schema import NoteSchema
+import asyncio
 import datetime
+import json
+import os
 import pytest
 import pytz
 import tempfile
+import unittest.mock
+import uuid
 
 
 @pytest.fixture
@@ -108,3 +114,419 @@ async def test_delete_raises_NotFound_if_note_doesnt_exist(storage,
                                                            new_note):
     with pytest.raises(NotFound):
         await storage.delete('NON-EXISTING ID')
+
+
+@pytest.mark.asyncio
+async def test_list_does_not_include_text(storage, new_note):
+    await storage.write(new_note)
+
+    result = await storage.list()
+
+    assert result[0].revision_id == new_note.revision_id
+    assert result[0].text is None
+
+
+@pytest.mark.asyncio
+async def test_list_does_not_read_note_files(storage, new_note):
+    await storage.write(new_note)
+
+    with unittest.mock.patch('builtins.open') as open_mock:
+        result = await storage.list()
+
+    open_mock.assert_not_called()
+    assert len(result) == 1
+
+
+@pytest.mark.asyncio
+async def test_list_does_not_return_deleted_notes(storage, new_note):
+    await storage.write(new_note)
+
+    await storage.delete(new_note.id)
+
+    assert await storage.list() == []
+
+
+@pytest.mark.asyncio
+async def test_open_builds_index_from_existing_notes(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        storage.close()
+
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        try:
+            result = await storage.list()
+        finally:
+            storage.close()
+
+    assert len(result) == 1
+    assert result[0].id == new_note.id
+    assert result[0].title == 'TITLE'
+
+
+@pytest.mark.asyncio
+async def test_open_reads_only_changed_notes_when_index_exists(new_note):
+    other_note = NoteSchema().load({
+        'id': '5b1e4d3a-05f5-4cbe-a5cb-4cbc4d3e1b53',
+        'revision_id': '0c1ad6a0-3c7c-4a4f-9c5a-0d7cd7c6bfc4',
+        'title': 'OTHER TITLE',
+        'text': 'OTHER TEXT',
+    })
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        await storage.write(other_note)
+        storage.close()
+
+        with open(storage._filename(other_note.id), 'w') as fp:
+            other_note.title = 'CHANGED TITLE'
+            fp.write(NoteSchema().dumps(other_note))
+
+        storage = FilesystemStorage(tmp_dir)
+        with unittest.mock.patch(
+                'nete.backend.storage.filesystem.filesystem_storage.'
+                'read_note_header',
+                side_effect=read_note_header) as read_header_mock:
+            storage.open()
+        try:
+            result = await storage.list()
+        finally:
+            storage.close()
+
+    assert read_header_mock.call_count == 1
+    assert (sorted(note.title for note in result) ==
+            ['CHANGED TITLE', 'TITLE'])
+
+
+@pytest.mark.asyncio
+async def test_open_removes_deleted_notes_from_index(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        storage.close()
+
+        os.unlink(storage._filename(new_note.id))
+
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        try:
+            result = await storage.list()
+        finally:
+            storage.close()
+
+    assert result == []
+
+
+@pytest.mark.asyncio
+async def test_open_restores_revision_tree_from_index(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        digest = await storage.revision_digest()
+        storage.close()
+
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        try:
+            tree = await storage.revision_tree()
+            changes = await storage.changes()
+        finally:
+            storage.close()
+
+    assert tree.hexdigest() == digest
+    assert tree.revisions(['']) == {new_note.id: new_note.revision_id}
+    assert [change.note_id for change in changes] == [str(new_note.id)]
+
+
+@pytest.mark.asyncio
+async def test_open_replays_journal_after_crash(new_note):
+    other_note = NoteSchema().load(NoteSchema().dump(new_note))
+    other_note.id = uuid.uuid4()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        await storage.write(other_note)
+        await storage.delete(other_note.id)
+        sequence = await storage.change_sequence()
+        # crash without saving the index
+        storage.index.close_journal()
+        storage.unlock()
+
+        storage = FilesystemStorage(tmp_dir)
+        with unittest.mock.patch(
+                'nete.backend.storage.filesystem.filesystem_storage.'
+                'read_note_header',
+                side_effect=read_note_header) as read_header_mock:
+            storage.open()
+        try:
+            result = await storage.list()
+            changes = await storage.changes()
+            assert await storage.change_sequence() == sequence
+        finally:
+            storage.close()
+
+    assert read_header_mock.call_count == 0
+    assert [note.id for note in result] == [new_note.id]
+    assert ([(change.note_id, change.note is None) for change in changes] ==
+            [(str(new_note.id), False), (str(other_note.id), True)])
+
+
+@pytest.mark.asyncio
+async def test_write_saves_index_when_journal_grows_larger(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        try:
+            with unittest.mock.patch.object(storage.index,
+                                            'MIN_JOURNAL_SIZE', 2):
+                for _ in range(3):
+                    await storage.write(new_note)
+            with open(storage._index_filename()) as fp:
+                seq = json.load(fp)['seq']
+        finally:
+            storage.close()
+
+    assert seq == 3
+
+
+@pytest.mark.asyncio
+async def test_write_leaves_no_temporary_files(storage, new_note):
+    await storage.write(new_note)
+
+    assert sorted(os.listdir(storage.base_dir)) == [
+        '.lock', '{}.nete'.format(new_note.id),
+        'index.json', 'index.json.journal']
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_committed_together(storage, new_note):
+    notes = []
+    for _ in range(5):
+        note = NoteSchema().load(NoteSchema().dump(new_note))
+        note.id = uuid.uuid4()
+        notes.append(note)
+
+    with unittest.mock.patch.object(
+            storage, '_commit_files',
+            side_effect=storage._commit_files) as commit_files_mock:
+        await asyncio.gather(*[storage.write(note) for note in notes])
+
+    assert commit_files_mock.call_count < len(notes)
+    assert len(await storage.list()) == len(notes)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('fsync', ['always', 'never'])
+async def test_write_without_group_commit(fsync, new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir, fsync=fsync)
+        storage.open()
+        try:
+            await storage.write(new_note)
+            note = await storage.read(new_note.id)
+        finally:
+            storage.close()
+
+    assert note.title == 'TITLE'
+
+
+def test_init_raises_ValueError_for_unknown_fsync_mode():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with pytest.raises(ValueError):
+            FilesystemStorage(tmp_dir, fsync='sometimes')
+
+
+def test_open_removes_temporary_files(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_filename = os.path.join(
+            tmp_dir, '{}.nete.0123.tmp'.format(new_note.id))
+        with open(tmp_filename, 'w') as fp:
+            fp.write('{"id": ')
+
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        storage.close()
+
+        assert not os.path.exists(tmp_filename)
+
+
+@pytest.fixture
+def sharded_storage():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir, layout='sharded')
+        storage.open()
+        try:
+            yield storage
+        finally:
+            storage.close()
+
+
+@pytest.mark.asyncio
+async def test_sharded_layout_writes_notes_into_prefix_dirs(
+        sharded_storage, new_note):
+    await sharded_storage.write(new_note)
+
+    assert os.path.exists(os.path.join(
+        sharded_storage.base_dir, '3b', '7f',
+        '3b7f5ad1-2c35-487e-a01e-2a5259c434f9.nete'))
+    assert (await sharded_storage.read(new_note.id)).title == 'TITLE'
+
+
+@pytest.mark.asyncio
+async def test_sharded_layout_reads_and_replaces_notes_in_flat_layout(
+        sharded_storage, new_note):
+    flat_filename = sharded_storage._filename(new_note.id, 'flat')
+    with open(flat_filename, 'w') as fp:
+        fp.write(NoteSchema().dumps(new_note))
+
+    assert (await sharded_storage.read(new_note.id)).title == 'TITLE'
+
+    new_note.title = 'NEW TITLE'
+    await sharded_storage.write(new_note)
+
+    assert not os.path.exists(flat_filename)
+    assert (await sharded_storage.read(new_note.id)).title == 'NEW TITLE'
+
+
+@pytest.mark.asyncio
+async def test_open_indexes_notes_of_both_layouts(new_note):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir, layout='flat')
+        storage.open()
+        await storage.write(new_note)
+        storage.close()
+
+        storage = FilesystemStorage(tmp_dir, layout='sharded')
+        storage.open()
+        new_note.id = uuid.uuid4()
+        await storage.write(new_note)
+        storage.close()
+
+        storage.open()
+        try:
+            result = await storage.list()
+        finally:
+            storage.close()
+
+    assert len(result) == 2
+
+
+@pytest.mark.asyncio
+async def test_write_keeps_note_moved_by_migration_right_after_write(
+        storage, new_note):
+    flat_filename = storage._filename(new_note.id, 'flat')
+    sharded_filename = storage._filename(new_note.id, 'sharded')
+    replace = os.replace
+
+    def replace_and_migrate(src, dst):
+        replace(src, dst)
+        if dst == flat_filename:
+            os.makedirs(os.path.dirname(sharded_filename), exist_ok=True)
+            os.rename(flat_filename, sharded_filename)
+
+    with unittest.mock.patch('os.replace', replace_and_migrate):
+        await storage.write(new_note)
+
+    assert os.path.exists(sharded_filename)
+    assert (await storage.read(new_note.id)).title == 'TITLE'
+
+
+@pytest.mark.asyncio
+async def test_migration_while_writing_keeps_latest_notes(storage, new_note):
+    notes = []
+    for i in range(20):
+        note = NoteSchema().load(NoteSchema().dump(new_note))
+        note.id = uuid.uuid4()
+        notes.append(note)
+    await storage.write_many(notes)
+    migrating = True
+
+    def migrate():
+        # moves the notes back and forth like repeated runs of
+        # scripts/migrate_layout.py
+        layouts = ['sharded', 'flat']
+        while migrating:
+            for note in notes:
+                old_filename, new_filename = [
+                    storage._filename(note.id, layout) for layout in layouts]
+                os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+                if os.path.exists(new_filename):
+                    continue
+                try:
+                    os.rename(old_filename, new_filename)
+                except FileNotFoundError:
+                    pass
+            layouts.reverse()
+
+    migration = asyncio.get_event_loop().run_in_executor(None, migrate)
+    try:
+        for i in range(20):
+            for note in notes:
+                note.text = 'TEXT {}'.format(i)
+            await asyncio.gather(*[storage.write(note) for note in notes])
+            await storage.read(notes[i].id)
+    finally:
+        migrating = False
+        await migration
+
+    for note in notes:
+        assert (await storage.read(note.id)).text == 'TEXT 19'
+        assert len([
+            filename for filename in storage._filenames(note.id)
+            if os.path.exists(filename)]) == 1
+
+
+@pytest.mark.asyncio
+async def test_write_puts_header_before_text(storage, new_note):
+    new_note.text = 'LINE 1\r\nLINE 2\nÄÖÜ'
+    await storage.write(new_note)
+
+    with open(storage._filename(new_note.id), 'rb') as fp:
+        header = json.loads(fp.readline().decode('utf-8'))
+        text = fp.read().decode('utf-8')
+
+    assert header['title'] == 'TITLE'
+    assert 'text' not in header
+    assert text == 'LINE 1\r\nLINE 2\nÄÖÜ'
+    assert (await storage.read(new_note.id)).text == text
+
+
+@pytest.mark.asyncio
+async def test_read_supports_former_file_format(storage, new_note):
+    with open(storage._filename(new_note.id), 'w') as fp:
+        fp.write(NoteSchema().dumps(new_note))
+
+    note = await storage.read(new_note.id)
+    assert note.revision_id == new_note.revision_id
+    assert note.title == 'TITLE'
+    assert note.text == 'TEXT'
+
+
+@pytest.mark.asyncio
+async def test_open_reads_only_headers(new_note):
+    new_note.text = 'x' * 1000000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = FilesystemStorage(tmp_dir)
+        storage.open()
+        await storage.write(new_note)
+        storage.close()
+        os.unlink(os.path.join(tmp_dir, FilesystemStorage.INDEX_FILENAME))
+
+        storage = FilesystemStorage(tmp_dir)
+        with unittest.mock.patch(
+                'nete.backend.storage.filesystem.filesystem_storage.'
+                'read_note_file') as read_note_file_mock:
+            storage.open()
+        try:
+            result = await storage.list()
+        finally:
+            storage.close()
+
+    assert not read_note_file_mock.called
+    assert [note.title for note in result] == ['TITLE']
@@ -0,0 +1,159 @@
+from nete.backend.storage.log import LogStorage
+from nete.backend.storage.exceptions import NotFound
+from nete.common.schemas.note_schema import NoteSchema
+import glob
+import os
+import os.path
+import pytest
+import tempfile
+import uuid
+
+
+@pytest.fixture
+def base_dir():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield tmp_dir
+
+
+@pytest.fixture
+def storage(base_dir):
+    storage = LogStorage(base_dir)
+    storage.open()
+    try:
+        yield storage
+    finally:
+        storage.close()
+
+
+@pytest.fixture
+def new_note():
+    return NoteSchema().load({
+        'id': '3b7f5ad1-2c35-487e-a01e-2a5259c434f9',
+        'revision_id': 'a7e0a4ac-af84-4797-97c4-95cb1ac7c7ed',
+        'title': 'TITLE',
+        'text': 'TEXT',
+    })
+
+
+def reopen(storage):
+    storage.close()
+    storage.open()
+
+
+def segment_filenames(base_dir):
+    return sorted(glob.glob(os.path.join(base_dir, 'segments', '*')))
+
+
+@pytest.mark.asyncio
+async def test_open_replays_log(storage, new_note):
+    await storage.write(new_note)
+    new_note.title = 'NEW TITLE'
+    await storage.write(new_note)
+    deleted_note_id = uuid.uuid4()
+    new_note.id = deleted_note_id
+    await storage.write(new_note)
+    await storage.delete(deleted_note_id)
+
+    reopen(storage)
+
+    result = await storage.list()
+    assert len(result) == 1
+    assert result[0].title == 'NEW TITLE'
+    assert (await storage.read(result[0].id)).text == 'TEXT'
+
+
+@pytest.mark.asyncio
+async def test_open_truncates_partially_written_record(
+        base_dir, storage, new_note):
+    await storage.write(new_note)
+    storage.close()
+    filename = segment_filenames(base_dir)[-1]
+    size = os.path.getsize(filename)
+    with open(filename, 'ab') as fp:
+        fp.write(b'\x00\x00\x01\x00garbage')
+
+    storage.open()
+
+    assert len(await storage.list()) == 1
+    assert os.path.getsize(filename) == size
+
+
+@pytest.mark.asyncio
+async def test_compact_drops_superseded_records(base_dir, storage, new_note):
+    storage.SEGMENT_SIZE = 1
+    for title in ('FIRST', 'SECOND', 'THIRD'):
+        new_note.title = title
+        await storage.write(new_note)
+    other_note_id = uuid.uuid4()
+    new_note.id = other_note_id
+    await storage.write(new_note)
+    await storage.delete(other_note_id)
+
+    await storage.compact()
+
+    assert len(segment_filenames(base_dir)) == 2
+    assert (await storage.read(
+        '3b7f5ad1-2c35-487e-a01e-2a5259c434f9')).title == 'THIRD'
+    reopen(storage)
+    assert [note.title for note in await storage.list()] == ['THIRD']
+
+
+@pytest.mark.asyncio
+async def test_compact_keeps_deletions_in_change_feed(storage, new_note):
+    storage.SEGMENT_SIZE = 1
+    await storage.write(new_note)
+    await storage.delete(new_note.id)
+    epoch, seq = await storage.change_sequence()
+
+    await storage.compact()
+    reopen(storage)
+
+    assert await storage.change_sequence() == (epoch, seq)
+    assert [(change.seq, change.note) for change in await storage.changes()
+            ] == [(seq, None)]
+
+
+@pytest.mark.asyncio
+async def test_open_finishes_committed_compaction(base_dir, storage, new_note):
+    storage.SEGMENT_SIZE = 1
+    await storage.write(new_note)
+    new_note.title = 'NEW TITLE'
+    await storage.write(new_note)
+    await storage.write(new_note)
+    sealed = storage.segments[:-1]
+    live = list(storage.entries.items())
+    await storage._run(
+        storage._write_compacted_segment, sealed[-1].number, live)
+
+    reopen(storage)
+
+    assert [note.title for note in await storage.list()] == ['NEW TITLE']
+    assert not glob.glob(os.path.join(base_dir, 'segments', '*.compact'))
+
+
+@pytest.mark.asyncio
+async def test_open_restores_history(storage, new_note):
+    old_revision_id = new_note.revision_id
+    await storage.write(new_note)
+    new_note.revision_id = uuid.uuid4()
+    new_note.text = 'CHANGED'
+    await storage.write(new_note)
+
+    reopen(storage)
+
+    old_note = await storage.read_revision(new_note.id, old_revision_id)
+    assert old_note.text == 'TEXT'
+
+
+@pytest.mark.asyncio
+async def test_compact_drops_history(storage, new_note):
+    storage.SEGMENT_SIZE = 1
+    old_revision_id = new_note.revision_id
+    await storage.write(new_note)
+    new_note.revision_id = uuid.uuid4()
+    await storage.write(new_note)
+
+    await storage.compact()
+
+    with pytest.raises(NotFound):
+        await storage.read_revision(new_note.id, old_revision_id)
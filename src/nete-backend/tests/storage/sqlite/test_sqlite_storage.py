@@ -0,0 +1,49 @@
+from nete.backend.storage.sqlite import SqliteStorage
+from nete.common.schemas.note_schema import NoteSchema
+import pytest
+import tempfile
+import uuid
+
+
+@pytest.fixture
+def storage():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = SqliteStorage(tmp_dir)
+        storage.open()
+        try:
+            yield storage
+        finally:
+            storage.close()
+
+
+@pytest.fixture
+def new_note():
+    return NoteSchema().load({
+        'id': '3b7f5ad1-2c35-487e-a01e-2a5259c434f9',
+        'revision_id': 'a7e0a4ac-af84-4797-97c4-95cb1ac7c7ed',
+        'title': 'TITLE',
+        'text': 'TEXT',
+    })
+
+
+def test_open_enables_wal_mode(storage):
+    result = storage.connection.execute('PRAGMA journal_mode').fetchone()
+
+    assert result == ('wal',)
+
+
+@pytest.mark.asyncio
+async def test_revision_tree_is_updated_by_writes(storage, new_note):
+    other_note_id = new_note.id
+    await storage.write(new_note)
+    tree = await storage.revision_tree()
+
+    new_note.revision_id = uuid.uuid4()
+    await storage.write(new_note)
+    new_note.id = uuid.uuid4()
+    await storage.write_many([new_note], [other_note_id])
+
+    assert await storage.revision_tree() is tree
+    assert tree.revisions(['']) == {new_note.id: new_note.revision_id}
+    storage.digest = None
+    assert (await storage.revision_tree()).hexdigest() == tree.hexdigest()
@@ -0,0 +1,49 @@
+from nete.backend.storage.change_feed import Change, ChangeFeed, load_epoch
+import os.path
+import tempfile
+
+
+def test_since_returns_latest_change_of_every_note_in_order():
+    feed = ChangeFeed()
+    feed.add('A', 'NOTE A')
+    feed.add('B', 'NOTE B')
+    feed.add('A', None)
+    feed.add('C', 'NOTE C')
+
+    assert [(change.seq, change.note_id, change.note)
+            for change in feed.since()] == [
+        (2, 'B', 'NOTE B'), (3, 'A', None), (4, 'C', 'NOTE C')]
+    assert [change.note_id for change in feed.since(2)] == ['A', 'C']
+    assert [change.note_id for change in feed.since(2, limit=1)] == ['A']
+    assert feed.since(4) == []
+
+
+def test_add_with_sequence_numbers_out_of_order():
+    feed = ChangeFeed()
+    feed.add('B', 'NOTE B', 7)
+    feed.add('A', 'NOTE A', 3)
+
+    assert [change.note_id for change in feed.since()] == ['A', 'B']
+    assert feed.next_seq() == 8
+
+
+def test_add_many_keeps_changes_in_order():
+    feed = ChangeFeed()
+    feed.add_many([
+        Change(7, 'B', 'NOTE B'),
+        Change(3, 'A', 'NOTE A'),
+        Change(5, 'C', None),
+    ])
+
+    assert [change.note_id for change in feed.since()] == ['A', 'C', 'B']
+    assert feed.next_seq() == 8
+
+
+def test_load_epoch_keeps_epoch():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'epoch')
+
+        epoch = load_epoch(filename)
+
+        assert epoch
+        assert load_epoch(filename) == epoch
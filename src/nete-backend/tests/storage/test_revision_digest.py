@@ -0,0 +1,80 @@
+from nete.backend.storage.revision_digest import (
+    DEPTH, RevisionDigest, is_prefix)
+import uuid
+
+
+def make_digest(note_ids):
+    digest = RevisionDigest()
+    for note_id in note_ids:
+        digest.add(note_id, uuid.UUID(int=1))
+    return digest
+
+
+def test_digest_does_not_depend_on_order():
+    note_ids = [uuid.uuid4() for _ in range(10)]
+
+    assert (make_digest(note_ids).hexdigest() ==
+            make_digest(reversed(note_ids)).hexdigest())
+
+
+def test_remove_restores_digest_of_buckets():
+    note_id = uuid.UUID('abcdef00-0000-0000-0000-000000000000')
+    digest = make_digest([uuid.uuid4() for _ in range(10)])
+    buckets = digest.children(['', 'a', 'ab'])
+
+    digest.add(note_id, uuid.uuid4())
+    assert digest.children(['', 'a', 'ab']) != buckets
+    digest.remove(note_id, digest.revisions(['abc'])[note_id])
+
+    assert digest.children(['', 'a', 'ab']) == buckets
+    assert note_id not in digest.revisions([''])
+
+
+def test_children_differ_only_where_notes_differ():
+    note_ids = [uuid.UUID(int=i << 124) for i in range(16)]
+    digest = make_digest(note_ids)
+    other_digest = make_digest(note_ids)
+    other_digest.remove(note_ids[3], uuid.UUID(int=1))
+    other_digest.add(note_ids[3], uuid.UUID(int=2))
+
+    buckets = digest.children([''])
+    other_buckets = other_digest.children([''])
+    assert [prefix for prefix in buckets
+            if buckets[prefix] != other_buckets[prefix]] == ['3']
+    assert buckets['3'][1] == 1
+
+
+def test_revisions_returns_notes_in_buckets():
+    note_ids = [
+        uuid.UUID('a0000000-0000-0000-0000-000000000000'),
+        uuid.UUID('ab000000-0000-0000-0000-000000000000'),
+        uuid.UUID('b0000000-0000-0000-0000-000000000000'),
+    ]
+    digest = make_digest(note_ids)
+
+    assert digest.revisions(['a']).keys() == set(note_ids[:2])
+    assert digest.revisions(['ab', 'b']).keys() == set(note_ids[1:])
+    assert digest.revisions([]) == {}
+    assert digest.revision(note_ids[1]) == uuid.UUID(int=1)
+    assert digest.revision(uuid.uuid4()) is None
+
+
+def test_restore_returns_dumped_digest():
+    digest = make_digest([uuid.uuid4() for _ in range(10)])
+
+    restored = RevisionDigest.restore(digest.dump(), digest.leaves)
+    note_id = uuid.uuid4()
+    for d in (digest, restored):
+        d.add(note_id, uuid.UUID(int=1))
+
+    assert restored.hexdigest() == digest.hexdigest()
+    assert (restored.children(['', '0', 'a']) ==
+            digest.children(['', '0', 'a']))
+    assert restored.revisions(['']) == digest.revisions([''])
+
+
+def test_is_prefix():
+    assert is_prefix('')
+    assert is_prefix('a' * DEPTH)
+    assert not is_prefix('a' * (DEPTH + 1))
+    assert not is_prefix('xy')
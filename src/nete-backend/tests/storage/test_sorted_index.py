@@ -0,0 +1,49 @@
+from nete.backend.storage.sorted_index import (
+    SortedIndex, decode_cursor, encode_cursor, parse_sort, sort_key)
+from nete.common.models import NoteHeader
+import datetime
+import pytest
+import uuid
+
+
+def make_note(title, updated_at=None):
+    return NoteHeader(id=uuid.uuid4(), revision_id=uuid.uuid4(),
+                      title=title, updated_at=updated_at)
+
+
+def test_parse_sort():
+    assert parse_sort('title') == ('title', False)
+    assert parse_sort('-updated_at') == ('updated_at', True)
+    with pytest.raises(ValueError):
+        parse_sort('text')
+
+
+def test_cursor_round_trip():
+    note = make_note('TITLE', datetime.datetime(
+        2018, 3, 6, 17, 35, tzinfo=datetime.timezone.utc))
+    key = sort_key(note, 'updated_at')
+
+    assert decode_cursor(encode_cursor('updated_at', key), 'updated_at') == key
+
+
+def test_decode_cursor_for_other_sort_field_fails():
+    cursor = encode_cursor('title', sort_key(make_note('TITLE'), 'title'))
+
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, 'updated_at')
+
+
+def test_page_follows_changes():
+    index = SortedIndex()
+    notes = [make_note(title) for title in ('B', 'A', 'C')]
+    for note in notes:
+        index.add(note)
+    assert [note.title for note in index.page('title')] == ['A', 'B', 'C']
+
+    index.remove(notes[0].id)
+    index.add(make_note('AA'))
+
+    assert ([note.title for note in index.page('title', limit=2)] ==
+            ['A', 'AA'])
+    assert ([note.title for note in index.page('title', reverse=True)] ==
+            ['C', 'AA', 'A'])
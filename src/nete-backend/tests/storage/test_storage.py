@@ -0,0 +1,264 @@
+from nete.backend.storage.exceptions import NotFound
+from nete.backend.storage.filesystem import FilesystemStorage
+from nete.backend.storage.log import LogStorage
+from nete.backend.storage.sorted_index import sort_key
+from nete.backend.storage.sqlite import SqliteStorage
+from nete.common.schemas.note_schema import NoteSchema
+import pytest
+import pytz
+import tempfile
+import uuid
+
+
+@pytest.fixture(
+    params=[FilesystemStorage, LogStorage, SqliteStorage],
+    ids=['filesystem', 'log', 'sqlite'])
+def storage(request):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = request.param(tmp_dir)
+        storage.open()
+        try:
+            yield storage
+        finally:
+            storage.close()
+
+
+@pytest.fixture
+def new_note():
+    return NoteSchema().load({
+        'id': '3b7f5ad1-2c35-487e-a01e-2a5259c434f9',
+        'revision_id': 'a7e0a4ac-af84-4797-97c4-95cb1ac7c7ed',
+        'title': 'TITLE',
+        'text': 'TEXT',
+    })
+
+
+def reopen(storage):
+    storage.close()
+    storage.open()
+
+
+@pytest.mark.asyncio
+async def test_list(storage, new_note):
+    assert await storage.list() == []
+
+    await storage.write(new_note)
+
+    result = await storage.list()
+
+    assert len(result) == 1
+    assert result[0].id == new_note.id
+    assert result[0].revision_id == new_note.revision_id
+    assert result[0].title == new_note.title
+    assert result[0].text is None
+    assert (result[0].created_at ==
+            new_note.created_at.replace(tzinfo=pytz.UTC))
+    assert (result[0].updated_at ==
+            new_note.updated_at.replace(tzinfo=pytz.UTC))
+
+
+@pytest.mark.asyncio
+async def test_read_raises_NotFound_when_id_not_found(storage):
+    with pytest.raises(NotFound):
+        await storage.read('NON-EXISTING ID')
+
+
+@pytest.mark.asyncio
+async def test_write_writes_note_that_can_be_read(storage, new_note):
+    await storage.write(new_note)
+
+    note = await storage.read(new_note.id)
+
+    assert note.id == new_note.id
+    assert note.revision_id == new_note.revision_id
+    assert note.title == 'TITLE'
+    assert note.text == 'TEXT'
+
+
+@pytest.mark.asyncio
+async def test_write_updates_existing_note(storage, new_note):
+    await storage.write(new_note)
+
+    new_note.revision_id = uuid.uuid4()
+    new_note.title = 'NEW TITLE'
+    new_note.text = 'NEW TEXT'
+    await storage.write(new_note)
+
+    updated_note = await storage.read(new_note.id)
+    assert updated_note.revision_id == new_note.revision_id
+    assert updated_note.title == 'NEW TITLE'
+    assert updated_note.text == 'NEW TEXT'
+    assert len(await storage.list()) == 1
+
+
+@pytest.mark.asyncio
+async def test_delete_removes_note(storage, new_note):
+    await storage.write(new_note)
+
+    await storage.delete(new_note.id)
+
+    with pytest.raises(NotFound):
+        await storage.read(new_note.id)
+    with pytest.raises(NotFound):
+        await storage.delete(new_note.id)
+
+
+@pytest.mark.asyncio
+async def test_delete_raises_NotFound_if_note_doesnt_exist(storage):
+    with pytest.raises(NotFound):
+        await storage.delete('NON-EXISTING ID')
+
+
+@pytest.mark.asyncio
+async def test_list_pages_sorted_by_title(storage, new_note):
+    for title in ('B', 'A', 'D', 'C'):
+        new_note.id = uuid.uuid4()
+        new_note.title = title
+        await storage.write(new_note)
+    await storage.delete(new_note.id)
+
+    first_page = await storage.list(sort='title', limit=2)
+    second_page = await storage.list(
+        sort='title', after=sort_key(first_page[-1], 'title'), limit=2)
+    reversed_page = await storage.list(
+        sort='title', reverse=True, after=sort_key(second_page[-1], 'title'))
+
+    assert [note.title for note in first_page] == ['A', 'B']
+    assert [note.title for note in second_page] == ['D']
+    assert [note.title for note in reversed_page] == ['B', 'A']
+
+
+@pytest.mark.asyncio
+async def test_revision_digest_follows_changes(storage, new_note):
+    empty_digest = await storage.revision_digest()
+    await storage.write(new_note)
+    digest = await storage.revision_digest()
+
+    new_note.revision_id = uuid.uuid4()
+    await storage.write(new_note)
+    changed_digest = await storage.revision_digest()
+    await storage.delete(new_note.id)
+
+    assert len({empty_digest, digest, changed_digest}) == 3
+    assert await storage.revision_digest() == empty_digest
+
+
+@pytest.mark.asyncio
+async def test_revision_tree_contains_revisions(storage, new_note):
+    await storage.write(new_note)
+
+    tree = await storage.revision_tree()
+
+    assert tree.revisions(['']) == {new_note.id: new_note.revision_id}
+    assert tree.hexdigest() == await storage.revision_digest()
+
+
+@pytest.mark.asyncio
+async def test_write_many_writes_and_deletes_notes(storage, new_note):
+    await storage.write(new_note)
+    other_notes = [
+        NoteSchema().load({
+            'id': str(uuid.uuid4()),
+            'revision_id': str(uuid.uuid4()),
+            'title': 'TITLE {}'.format(i),
+            'text': 'TEXT {}'.format(i),
+        })
+        for i in range(2)
+    ]
+
+    await storage.write_many(other_notes, [new_note.id])
+
+    reopen(storage)
+
+    assert ({note.id for note in await storage.list()} ==
+            {note.id for note in other_notes})
+    assert (await storage.read(other_notes[1].id)).text == 'TEXT 1'
+    with pytest.raises(NotFound):
+        await storage.read(new_note.id)
+
+
+@pytest.mark.asyncio
+async def test_changes_follow_writes_and_deletes(storage, new_note):
+    epoch, seq = await storage.change_sequence()
+    await storage.write(new_note)
+    other_note = NoteSchema().load({
+        'id': str(uuid.uuid4()),
+        'revision_id': str(uuid.uuid4()),
+        'title': 'OTHER TITLE',
+        'text': 'TEXT',
+    })
+    await storage.write(other_note)
+    await storage.delete(new_note.id)
+    reopen(storage)
+
+    changes = await storage.changes(seq)
+
+    assert await storage.change_sequence() == (epoch, changes[-1].seq)
+    assert [(change.note_id, change.note and change.note.title)
+            for change in changes] == [
+        (str(other_note.id), 'OTHER TITLE'), (str(new_note.id), None)]
+    assert await storage.changes(changes[0].seq) == changes[1:]
+
+
+@pytest.mark.asyncio
+async def test_update_status_stores_revisions(storage, new_note):
+    assert await storage.load_status() == {}
+
+    await storage.update_status(
+        {new_note.id: new_note.revision_id}, replace=True)
+    reopen(storage)
+
+    assert await storage.load_status() == {
+        new_note.id: new_note.revision_id,
+    }
+
+
+@pytest.mark.asyncio
+async def test_update_status_for_some_notes(storage):
+    note_id, other_note_id = uuid.uuid4(), uuid.uuid4()
+    revision_id, other_revision_id = uuid.uuid4(), uuid.uuid4()
+    await storage.update_status(
+        {note_id: revision_id, other_note_id: other_revision_id},
+        replace=True)
+
+    new_revision_id = uuid.uuid4()
+    await storage.update_status({note_id: new_revision_id})
+    assert await storage.load_status([note_id, other_note_id]) == {
+        note_id: new_revision_id, other_note_id: other_revision_id}
+
+    await storage.update_status({note_id: None})
+    assert await storage.load_status() == {other_note_id: other_revision_id}
+
+    await storage.update_status({note_id: revision_id}, replace=True)
+    assert await storage.load_status() == {note_id: revision_id}
+
+
+@pytest.mark.asyncio
+async def test_sync_checkpoint_is_saved(storage):
+    assert await storage.load_sync_checkpoint() is None
+
+    await storage.save_sync_checkpoint({'local_seq': 5})
+    reopen(storage)
+
+    assert await storage.load_sync_checkpoint() == {'local_seq': 5}
+
+
+@pytest.mark.asyncio
+async def test_read_revision_returns_recent_revisions(storage, new_note):
+    revision_ids = []
+    for text in ('TEXT 1', 'TEXT 2', 'TEXT 3', 'TEXT 4'):
+        new_note.revision_id = uuid.uuid4()
+        new_note.text = text
+        await storage.write(new_note)
+        revision_ids.append(new_note.revision_id)
+
+    assert [
+        (await storage.read_revision(new_note.id, revision_id)).text
+        for revision_id in revision_ids[1:]
+    ] == ['TEXT 2', 'TEXT 3', 'TEXT 4']
+    with pytest.raises(NotFound):
+        await storage.read_revision(new_note.id, revision_ids[0])
+
+    await storage.delete(new_note.id)
+    with pytest.raises(NotFound):
+        await storage.read_revision(new_note.id, revision_ids[2])
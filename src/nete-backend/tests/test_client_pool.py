@@ -0,0 +1,37 @@
+from nete.backend.app import create_app
+from nete.backend.nete_client import NeteClient, client_pool
+from nete.common.nete_url import NeteUrl
+import pytest
+import unittest.mock
+
+
+@pytest.fixture
+def remote_url(loop, test_server):
+    storage = unittest.mock.MagicMock()
+
+    async def change_sequence():
+        return 'EPOCH', 0
+
+    async def changes(since=0, limit=None):
+        return []
+
+    storage.change_sequence = change_sequence
+    storage.changes = changes
+    server = loop.run_until_complete(test_server(create_app(storage)))
+    return NeteUrl.from_string(str(server.make_url('')))
+
+
+async def test_clients_share_session_and_connections(remote_url):
+    async with NeteClient(remote_url) as client:
+        await client.changes()
+        session = client.session
+    async with NeteClient(remote_url) as client:
+        await client.changes()
+
+        assert client.session is session
+        assert not session.closed
+        # the connection of the first request has been released and reused
+        assert len(session.connector._conns) == 1
+
+    await client_pool.close()
+    assert session.closed
@@ -0,0 +1,17 @@
+from nete.backend.config import Config, build_parser, defaults
+
+
+def test_command_line_options_override_defaults():
+    config = Config(build_parser(), defaults)
+
+    config.parse_args([
+        '--no-rc',
+        '--storage-base-dir', './notes',
+        '--storage-history-size', '5',
+        '--sync-interval', '30',
+    ])
+
+    assert config['storage.base_dir'] == './notes'
+    assert config['storage.history_size'] == 5
+    assert config['sync.interval'] == 30.0
+    assert config['storage.fsync'] == 'group'
@@ -0,0 +1,66 @@
+from nete.backend.connection_method import SshTunnel
+from nete.common.nete_url import NeteUrl
+import asyncio
+import pytest
+import unittest.mock
+
+
+class FakeSshConnection:
+
+    def __init__(self):
+        self.closed = asyncio.Event()
+        self.commands = []
+        self.forwards = []
+
+    async def run(self, command, check):
+        self.commands.append(command)
+        return unittest.mock.Mock(stdout='/run/nete/socket\n')
+
+    async def forward_local_path(self, local_path, remote_path):
+        self.forwards.append((local_path, remote_path))
+
+    async def wait_closed(self):
+        await self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+@pytest.fixture
+def connections():
+    connections = []
+
+    async def connect(*args, **kwargs):
+        connections.append(FakeSshConnection())
+        return connections[-1]
+
+    with unittest.mock.patch('asyncssh.connect', connect):
+        yield connections
+
+
+@pytest.fixture
+def tunnel(loop):
+    tunnel = SshTunnel(NeteUrl.from_string('http+ssh://user@host'))
+    yield tunnel
+    loop.run_until_complete(tunnel.close())
+
+
+async def test_open_reuses_connection(tunnel, connections):
+    await tunnel.open()
+    await tunnel.open()
+
+    assert len(connections) == 1
+    assert connections[0].commands == ['nete socket']
+    assert connections[0].forwards == [
+        (tunnel.local_socket, '/run/nete/socket')]
+
+
+async def test_open_reconnects_after_connection_dropped(tunnel, connections):
+    await tunnel.open()
+    connections[0].close()
+    await asyncio.sleep(0)
+
+    await tunnel.open()
+
+    assert len(connections) == 2
+    assert tunnel.is_open
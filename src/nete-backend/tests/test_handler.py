@@ -1,7 +1,10 @@
 from nete.backend.handler import Handler
+from nete.backend.storage.change_feed import Change
 from nete.backend.storage.exceptions import NotFound
+from nete.backend.storage.revision_digest import RevisionDigest
 from nete.backend.app import create_app
-from nete.common.models import Note
+from nete.common.models import Note, NoteHeader
+import asyncio
 import datetime
 import json
 import pytest
@@ -36,7 +39,10 @@ class TestHandler:
 
     @pytest.fixture
     def storage(self):
-        return AsyncMock()
+        storage = AsyncMock()
+        storage.revision_digest.return_value = 'DIGEST'
+        storage.revision_tree.return_value = RevisionDigest()
+        return storage
 
     @pytest.fixture
     def handler(self, storage):
@@ -48,14 +54,195 @@ class TestHandler:
         return loop.run_until_complete(test_client(app))
 
     async def test_index(self, client, storage):
-        storage.list.return_value = [{'title': 'foo'}, {'title': 'bar'}]
+        id = uuid.uuid4()
+        revision_id = uuid.uuid4()
+        storage.list.return_value = [
+            Note(
+                id=id,
+                revision_id=revision_id,
+                created_at=datetime.datetime(
+                    2018, 3, 6, 17, 35, 00, tzinfo=pytz.UTC),
+                updated_at=datetime.datetime(
+                    2018, 4, 7, 10, 23, 45, tzinfo=pytz.UTC),
+                title='foo'),
+        ]
 
         response = await client.get('/notes')
 
         assert response.status == 200
         assert response.content_type == 'application/json'
-        assert json.loads(await response.text()) == [
-            {'title': 'foo'}, {'title': 'bar'}]
+        assert response.headers['transfer-encoding'] == 'chunked'
+        assert json.loads(await response.text()) == [{
+            'id': str(id),
+            'revision_id': str(revision_id),
+            'created_at': '2018-03-06T17:35:00+00:00',
+            'updated_at': '2018-04-07T10:23:45+00:00',
+            'title': 'foo',
+        }]
+
+    async def test_index_returns_not_modified_for_matching_etag(
+            self, client, storage):
+        storage.list.return_value = []
+        response = await client.get('/notes')
+        etag = response.headers['etag']
+        storage.list.reset_mock()
+
+        response = await client.get(
+            '/notes', headers={'if-none-match': etag})
+
+        assert response.status == 304
+        assert response.headers['etag'] == etag
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert not storage.list.called
+
+    async def test_index_etag_is_quoted_and_weak(self, client, storage):
+        storage.list.return_value = []
+
+        response = await client.get('/notes')
+
+        assert response.headers['etag'] == 'W/"DIGEST"'
+
+    async def test_index_etag_depends_on_revisions_and_query(
+            self, client, storage):
+        storage.list.return_value = []
+
+        etag = (await client.get('/notes')).headers['etag']
+        page_etag = (await client.get('/notes?limit=10')).headers['etag']
+        storage.revision_digest.return_value = 'CHANGED DIGEST'
+        changed_etag = (await client.get('/notes')).headers['etag']
+
+        assert len({etag, page_etag, changed_etag}) == 3
+
+    async def test_index_returns_page_with_link_to_next_page(
+            self, client, storage):
+        notes = [
+            Note(id=uuid.uuid4(), revision_id=uuid.uuid4(), title=title)
+            for title in ('A', 'B', 'C')
+        ]
+        storage.list.return_value = notes
+
+        response = await client.get('/notes?sort=title&limit=2')
+
+        assert response.status == 200
+        result = json.loads(await response.text())
+        assert [note['title'] for note in result] == ['A', 'B']
+        storage.list.assert_called_once_with(
+            sort='title', reverse=False, after=None, limit=3)
+        assert 'cursor' in response.links['next']['url'].query
+        assert response.links['next']['url'].query['sort'] == 'title'
+
+        storage.list.reset_mock()
+        storage.list.return_value = notes[2:]
+        response = await client.get(
+            response.links['next']['url'].relative())
+
+        assert response.status == 200
+        assert 'link' not in response.headers
+        storage.list.assert_called_once_with(
+            sort='title', reverse=False, after=('B', str(notes[1].id)),
+            limit=3)
+
+    @pytest.mark.parametrize('query', [
+        'sort=text', 'limit=0', 'limit=many', 'cursor=INVALID'])
+    async def test_index_with_invalid_parameters(self, client, query):
+        response = await client.get('/notes?{}'.format(query))
+
+        assert response.status == 400
+
+    async def test_changes(self, client, storage):
+        note = NoteHeader(id=uuid.uuid4(), revision_id=uuid.uuid4(),
+                          title='TITLE')
+        storage.change_sequence.return_value = ('EPOCH', 8)
+        storage.changes.return_value = [
+            Change(7, str(note.id), note),
+            Change(8, 'DELETED-ID', None),
+        ]
+
+        response = await client.get('/notes/changes?since=6&epoch=EPOCH')
+
+        assert response.status == 200
+        storage.changes.assert_called_once_with(6, None)
+        assert await response.json() == {
+            'epoch': 'EPOCH',
+            'seq': 8,
+            'changes': [
+                {
+                    'seq': 7,
+                    'id': str(note.id),
+                    'note': {
+                        'id': str(note.id),
+                        'revision_id': str(note.revision_id),
+                        'created_at': None,
+                        'updated_at': None,
+                        'title': 'TITLE',
+                    },
+                },
+                {'seq': 8, 'id': 'DELETED-ID', 'note': None},
+            ],
+        }
+
+    async def test_changes_returns_page_with_link_to_next_page(
+            self, client, storage):
+        storage.change_sequence.return_value = ('EPOCH', 9)
+        storage.changes.return_value = [
+            Change(seq, 'ID-{}'.format(seq), None) for seq in (7, 8, 9)]
+
+        response = await client.get('/notes/changes?since=6&limit=2')
+
+        storage.changes.assert_called_once_with(6, 3)
+        data = await response.json()
+        assert data['seq'] == 8
+        assert [change['seq'] for change in data['changes']] == [7, 8]
+        assert (str(response.links['next']['url'].relative()) ==
+                '/notes/changes?since=8&limit=2')
+
+    async def test_changes_returns_410_for_other_epoch(self, client, storage):
+        storage.change_sequence.return_value = ('EPOCH', 9)
+
+        response = await client.get('/notes/changes?since=6&epoch=OTHER')
+
+        assert response.status == 410
+
+    async def test_digest(self, client, storage):
+        note_id = uuid.UUID('ab000000-0000-0000-0000-000000000000')
+        tree = RevisionDigest()
+        tree.add(note_id, uuid.uuid4())
+        storage.change_sequence.return_value = ('EPOCH', 3)
+        storage.revision_tree.return_value = tree
+
+        response = await client.get('/notes/digest?prefix=a&prefix=b')
+
+        assert response.status == 200
+        assert await response.json() == {
+            'epoch': 'EPOCH',
+            'seq': 3,
+            'digest': tree.hexdigest(),
+            'buckets': {
+                'ab': {'digest': tree.hexdigest('ab'), 'count': 1},
+            },
+        }
+
+    async def test_digest_returns_400_for_invalid_prefix(
+            self, client, storage):
+        response = await client.get('/notes/digest?prefix=xyz')
+
+        assert response.status == 400
+
+    async def test_revisions(self, client, storage):
+        note_id = uuid.UUID('ab000000-0000-0000-0000-000000000000')
+        revision_id = uuid.uuid4()
+        tree = RevisionDigest()
+        tree.add(note_id, revision_id)
+        tree.add(uuid.UUID('b0000000-0000-0000-0000-000000000000'),
+                 uuid.uuid4())
+        storage.revision_tree.return_value = tree
+
+        response = await client.get('/notes/revisions?prefix=a')
+
+        assert response.status == 200
+        assert await response.json() == {
+            'revisions': {str(note_id): str(revision_id)},
+        }
 
     async def test_get_note(self, client, storage):
         id = uuid.uuid4()
@@ -72,7 +259,7 @@ class TestHandler:
         response = await client.get('/notes/EXISTING')
 
         assert response.status == 200
-        assert response.headers['etag'] == str(revision_id)
+        assert response.headers['etag'] == 'W/"{}"'.format(revision_id)
         assert response.content_type == 'application/json'
         assert json.loads(await response.text()) == {
             'id': str(id),
@@ -83,6 +270,60 @@ class TestHandler:
             'text': 'TEXT',
         }
 
+    async def test_get_note_returns_not_modified_for_matching_etag(
+            self, client, storage):
+        note_id = uuid.uuid4()
+        revision_id = uuid.uuid4()
+        storage.revision_tree.return_value.add(note_id, revision_id)
+
+        response = await client.get(
+            '/notes/{}'.format(note_id),
+            headers={'if-none-match': '"OTHER", "{}"'.format(revision_id)})
+
+        assert response.status == 304
+        assert response.headers['etag'] == 'W/"{}"'.format(revision_id)
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert not storage.read.called
+
+    async def test_get_note_reads_note_for_other_etag(self, client, storage):
+        note_id = uuid.uuid4()
+        revision_id = uuid.uuid4()
+        storage.revision_tree.return_value.add(note_id, uuid.uuid4())
+        storage.read.return_value = Note(
+            id=note_id, revision_id=revision_id, title='TITLE')
+
+        response = await client.get(
+            '/notes/{}'.format(note_id),
+            headers={'if-none-match': 'W/"OTHER"'})
+
+        assert response.status == 200
+        assert response.headers['etag'] == 'W/"{}"'.format(revision_id)
+
+    async def test_get_note_compresses_large_notes(self, client, storage):
+        storage.read.return_value = Note(
+            id=uuid.uuid4(), revision_id=uuid.uuid4(), title='TITLE',
+            text='TEXT ' * 1000)
+
+        response = await client.get(
+            '/notes/EXISTING', headers={'accept-encoding': 'gzip'})
+
+        assert response.status == 200
+        assert response.headers['content-encoding'] == 'gzip'
+        assert response.headers['vary'] == 'Accept-Encoding'
+        assert json.loads(await response.text())['text'] == 'TEXT ' * 1000
+
+    async def test_get_note_does_not_compress_small_notes(
+            self, client, storage):
+        storage.read.return_value = Note(
+            id=uuid.uuid4(), revision_id=uuid.uuid4(), title='TITLE',
+            text='TEXT')
+
+        response = await client.get(
+            '/notes/EXISTING', headers={'accept-encoding': 'gzip'})
+
+        assert response.status == 200
+        assert 'content-encoding' not in response.headers
+
     async def test_get_note_returns_404_when_not_found(self, client, storage):
         storage.read.side_effect = NotFound()
 
@@ -90,6 +331,217 @@ class TestHandler:
 
         assert response.status == 404
 
+    async def test_batch_get_streams_existing_notes(self, client, storage):
+        notes = {
+            note.id: note
+            for note in [
+                Note(id=uuid.uuid4(), revision_id=uuid.uuid4(),
+                     title='TITLE {}'.format(i), text='TEXT')
+                for i in range(3)
+            ]
+        }
+        missing_id = uuid.uuid4()
+
+        def read(note_id):
+            if note_id not in notes:
+                raise NotFound()
+            return notes[note_id]
+        storage.read.side_effect = read
+
+        response = await client.post('/notes/_batch_get', json={
+            'ids': [str(note_id) for note_id in notes] + [str(missing_id)],
+        })
+
+        assert response.status == 200
+        assert response.headers['transfer-encoding'] == 'chunked'
+        assert [note['id'] for note in json.loads(await response.text())] == [
+            str(note_id) for note_id in notes]
+
+    @pytest.mark.parametrize('body', [
+        'NO JSON',
+        '[]',
+        '{"ids": "NO LIST"}',
+        '{"ids": ["NO UUID"]}',
+    ])
+    async def test_batch_get_returns_400_for_invalid_ids(self, client, body):
+        response = await client.post('/notes/_batch_get', data=body)
+
+        assert response.status == 400
+
+    async def test_batch_get_sends_delta_against_base(self, client, storage):
+        base = Note(id=uuid.uuid4(), revision_id=uuid.uuid4(), title='TITLE',
+                    text=''.join('line {}\n'.format(i) for i in range(100)))
+        note = Note(id=base.id, revision_id=uuid.uuid4(), title='TITLE',
+                    text=base.text + 'new line\n')
+        storage.read.return_value = note
+        storage.read_revision.return_value = base
+
+        response = await client.post('/notes/_batch_get', json={
+            'ids': [str(note.id)],
+            'bases': {str(note.id): str(base.revision_id)},
+        })
+
+        assert response.status == 200
+        storage.read_revision.assert_called_once_with(
+            note.id, base.revision_id)
+        [data] = json.loads(await response.text())
+        assert 'text' not in data
+        assert data['base_revision_id'] == str(base.revision_id)
+        assert data['delta'] == [[0, 100], 'new line\n']
+
+    async def test_batch_get_sends_text_for_unknown_base(
+            self, client, storage):
+        note = Note(id=uuid.uuid4(), revision_id=uuid.uuid4(), title='TITLE',
+                    text='TEXT')
+        storage.read.return_value = note
+        storage.read_revision.side_effect = NotFound()
+
+        response = await client.post('/notes/_batch_get', json={
+            'ids': [str(note.id)],
+            'bases': {str(note.id): str(uuid.uuid4())},
+        })
+
+        [data] = json.loads(await response.text())
+        assert data['text'] == 'TEXT'
+        assert 'delta' not in data
+
+    async def test_bulk_applies_operations_and_returns_results(
+            self, client, storage):
+        old_revision_id = uuid.uuid4()
+        existing = Note(
+            id=uuid.uuid4(), revision_id=old_revision_id, title='OLD',
+            text='OLD', created_at=datetime.datetime(
+                2018, 3, 6, 17, 35, 00, tzinfo=pytz.UTC))
+        new_id = uuid.uuid4()
+
+        def read(note_id):
+            if note_id != existing.id:
+                raise NotFound()
+            return existing
+        storage.read.side_effect = read
+
+        def note_data(note_id, title):
+            return {
+                'id': str(note_id),
+                'revision_id': str(uuid.uuid4()),
+                'created_at': '2018-03-06T17:35:00+00:00',
+                'title': title,
+                'text': 'TEXT',
+            }
+
+        response = await client.post('/notes/_bulk', json={'operations': [
+            {'op': 'create', 'note': note_data(new_id, 'NEW')},
+            {'op': 'update', 'note': note_data(existing.id, 'CHANGED'),
+             'if_match': str(old_revision_id)},
+            {'op': 'update', 'note': note_data(uuid.uuid4(), 'MISSING'),
+             'if_match': str(old_revision_id)},
+            {'op': 'delete', 'id': str(existing.id),
+             'if_match': str(uuid.uuid4())},
+            {'op': 'delete', 'id': str(existing.id),
+             'if_match': str(old_revision_id)},
+            {'op': 'move'},
+        ]})
+
+        assert response.status == 200
+        results = (await response.json())['results']
+        assert [result['status'] for result in results] == [
+            201, 200, 404, 409, 422, 400]
+        assert results[0]['id'] == str(new_id)
+        assert 'reason' in results[3]
+        storage.write_many.assert_called_once()
+        notes, deleted_ids = storage.write_many.call_args[0]
+        assert [note.title for note in notes] == ['NEW', 'CHANGED']
+        assert deleted_ids == []
+
+    @pytest.mark.parametrize('body', [
+        'NO JSON',
+        '{"operations": {}}',
+        '{"operations": ["NO OBJECT"]}',
+    ])
+    async def test_bulk_returns_400_for_invalid_operations(
+            self, client, body):
+        response = await client.post('/notes/_bulk', data=body)
+
+        assert response.status == 400
+
+    @pytest.mark.parametrize('delta, status, text', [
+        ([[0, 1], 'NEW LINE\n'], 200, 'OLD LINE\nNEW LINE\n'),
+        ([[0, 5]], 422, None),
+    ])
+    async def test_bulk_applies_delta_of_update(
+            self, client, storage, delta, status, text):
+        existing = Note(
+            id=uuid.uuid4(), revision_id=uuid.uuid4(), title='TITLE',
+            text='OLD LINE\n', created_at=datetime.datetime(
+                2018, 3, 6, 17, 35, 00, tzinfo=pytz.UTC))
+        storage.read.return_value = existing
+
+        response = await client.post('/notes/_bulk', json={'operations': [{
+            'op': 'update',
+            'note': {
+                'id': str(existing.id),
+                'revision_id': str(uuid.uuid4()),
+                'created_at': '2018-03-06T17:35:00+00:00',
+                'title': 'TITLE',
+            },
+            'if_match': str(existing.revision_id),
+            'delta': delta,
+        }]})
+
+        assert response.status == 200
+        [result] = (await response.json())['results']
+        assert result['status'] == status
+        notes, _ = storage.write_many.call_args[0]
+        assert [note.text for note in notes] == ([] if text is None
+                                                 else [text])
+
+    async def test_concurrent_updates_of_same_revision_conflict(
+            self, client, storage):
+        old_revision_id = uuid.uuid4()
+        stored = Note(
+            id=uuid.uuid4(), revision_id=old_revision_id, title='OLD',
+            text='OLD', created_at=datetime.datetime(
+                2018, 3, 6, 17, 35, 00, tzinfo=pytz.UTC))
+
+        async def read(note_id):
+            note = stored
+            # let the other request run between reading and writing
+            await asyncio.sleep(0.01)
+            return note
+
+        def write(note):
+            nonlocal stored
+            stored = note
+
+        def write_many(notes, deleted_ids):
+            for note in notes:
+                write(note)
+
+        storage.read = read
+        storage.write.side_effect = write
+        storage.write_many.side_effect = write_many
+
+        def note_data(title):
+            return {
+                'id': str(stored.id),
+                'revision_id': str(uuid.uuid4()),
+                'created_at': '2018-03-06T17:35:00+00:00',
+                'title': title,
+                'text': 'TEXT',
+            }
+
+        put_response, bulk_response = await asyncio.gather(
+            client.put(
+                '/notes/{}'.format(stored.id), json=note_data('PUT'),
+                headers={'if-match': str(old_revision_id)}),
+            client.post('/notes/_bulk', json={'operations': [
+                {'op': 'update', 'note': note_data('BULK'),
+                 'if_match': str(old_revision_id)},
+            ]}))
+
+        bulk_status = (await bulk_response.json())['results'][0]['status']
+        assert sorted([put_response.status, bulk_status]) == [200, 409]
+
     @pytest.mark.freeze_time
     async def test_create_note(self, client, storage):
         id = uuid.uuid4()
@@ -363,3 +815,26 @@ class TestHandler:
         response = await client.delete('/notes/DOES-NOT-EXIST')
         storage.delete.assert_called_with('DOES-NOT-EXIST')
         assert response.status == 404
+
+    async def test_delete_note_notifies_sync_scheduler(self, storage):
+        sync_scheduler = unittest.mock.MagicMock()
+        handler = Handler(storage, sync_scheduler)
+        request = unittest.mock.MagicMock(match_info={'note_id': 'ID'})
+
+        await handler.delete_note(request)
+
+        sync_scheduler.notify_change.assert_called_once_with()
+
+    async def test_synchronize_waits_for_scheduled_sync(self, storage):
+        sync_scheduler = AsyncMock()
+        sync_scheduler.sync = AsyncMock()
+        handler = Handler(storage, sync_scheduler)
+
+        response = await handler.synchronize(unittest.mock.MagicMock())
+
+        sync_scheduler.sync.assert_called_once_with()
+        assert response.status == 204
+
+    async def test_synchronize_returns_500_without_sync_url(self, client):
+        response = await client.get('/notes/sync')
+        assert response.status == 500
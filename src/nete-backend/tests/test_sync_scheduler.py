@@ -0,0 +1,125 @@
+from nete.backend.sync_scheduler import SyncScheduler
+import asyncio
+import pytest
+
+
+class FakeSynchronizer:
+    def __init__(self, duration=0):
+        self.duration = duration
+        self.runs = 0
+        self.running = 0
+        self.max_running = 0
+        self.error = None
+
+    async def synchronize(self):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.duration)
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.running -= 1
+        self.runs += 1
+
+
+@pytest.fixture
+def synchronizer():
+    return FakeSynchronizer(duration=0.05)
+
+
+async def test_sync_waits_for_a_run(synchronizer):
+    scheduler = SyncScheduler(synchronizer)
+    scheduler.start()
+
+    await scheduler.sync()
+    await scheduler.stop()
+
+    assert synchronizer.runs == 1
+
+
+async def test_sync_raises_error_before_start(synchronizer):
+    scheduler = SyncScheduler(synchronizer)
+
+    with pytest.raises(RuntimeError):
+        await scheduler.sync()
+
+
+async def test_cancelled_sync_requests_dont_start_a_run(synchronizer):
+    scheduler = SyncScheduler(synchronizer)
+    scheduler.start()
+
+    request = asyncio.ensure_future(scheduler.sync())
+    await asyncio.sleep(0)
+    request.cancel()
+    await asyncio.sleep(0.01)
+    await scheduler.stop()
+
+    assert scheduler.waiters == []
+    assert synchronizer.max_running == 0
+
+
+async def test_sync_requests_during_a_run_share_the_next_run(synchronizer):
+    scheduler = SyncScheduler(synchronizer)
+    scheduler.start()
+
+    first = asyncio.ensure_future(scheduler.sync())
+    await asyncio.sleep(0.01)
+    await asyncio.gather(first, scheduler.sync(), scheduler.sync())
+    await scheduler.stop()
+
+    assert synchronizer.runs == 2
+    assert synchronizer.max_running == 1
+
+
+async def test_sync_raises_error_of_run(synchronizer):
+    synchronizer.error = RuntimeError('remote is gone')
+    scheduler = SyncScheduler(synchronizer)
+    scheduler.start()
+
+    with pytest.raises(RuntimeError):
+        await scheduler.sync()
+    synchronizer.error = None
+    await scheduler.sync()
+    await scheduler.stop()
+
+    assert synchronizer.runs == 1
+
+
+async def test_changes_are_debounced():
+    synchronizer = FakeSynchronizer()
+    scheduler = SyncScheduler(synchronizer, debounce=0.05)
+    scheduler.start()
+
+    for _ in range(5):
+        scheduler.notify_change()
+        await asyncio.sleep(0.02)
+    assert synchronizer.runs == 0
+
+    await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    assert synchronizer.runs == 1
+
+
+async def test_changes_are_ignored_without_debounce():
+    synchronizer = FakeSynchronizer()
+    scheduler = SyncScheduler(synchronizer)
+    scheduler.start()
+
+    scheduler.notify_change()
+    await asyncio.sleep(0.05)
+    await scheduler.stop()
+
+    assert synchronizer.runs == 0
+
+
+async def test_runs_every_interval():
+    synchronizer = FakeSynchronizer()
+    scheduler = SyncScheduler(synchronizer, interval=0.05)
+    scheduler.start()
+
+    await asyncio.sleep(0.175)
+    await scheduler.stop()
+
+    assert synchronizer.runs == 3
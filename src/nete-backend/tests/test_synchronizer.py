@@ -0,0 +1,306 @@
+from nete.backend.app import create_app
+from nete.backend.nete_client import NeteClient, listing_cache
+from nete.backend.storage.filesystem import FilesystemStorage
+from nete.backend.sync import Synchronizer
+from nete.common.models import Note
+from nete.common.nete_url import NeteUrl
+from nete.common.text_delta import apply_delta
+import asyncio
+import datetime
+import pytest
+import tempfile
+import unittest.mock
+import uuid
+
+
+def make_storage(base_dir):
+    storage = FilesystemStorage(base_dir)
+    storage.open()
+    return storage
+
+
+@pytest.fixture
+def local_storage():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = make_storage(tmp_dir)
+        yield storage
+        storage.close()
+
+
+@pytest.fixture
+def remote_storage():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = make_storage(tmp_dir)
+        yield storage
+        storage.close()
+
+
+@pytest.fixture
+def synchronizer(loop, test_server, local_storage, remote_storage):
+    server = loop.run_until_complete(
+        test_server(create_app(remote_storage)))
+    sync_url = NeteUrl.from_string(str(server.make_url('')))
+    return Synchronizer(local_storage, sync_url)
+
+
+def make_note(title):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return Note(id=uuid.uuid4(), revision_id=uuid.uuid4(), created_at=now,
+                updated_at=now, title=title, text='TEXT')
+
+
+async def test_synchronize_copies_notes_both_ways(
+        synchronizer, local_storage, remote_storage):
+    local_note = make_note('LOCAL')
+    remote_note = make_note('REMOTE')
+    await local_storage.write(local_note)
+    await remote_storage.write(remote_note)
+
+    await synchronizer.synchronize()
+
+    for storage in (local_storage, remote_storage):
+        assert ({note.title for note in await storage.list()} ==
+                {'LOCAL', 'REMOTE'})
+
+
+async def test_synchronize_only_compares_changed_notes(
+        synchronizer, local_storage, remote_storage):
+    notes = [make_note('NOTE {}'.format(i)) for i in range(3)]
+    for note in notes:
+        await remote_storage.write(note)
+    await synchronizer.synchronize()
+
+    notes[0].title = 'CHANGED'
+    notes[0].revision_id = uuid.uuid4()
+    await remote_storage.write(notes[0])
+    with unittest.mock.patch.object(
+            local_storage, 'load_status',
+            wraps=local_storage.load_status) as load_status:
+        await synchronizer.synchronize()
+
+    load_status.assert_called_once_with({notes[0].id})
+    assert (await local_storage.read(notes[0].id)).title == 'CHANGED'
+
+
+async def test_synchronize_does_nothing_when_digests_are_equal(
+        synchronizer, local_storage, remote_storage):
+    note = make_note('NOTE')
+    await local_storage.write(note)
+    await remote_storage.write(note)
+
+    with unittest.mock.patch.object(NeteClient, 'changes') as changes, \
+            unittest.mock.patch.object(NeteClient, 'revisions') as revisions:
+        await synchronizer.synchronize()
+
+    changes.assert_not_called()
+    revisions.assert_not_called()
+    assert await local_storage.load_status() == {note.id: note.revision_id}
+
+
+async def test_synchronize_compares_differing_buckets_when_remote_restarted(
+        synchronizer, local_storage, remote_storage):
+    notes = [make_note('NOTE {}'.format(i)) for i in range(20)]
+    for note in notes:
+        await remote_storage.write(note)
+    await synchronizer.synchronize()
+
+    remote_storage.index.feed.epoch = 'RESTARTED'
+    notes[0].title = 'CHANGED'
+    notes[0].revision_id = uuid.uuid4()
+    await remote_storage.write(notes[0])
+    with unittest.mock.patch('nete.backend.sync.LEAF_SIZE', 0), \
+            unittest.mock.patch.object(
+                local_storage, 'load_status',
+                wraps=local_storage.load_status) as load_status:
+        await synchronizer.synchronize()
+
+    load_status.assert_called_once_with({notes[0].id})
+    assert (await local_storage.read(notes[0].id)).title == 'CHANGED'
+
+
+async def test_synchronize_compares_all_notes_when_many_buckets_differ(
+        synchronizer, local_storage, remote_storage):
+    for i in range(20):
+        await remote_storage.write(make_note('NOTE {}'.format(i)))
+
+    with unittest.mock.patch('nete.backend.sync.MAX_TREE_REVISIONS', 10), \
+            unittest.mock.patch.object(
+                local_storage, 'load_status',
+                wraps=local_storage.load_status) as load_status:
+        await synchronizer.synchronize()
+
+    load_status.assert_called_once_with()
+    assert len(await local_storage.list()) == 20
+
+
+async def test_synchronize_limits_concurrent_transfers(
+        synchronizer, local_storage, remote_storage):
+    for i in range(10):
+        await remote_storage.write(make_note('NOTE {}'.format(i)))
+    synchronizer.concurrency = 2
+    get_notes = NeteClient.get_notes
+    running = []
+    max_running = 0
+
+    async def counting_get_notes(client, note_ids, base_notes=None):
+        nonlocal max_running
+        running.append(note_ids)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.remove(note_ids)
+        return await get_notes(client, note_ids, base_notes)
+
+    with unittest.mock.patch('nete.backend.sync.BATCH_GET_SIZE', 2), \
+            unittest.mock.patch.object(
+                NeteClient, 'get_notes', counting_get_notes):
+        await synchronizer.synchronize()
+
+    assert max_running == 2
+    assert len(await local_storage.list()) == 10
+
+
+async def test_synchronize_reads_pushed_notes_per_batch(
+        synchronizer, local_storage, remote_storage):
+    for i in range(6):
+        await local_storage.write(make_note('NOTE {}'.format(i)))
+    synchronizer.concurrency = 1
+    read = local_storage.read
+    bulk = NeteClient.bulk
+    calls = []
+
+    async def recording_read(note_id):
+        calls.append('read')
+        return await read(note_id)
+
+    async def recording_bulk(client, operations):
+        calls.append('bulk')
+        return await bulk(client, operations)
+
+    with unittest.mock.patch('nete.backend.sync.BULK_SIZE', 2), \
+            unittest.mock.patch.object(
+                local_storage, 'read', recording_read), \
+            unittest.mock.patch.object(NeteClient, 'bulk', recording_bulk):
+        await synchronizer.synchronize()
+
+    assert calls == ['read', 'read', 'bulk'] * 3
+    assert len(await remote_storage.list()) == 6
+
+
+@pytest.mark.parametrize('changed_side', ['local', 'remote'])
+async def test_synchronize_sends_deltas_of_changed_notes(
+        synchronizer, local_storage, remote_storage, changed_side):
+    note = make_note('NOTE')
+    note.text = ''.join('line {}\n'.format(i) for i in range(1000))
+    await remote_storage.write(note)
+    await synchronizer.synchronize()
+
+    note.text += 'appended line\n'
+    note.revision_id = uuid.uuid4()
+    changed_storage = (
+        local_storage if changed_side == 'local' else remote_storage)
+    await changed_storage.write(note)
+    with unittest.mock.patch(
+            'nete.backend.handler.apply_delta',
+            wraps=apply_delta) as handler_apply_delta, \
+            unittest.mock.patch(
+                'nete.backend.nete_client.apply_delta',
+                wraps=apply_delta) as client_apply_delta:
+        await synchronizer.synchronize()
+
+    applied_delta = (handler_apply_delta if changed_side == 'local'
+                     else client_apply_delta)
+    assert applied_delta.call_count == 1
+    for storage in (local_storage, remote_storage):
+        assert (await storage.read(note.id)).text == note.text
+
+
+async def test_synchronize_keeps_notes_changed_during_sync_unsynced(
+        synchronizer, local_storage, remote_storage):
+    note = make_note('NOTE')
+    await local_storage.write(note)
+    await synchronizer.synchronize()
+    note.text = 'BEFORE SYNC'
+    note.revision_id = uuid.uuid4()
+    await local_storage.write(note)
+
+    update_status = local_storage.update_status
+
+    async def change_note_and_update_status(*args, **kwargs):
+        note.text = 'DURING SYNC'
+        note.revision_id = uuid.uuid4()
+        await local_storage.write(note)
+        await update_status(*args, **kwargs)
+
+    with unittest.mock.patch.object(
+            local_storage, 'update_status', change_note_and_update_status):
+        await synchronizer.synchronize()
+    await synchronizer.synchronize()
+
+    assert (await remote_storage.read(note.id)).text == 'DURING SYNC'
+    assert (await local_storage.revision_digest() ==
+            await remote_storage.revision_digest())
+
+
+async def test_synchronize_keeps_notes_changed_before_pull_as_copies(
+        synchronizer, local_storage, remote_storage):
+    note = make_note('NOTE')
+    await remote_storage.write(note)
+    await synchronizer.synchronize()
+    note.text = 'REMOTE'
+    note.revision_id = uuid.uuid4()
+    await remote_storage.write(note)
+
+    get_notes = NeteClient.get_notes
+
+    async def change_note_and_get_notes(client, note_ids, base_notes=None):
+        local_note = await local_storage.read(note.id)
+        local_note.text = 'LOCAL'
+        local_note.revision_id = uuid.uuid4()
+        await local_storage.write(local_note)
+        return await get_notes(client, note_ids, base_notes)
+
+    with unittest.mock.patch.object(
+            NeteClient, 'get_notes', change_note_and_get_notes):
+        await synchronizer.synchronize()
+    await synchronizer.synchronize()
+
+    for storage in (local_storage, remote_storage):
+        assert ({note.text for note in
+                 await asyncio.gather(*[
+                     storage.read(header.id)
+                     for header in await storage.list()])} ==
+                {'REMOTE', 'LOCAL'})
+
+
+async def test_synchronize_writes_under_write_lock(
+        synchronizer, local_storage, remote_storage):
+    await remote_storage.write(make_note('NOTE'))
+
+    async with synchronizer.write_lock:
+        sync = asyncio.ensure_future(synchronizer.synchronize())
+        await asyncio.sleep(0.1)
+        assert await local_storage.list() == []
+    await sync
+
+    assert len(await local_storage.list()) == 1
+
+
+async def test_list_notes_reads_only_changed_pages(
+        synchronizer, remote_storage):
+    notes = [make_note('NOTE {}'.format(i)) for i in range(3)]
+    for note in notes:
+        await remote_storage.write(note)
+    listing_cache.clear()
+
+    with unittest.mock.patch('nete.backend.nete_client.LIST_PAGE_SIZE', 2):
+        async with NeteClient(synchronizer.sync_url) as client:
+            listed_notes = await client.list_notes()
+            with unittest.mock.patch.object(
+                    client, '_read_notes',
+                    wraps=client._read_notes) as read_notes:
+                relisted_notes = await client.list_notes()
+
+    assert ({note.id for note in listed_notes} ==
+            {note.id for note in notes})
+    assert relisted_notes == listed_notes
+    read_notes.assert_not_called()
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+logger = logging.getLogger(__name__)
+
+
+class ListingCache:
+    """Keeps the pages of the latest note listing in a directory.
+
+    Every page is stored in a file of its own with its URL, ETag, body and
+    the URL of the next page, so it can be requested conditionally next
+    time and doesn't need to be transferred again if it hasn't changed.
+    Only the pages that changed are written again.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._pages = {}
+
+    def get(self, url):
+        if url not in self._pages:
+            self._pages[url] = self._load(url)
+        return self._pages[url]
+
+    def save(self, pages):
+        """Replaces all cached pages with `pages`, a dict mapping URLs to
+        dicts with the keys `etag`, `body` and `next_url`."""
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            for url, page in pages.items():
+                if self._pages.get(url) != page:
+                    self._write(url, page)
+            filenames = {self._filename(url) for url in pages}
+            for name in os.listdir(self.dirname):
+                filename = os.path.join(self.dirname, name)
+                if filename not in filenames:
+                    os.unlink(filename)
+        except OSError as e:
+            logger.warning('Cannot write listing cache {}: {}'.format(
+                self.dirname, e))
+        self._pages = dict(pages)
+
+    def _filename(self, url):
+        return os.path.join(self.dirname, '{}.json'.format(
+            hashlib.sha1(url.encode('utf-8')).hexdigest()))
+
+    def _write(self, url, page):
+        filename = self._filename(url)
+        tmp_filename = '{}.tmp'.format(filename)
+        with open(tmp_filename, 'w') as fp:
+            json.dump(dict(page, url=url), fp)
+        os.replace(tmp_filename, filename)
+
+    def _load(self, url):
+        filename = self._filename(url)
+        try:
+            with open(filename) as fp:
+                page = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning('Ignoring corrupt listing cache page {}: {}'
+                           .format(filename, e))
+            return None
+        if page.pop('url', None) != url:
+            return None
+        return page
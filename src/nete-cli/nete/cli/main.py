@@ -1,5 +1,5 @@
 from nete.common.nete_url import NeteUrl
-from nete.common.xdg import XDG_RUNTIME_DIR
+from nete.common.xdg import XDG_CACHE_HOME, XDG_RUNTIME_DIR
 from .config import Config
 from .parse_args import parse_args
 from .nete_client import NeteClient
@@ -16,6 +16,7 @@ if XDG_RUNTIME_DIR:
 defaults = {
     'debug': False,
     'backend.url': DEFAULT_SOCKET_FILENAME,
+    'cache.dir': os.path.join(XDG_CACHE_HOME, 'nete'),
 }
 
 
@@ -24,7 +25,7 @@ def main():
     args = parse_args(config)
 
     nete_url = NeteUrl.from_string(config['backend.url'])
-    nete_client = NeteClient(nete_url)
+    nete_client = NeteClient(nete_url, cache_dir=config['cache.dir'])
     shell = NeteShell(nete_client, config)
 
     result = shell.run(args)
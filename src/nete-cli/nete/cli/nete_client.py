@@ -1,7 +1,13 @@
+from .listing_cache import ListingCache
 from nete.common.exceptions import NotFound, ServerError
+from nete.common.json_stream import JsonArrayDecoder
 from nete.common.schemas.note_schema import NoteSchema
 from nete.common.schemas.note_index_schema import NoteIndexSchema
+from nete.common.schemas.registry import get_schema
 from nete.common.nete_url import ConnectionType
+import hashlib
+import json
+import os.path
 import requests
 import requests_unixsocket
 import urllib.parse
@@ -9,10 +15,20 @@ import urllib.parse
 
 class NeteClient:
 
-    def __init__(self, backend_url):
+    LIST_PAGE_SIZE = 1000
+    BATCH_GET_SIZE = 500
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, backend_url, cache_dir=None):
         self._prepare_base_url(backend_url)
-        self.note_schema = NoteSchema()
-        self.note_index_schema = NoteIndexSchema()
+        self.note_schema = get_schema(NoteSchema)
+        self.note_index_schema = get_schema(NoteIndexSchema)
+        self.listing_cache = None
+        if cache_dir is not None:
+            self.listing_cache = ListingCache(os.path.join(
+                cache_dir,
+                'listing-{}'.format(hashlib.sha1(
+                    self.base_url.encode('utf-8')).hexdigest()[:16])))
 
     def _prepare_base_url(self, backend_url):
         if backend_url.connection_type == ConnectionType.UNIX:
@@ -23,16 +39,83 @@ class NeteClient:
             self.base_url = backend_url.base_url
             self.session = requests.Session()
 
-    def list(self):
-        response = self._get('/notes')
-        return self.note_index_schema.loads(response.text, many=True)
+    def list(self, sort=None):
+        return list(self.iter_notes(sort))
+
+    def iter_notes(self, sort=None):
+        """Yields all notes, fetching them page by page.
+
+        With a cache directory, pages are requested conditionally and
+        taken from the cache if they haven't changed.
+        """
+        params = {'limit': self.LIST_PAGE_SIZE}
+        if sort is not None:
+            params['sort'] = sort
+        url = self._url('/notes?{}', urllib.parse.urlencode(params))
+        pages = {}
+        while url is not None:
+            cached_page = (self.listing_cache.get(url)
+                           if self.listing_cache is not None else None)
+            headers = (None if cached_page is None
+                       else {'if-none-match': cached_page['etag']})
+            response = self._send(
+                requests.Request('GET', url, headers=headers), stream=True)
+
+            if response.status_code == 304 and cached_page is not None:
+                page = cached_page
+                chunks = [page['body'].encode('utf-8')]
+            else:
+                next_link = response.links.get('next')
+                page = {
+                    'etag': response.headers.get('etag'),
+                    'next_url': (None if next_link is None
+                                 else self.base_url + next_link['url']),
+                }
+                chunks = response.iter_content(self.CHUNK_SIZE)
+
+            body = []
+            decoder = JsonArrayDecoder()
+            for chunk in chunks:
+                body.append(chunk)
+                yield from self.note_index_schema.load(
+                    decoder.feed(chunk), many=True)
+            decoder.close()
+
+            if page['etag'] is not None:
+                page['body'] = b''.join(body).decode('utf-8')
+                pages[url] = page
+            url = page['next_url']
+
+        if self.listing_cache is not None:
+            self.listing_cache.save(pages)
 
     def get_note(self, note_id):
         response = self._get('/notes/{}', note_id)
         return self.note_schema.loads(response.text)
 
+    def get_notes(self, note_ids):
+        """Returns the notes with the given ids, leaving out those that
+        don't exist."""
+        note_ids = [str(note_id) for note_id in note_ids]
+        notes = []
+        for start in range(0, len(note_ids), self.BATCH_GET_SIZE):
+            request = requests.Request(
+                'POST',
+                self._url('/notes/_batch_get'),
+                headers={'content-type': 'application/json'},
+                data=json.dumps({
+                    'ids': note_ids[start:start + self.BATCH_GET_SIZE]}))
+            response = self._send(request, stream=True)
+            decoder = JsonArrayDecoder()
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                notes.extend(self.note_schema.load(
+                    decoder.feed(chunk), many=True))
+            decoder.close()
+        return notes
+
     def create_note(self, note):
-        note_schema = NoteSchema(exclude=('created_at', 'updated_at'))
+        note_schema = get_schema(
+            NoteSchema, exclude=('created_at', 'updated_at'))
         response = self._post(
             '/notes',
             data=note_schema.dumps(note))
@@ -79,9 +162,9 @@ class NeteClient:
             self._url(path, *args, **kwargs))
         return self._send(request)
 
-    def _send(self, request):
+    def _send(self, request, stream=False):
         try:
-            response = self.session.send(request.prepare())
+            response = self.session.send(request.prepare(), stream=stream)
             response.raise_for_status()
             return response
         except requests.HTTPError as exc:
@@ -22,14 +22,20 @@ class NeteShell:
             print('Error: {}'.format(e))
 
     def cat(self, note_ids):
+        note_ids = [uuid.UUID(note_id) for note_id in note_ids]
+        notes = {
+            note.id: note
+            for note in self.nete_client.get_notes(note_ids)
+        }
+
+        result = 0
         for note_id in note_ids:
-            try:
-                note = self.nete_client.get_note(uuid.UUID(note_id))
-                print(render_editable_note(note))
-                return 0
-            except NotFound:
+            if note_id in notes:
+                print(render_editable_note(notes[note_id]))
+            else:
                 print('{} not found.'.format(note_id))
-                return 1
+                result = 1
+        return result
 
     def edit(self, note_id):
         try:
@@ -45,12 +51,7 @@ class NeteShell:
             return 1
 
     def ls(self):
-        notes = self.nete_client.list()
-
-        def sort_fn(note):
-            return note.title
-
-        for note in sorted(notes, key=sort_fn):
+        for note in self.nete_client.iter_notes(sort='title'):
             print('{id}   {title}'.format(**note.__dict__))
         return 0
 
@@ -85,7 +86,7 @@ class NeteShell:
             return 1
 
     def complete_note_id(self, text):
-        notes = self.nete_client.list()
+        notes = self.nete_client.iter_notes()
         return (
             [str(note.id)
              for note in notes
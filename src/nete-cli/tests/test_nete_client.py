@@ -1,3 +1,4 @@
+from nete.cli.listing_cache import ListingCache
 from nete.cli.nete_client import NeteClient, NotFound
 from nete.common.nete_url import NeteUrl
 from nete.common.models import Note
@@ -6,6 +7,7 @@ import json
 import requests_mock
 import pytest
 import pytz
+import unittest.mock
 import uuid
 
 
@@ -62,6 +64,101 @@ class TestNeteClient:
                 )
         ]
 
+    def test_list_fetches_all_pages(self, nete_client, server_mock):
+        def note_data(id):
+            return {
+                'id': id,
+                'revision_id': '0244174a-3dcf-4cca-af46-5f5063d53599',
+                'title': 'TITLE',
+                'created_at': '2017-11-12T17:55:00',
+                'updated_at': '2017-11-12T18:00:00',
+            }
+
+        server_mock.get(
+            'http://nete.io/notes?limit=1000&sort=title',
+            complete_qs=True,
+            headers={'link': '</notes?sort=title&cursor=CURSOR>; rel="next"'},
+            text=json.dumps(
+                [note_data('b08cee6f-cc15-44d5-86d4-b20dfb1295b8')]))
+        server_mock.get(
+            'http://nete.io/notes?sort=title&cursor=CURSOR',
+            complete_qs=True,
+            text=json.dumps(
+                [note_data('f75ec26c-a567-4069-86c7-17610d2a7b71')]))
+
+        result = nete_client.list(sort='title')
+
+        assert [str(note.id) for note in result] == [
+            'b08cee6f-cc15-44d5-86d4-b20dfb1295b8',
+            'f75ec26c-a567-4069-86c7-17610d2a7b71',
+        ]
+
+    def test_list_uses_cached_page_when_not_modified(
+            self, server_mock, tmpdir):
+        nete_client = NeteClient(
+            NeteUrl.from_string('http://nete.io'), cache_dir=str(tmpdir))
+        server_mock.get('http://nete.io/notes', headers={'etag': 'ETAG'},
+                        text=json.dumps([{
+                            'id': 'b08cee6f-cc15-44d5-86d4-b20dfb1295b8',
+                            'revision_id':
+                                '0244174a-3dcf-4cca-af46-5f5063d53599',
+                            'title': 'TITLE',
+                        }]))
+        first_result = nete_client.list()
+
+        server_mock.get('http://nete.io/notes', status_code=304,
+                        headers={'etag': 'ETAG'})
+        second_result = nete_client.list()
+
+        assert server_mock.last_request.headers['if-none-match'] == 'ETAG'
+        assert ([note.id for note in second_result] ==
+                [note.id for note in first_result])
+        assert [note.title for note in second_result] == ['TITLE']
+
+    def test_list_writes_only_changed_pages_to_cache(
+            self, server_mock, tmpdir):
+        nete_client = NeteClient(
+            NeteUrl.from_string('http://nete.io'), cache_dir=str(tmpdir))
+        next_url = '/notes?limit=1&cursor=CURSOR'
+        server_mock.get('http://nete.io/notes',
+                        headers={'etag': 'W/"1"',
+                                 'link': '<{}>; rel="next"'.format(next_url)},
+                        text=json.dumps([{
+                            'id': 'b08cee6f-cc15-44d5-86d4-b20dfb1295b8',
+                            'revision_id':
+                                '0244174a-3dcf-4cca-af46-5f5063d53599',
+                            'title': 'FIRST',
+                        }]))
+        server_mock.get('http://nete.io/notes?cursor=CURSOR',
+                        headers={'etag': 'W/"2"'},
+                        text=json.dumps([{
+                            'id': 'f75ec26c-a567-4069-86c7-17610d2a7b71',
+                            'revision_id':
+                                '9035acb6-839f-43ea-a426-7598c1ba952c',
+                            'title': 'SECOND',
+                        }]))
+        nete_client.list()
+
+        server_mock.get('http://nete.io/notes', status_code=304,
+                        headers={'etag': 'W/"1"'})
+        server_mock.get('http://nete.io/notes?cursor=CURSOR',
+                        headers={'etag': 'W/"3"'},
+                        text=json.dumps([{
+                            'id': 'f75ec26c-a567-4069-86c7-17610d2a7b71',
+                            'revision_id':
+                                '1035acb6-839f-43ea-a426-7598c1ba952c',
+                            'title': 'CHANGED',
+                        }]))
+        with unittest.mock.patch.object(
+                ListingCache, '_write', autospec=True,
+                side_effect=ListingCache._write) as write_mock:
+            result = nete_client.list()
+
+        assert ([call[0][1] for call in write_mock.call_args_list] ==
+                ['http://nete.io' + next_url])
+        assert [note.title for note in result] == ['FIRST', 'CHANGED']
+        assert len(tmpdir.listdir()[0].listdir()) == 2
+
     def test_get_note(self, nete_client, server_mock):
         server_mock.get('http://nete.io/notes/ID', text=json.dumps({
             'id': '1035acb6-839f-43ea-a426-7598c1ba952c',
@@ -92,6 +189,29 @@ class TestNeteClient:
         with pytest.raises(NotFound):
             nete_client.get_note('NON-EXISTING-ID')
 
+    def test_get_notes(self, nete_client, server_mock):
+        server_mock.post('http://nete.io/notes/_batch_get', text=json.dumps([
+            {
+                'id': '1035acb6-839f-43ea-a426-7598c1ba952c',
+                'revision_id': '9035acb6-839f-43ea-a426-7598c1ba952c',
+                'title': 'TITLE',
+                'text': 'TEXT',
+                'created_at': '2017-11-12T17:55:00',
+                'updated_at': '2017-11-12T18:00:00',
+            },
+        ]))
+
+        result = nete_client.get_notes([
+            uuid.UUID('1035acb6-839f-43ea-a426-7598c1ba952c'),
+            uuid.UUID('2035acb6-839f-43ea-a426-7598c1ba952c'),
+        ])
+
+        assert server_mock.last_request.json() == {'ids': [
+            '1035acb6-839f-43ea-a426-7598c1ba952c',
+            '2035acb6-839f-43ea-a426-7598c1ba952c',
+        ]}
+        assert [note.text for note in result] == ['TEXT']
+
     @pytest.mark.freeze_time
     def test_create_note(self, nete_client, server_mock):
         server_mock.post('http://nete.io/notes', text=json.dumps({
@@ -19,7 +19,7 @@ def nete_shell(nete_client):
 
 
 def test_ls_returns_list_of_notes(nete_shell, nete_client, capsys):
-    nete_client.list.return_value = [
+    nete_client.iter_notes.return_value = [
         Note(id=uuid.UUID('02665506-be9c-4c72-8c93-da8625061168'),
              title='TITLE 1', text='TEXT 1'),
         Note(id=uuid.UUID('9af112f7-9094-4166-aaa5-f1646670d428'),
@@ -36,17 +36,17 @@ def test_ls_returns_list_of_notes(nete_shell, nete_client, capsys):
 
 
 def test_cat_outputs_note(nete_shell, nete_client, capsys):
-    nete_client.get_note.return_value = Note(
+    nete_client.get_notes.return_value = [Note(
         id=uuid.UUID('02665506-be9c-4c72-8c93-da8625061168'),
         title='TITLE 1', text='TEXT 1',
         created_at=datetime.datetime(2017, 1, 1, 12, 0, 0, tzinfo=pytz.UTC),
         updated_at=datetime.datetime(2017, 1, 1, 12, 0, 0, tzinfo=pytz.UTC),
-        )
+        )]
 
     result = nete_shell.cat(['02665506-be9c-4c72-8c93-da8625061168'])
 
-    nete_client.get_note.assert_called_once_with(
-        uuid.UUID('02665506-be9c-4c72-8c93-da8625061168'))
+    nete_client.get_notes.assert_called_once_with(
+        [uuid.UUID('02665506-be9c-4c72-8c93-da8625061168')])
     captured = capsys.readouterr()
     assert (captured.out ==
             'Title: TITLE 1\n'
@@ -59,7 +59,7 @@ def test_cat_outputs_note(nete_shell, nete_client, capsys):
 
 
 def test_cat_prints_error_if_not_found(nete_shell, nete_client, capsys):
-    nete_client.get_note.side_effect = NotFound('ID')
+    nete_client.get_notes.return_value = []
 
     result = nete_shell.cat(['02665506-be9c-4c72-8c93-da8625061168'])
 
@@ -68,6 +68,26 @@ def test_cat_prints_error_if_not_found(nete_shell, nete_client, capsys):
     assert result == 1
 
 
+def test_cat_outputs_all_notes_with_one_request(
+        nete_shell, nete_client, capsys):
+    note_ids = [
+        uuid.UUID('02665506-be9c-4c72-8c93-da8625061168'),
+        uuid.UUID('9af112f7-9094-4166-aaa5-f1646670d428'),
+    ]
+    nete_client.get_notes.return_value = [
+        Note(id=note_id, title='TITLE', text='TEXT {}'.format(note_id))
+        for note_id in reversed(note_ids)
+    ]
+
+    result = nete_shell.cat([str(note_id) for note_id in note_ids])
+
+    nete_client.get_notes.assert_called_once_with(note_ids)
+    captured = capsys.readouterr()
+    assert (captured.out.index('TEXT {}'.format(note_ids[0])) <
+            captured.out.index('TEXT {}'.format(note_ids[1])))
+    assert result == 0
+
+
 @pytest.mark.freeze_time
 def test_new_lets_user_edit_note_and_saves_it(nete_shell, nete_client, capsys):
     note_after_editing = Note(id=None, title='TITLE 1', text='TEXT 1',
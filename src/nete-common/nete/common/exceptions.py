@@ -16,3 +16,7 @@ class ServerError(NeteException):
 
 class SshError(NeteException):
     pass
+
+
+class SequenceRestarted(NeteException):
+    pass
@@ -0,0 +1,140 @@
+import codecs
+import json
+import re
+
+WHITESPACE = ' \t\n\r'
+
+# the rest of a string up to its closing quote or an incomplete escape
+STRING_CONTENT = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# the characters an item can end at outside of strings, and after numbers
+# and literals
+STRUCTURAL = re.compile(r'["\[\]{}]')
+SCALAR_END = re.compile(r'[\s,\]]')
+
+
+class JsonArrayDecoder:
+    """Incrementally decodes a JSON array of objects.
+
+    Feed the encoded array in chunks of any size to `feed()`, which
+    returns the items completed by the chunk. Call `close()` after the
+    last chunk to make sure the array was complete.
+
+    The chunks of an unfinished item are only scanned for the end of the
+    item and kept until it is complete, so every item is decoded once, no
+    matter how many chunks it arrives in.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.started = False
+        self.finished = False
+        self.rest = ''
+        # state of the item being received
+        self.chunks = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.scalar = False
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data)
+
+        items = []
+        pos = 0
+        while pos < len(data) and not self.finished:
+            if self.chunks is not None:
+                end = self._scan(data, pos)
+                if end is None:
+                    # the item is incomplete, wait for more data
+                    self.chunks.append(data[pos:])
+                    pos = len(data)
+                    break
+                self.chunks.append(data[pos:end])
+                items.append(self._decode_item())
+                pos = end
+                continue
+
+            pos = _skip_whitespace(data, pos)
+            if pos == len(data):
+                break
+
+            char = data[pos]
+            if not self.started:
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                self.started = True
+                pos += 1
+            elif char == ']':
+                self.finished = True
+                pos += 1
+            elif char == ',':
+                pos += 1
+            else:
+                self.chunks = []
+                self.scalar = char not in '"[{'
+
+        if self.finished:
+            self.rest += data[pos:]
+        return items
+
+    def close(self):
+        self.feed(self.decoder.decode(b'', final=True))
+        if not self.finished or self.rest.strip(WHITESPACE):
+            raise ValueError('Incomplete or invalid JSON array')
+
+    def _scan(self, data, pos):
+        """Returns the position in `data` after the end of the current item,
+        or None if it doesn't end in `data`."""
+        if self.scalar:
+            match = SCALAR_END.search(data, pos)
+            return None if match is None else match.start()
+
+        if self.escape:
+            self.escape = False
+            pos += 1
+        while True:
+            if self.in_string:
+                pos = STRING_CONTENT.match(data, pos).end()
+                if pos == len(data):
+                    return None
+                if data[pos] == '\\':
+                    # the escaped character is in the next chunk
+                    self.escape = True
+                    return None
+                pos += 1
+                self.in_string = False
+                if self.depth == 0:
+                    return pos
+            else:
+                match = STRUCTURAL.search(data, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                char = match.group()
+                if char == '"':
+                    self.in_string = True
+                elif char in '[{':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return pos
+
+    def _decode_item(self):
+        text = ''.join(self.chunks)
+        self.chunks = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        item, end = self.json_decoder.raw_decode(text)
+        if text[end:].strip(WHITESPACE):
+            raise ValueError('Invalid JSON array item')
+        return item
+
+
+def _skip_whitespace(data, pos):
+    while pos < len(data) and data[pos] in WHITESPACE:
+        pos += 1
+    return pos
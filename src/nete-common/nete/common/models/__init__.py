@@ -1 +1 @@
-from .note import Note    # noqa F401
+from .note import Note, NoteHeader    # noqa F401
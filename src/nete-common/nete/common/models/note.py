@@ -1,23 +1,50 @@
-class Note:
+class NoteHeader:
+    """A note's metadata without its text, as used for listings.
+
+    Notes and note headers use `__slots__` to keep large listings small.
+    `__dict__` returns a new dict of the attributes, so changing it
+    doesn't change the note.
+    """
+
+    __slots__ = ('id', 'revision_id', 'created_at', 'updated_at', 'title')
+
+    FIELDS = __slots__
+
+    # headers don't have a text, but code reading it from any note works
+    text = None
+
     def __init__(self, id=None, revision_id=None,
-                 created_at=None, updated_at=None, title=None,
-                 text=None):
+                 created_at=None, updated_at=None, title=None):
         self.id = id
         self.revision_id = revision_id
         self.created_at = created_at
         self.updated_at = updated_at
         self.title = title
-        self.text = text
+
+    @property
+    def __dict__(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
 
     def __eq__(self, other):
-        return (
-            self.id == other.id and
-            self.revision_id == other.revision_id and
-            self.created_at == other.created_at and
-            self.updated_at == other.updated_at and
-            self.title == other.title and
-            self.text == other.text
-            )
+        if not isinstance(other, NoteHeader):
+            return NotImplemented
+        # a header equals a note without text
+        return all(
+            getattr(self, name) == getattr(other, name, None)
+            for name in Note.FIELDS)
 
     def __repr__(self):
-        return 'Note(id={})'.format(str(self.id))
+        return '{}(id={})'.format(type(self).__name__, str(self.id))
+
+
+class Note(NoteHeader):
+
+    __slots__ = ('text',)
+
+    FIELDS = NoteHeader.FIELDS + __slots__
+
+    def __init__(self, id=None, revision_id=None,
+                 created_at=None, updated_at=None, title=None,
+                 text=None):
+        super().__init__(id, revision_id, created_at, updated_at, title)
+        self.text = text
@@ -0,0 +1,142 @@
+"""Fast serialization of `Note` objects from and to trusted data.
+
+Data written by nete itself, like the notes in a storage, has been
+validated before, so it's converted directly without the validation
+`NoteSchema` does. The output is the same as `NoteSchema`'s. Don't use
+this for data received from clients; use `NoteSchema` there.
+
+If ujson is installed, it's used for parsing and encoding JSON.
+"""
+from nete.common.models.note import Note, NoteHeader
+import datetime
+import json
+import re
+import uuid
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+NOTE_FIELDS = (
+    'id', 'revision_id', 'created_at', 'updated_at', 'title', 'text')
+HEADER_FIELDS = NOTE_FIELDS[:-1]
+
+DATETIME_RE = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?'
+    r'(?:(Z)|([+-])(\d\d):?(\d\d))?$')
+
+UTC = datetime.timezone.utc
+
+if ujson is not None:
+    _json_loads = ujson.loads
+
+    def _json_dumps(obj):
+        return ujson.dumps(obj, escape_forward_slashes=False)
+else:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+
+def note_to_dict(note, fields=NOTE_FIELDS):
+    data = {}
+    for field in fields:
+        value = getattr(note, field)
+        if value is None:
+            data[field] = None
+        elif field in ('id', 'revision_id'):
+            data[field] = str(value)
+        elif field in ('created_at', 'updated_at'):
+            data[field] = format_datetime(value)
+        else:
+            data[field] = value
+    return data
+
+
+def note_from_dict(data):
+    """Returns a `Note`, or a `NoteHeader` if `data` has no text."""
+    header = (
+        _uuid_or_none(data.get('id')),
+        _uuid_or_none(data.get('revision_id')),
+        _datetime_or_none(data.get('created_at')),
+        _datetime_or_none(data.get('updated_at')),
+        data.get('title'))
+    if 'text' not in data:
+        return NoteHeader(*header)
+    return Note(*header, text=data['text'])
+
+
+def dumps_note(note, fields=NOTE_FIELDS):
+    return _json_dumps(note_to_dict(note, fields))
+
+
+def loads_note(s):
+    return note_from_dict(_json_loads(s))
+
+
+def dumps_notes(notes, fields=NOTE_FIELDS):
+    return _json_dumps([note_to_dict(note, fields) for note in notes])
+
+
+def iter_dumps_notes(notes, fields=NOTE_FIELDS, batch_size=100):
+    """Yields a JSON array of `notes` in chunks of `batch_size` notes."""
+    separator = '['
+    batch = []
+    for note in notes:
+        batch.append(_json_dumps(note_to_dict(note, fields)))
+        if len(batch) == batch_size:
+            yield separator + ','.join(batch)
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(batch)
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def loads_notes(s):
+    return [note_from_dict(data) for data in _json_loads(s)]
+
+
+def format_datetime(dt):
+    """Formats a datetime like marshmallow does, i.e. in UTC with naive
+    datetimes taken as UTC."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    elif dt.utcoffset():
+        dt = dt.astimezone(UTC)
+    return dt.isoformat()
+
+
+def parse_datetime(s):
+    match = DATETIME_RE.match(s)
+    if match is None:
+        raise ValueError('Not a valid ISO8601 datetime: {!r}'.format(s))
+
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+
+    if zulu:
+        tzinfo = UTC
+    elif sign:
+        offset = datetime.timedelta(
+            hours=int(offset_hours), minutes=int(offset_minutes))
+        tzinfo = UTC if not offset else datetime.timezone(
+            -offset if sign == '-' else offset)
+    else:
+        tzinfo = None
+
+    return datetime.datetime(
+        int(year), int(month), int(day),
+        int(hour), int(minute), int(second),
+        int(fraction.ljust(6, '0')) if fraction else 0,
+        tzinfo)
+
+
+def _uuid_or_none(value):
+    return None if value is None else uuid.UUID(value)
+
+
+def _datetime_or_none(value):
+    return None if value is None else parse_datetime(value)
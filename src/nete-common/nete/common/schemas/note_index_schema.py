@@ -1,6 +1,12 @@
 from .note_schema import NoteSchema
+from marshmallow import post_load
+from nete.common.models.note import NoteHeader
 
 
 class NoteIndexSchema(NoteSchema):
     class Meta:
         exclude = ('text',)
+
+    @post_load
+    def make_object(self, data):
+        return NoteHeader(**data)
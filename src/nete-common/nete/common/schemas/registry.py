@@ -0,0 +1,14 @@
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def get_schema(schema_class, exclude=()):
+    """Returns a shared instance of `schema_class`.
+
+    Constructing a marshmallow schema is expensive compared to
+    (de)serializing a single note, so instances are created once per
+    schema class and set of excluded fields and reused afterwards.
+    Schemas don't keep state between calls, so instances can be shared
+    between threads. `exclude` must be a tuple.
+    """
+    return schema_class(exclude=exclude)
@@ -0,0 +1,47 @@
+"""Line-based deltas between two versions of a text.
+
+A delta is a list of `[start, end]` pairs, which stand for the lines
+`start` to `end` (exclusive) of the old text, and of strings, which are
+inserted as they are. Joined together, they make up the new text.
+"""
+import difflib
+import json
+
+
+def make_delta(old_text, new_text):
+    """Returns a delta from `old_text` to `new_text`, or None if it isn't
+    smaller than `new_text`, which should then be sent as it is."""
+    old_lines = old_text.splitlines(keepends=True)
+    new_lines = new_text.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j1 < j2:
+            delta.append(''.join(new_lines[j1:j2]))
+
+    if len(json.dumps(delta)) >= len(json.dumps(new_text)):
+        return None
+    return delta
+
+
+def apply_delta(old_text, delta):
+    """Returns the new text made from `old_text` and `delta`. Raises
+    ValueError if `delta` isn't a valid delta for `old_text`."""
+    if not isinstance(delta, list):
+        raise ValueError('Delta must be a list')
+
+    old_lines = old_text.splitlines(keepends=True)
+    parts = []
+    for item in delta:
+        if isinstance(item, str):
+            parts.append(item)
+        elif (isinstance(item, list) and len(item) == 2 and
+                all(type(index) is int for index in item) and
+                0 <= item[0] <= item[1] <= len(old_lines)):
+            parts.extend(old_lines[item[0]:item[1]])
+        else:
+            raise ValueError('Invalid delta item {!r}'.format(item))
+    return ''.join(parts)
@@ -19,6 +19,9 @@ setup(
     install_requires=[
         'marshmallow>=3.0.0b7',
     ],
+    extras_require={
+        'fast': ['ujson'],
+    },
     setup_requires=[
         'pytest-runner',
     ],
@@ -0,0 +1,64 @@
+from nete.common.json_stream import JsonArrayDecoder
+import json
+import pytest
+import unittest.mock
+
+ITEMS = [
+    {'title': 'ÄÖÜ', 'tags': ['a', 'b']},
+    {'title': 'with ] and , inside'},
+    {},
+    {'text': 'with \\" and \\\\ inside'},
+    'STRING',
+    42,
+    [1, [2]],
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 1000])
+def test_feed_returns_completed_items(chunk_size):
+    data = json.dumps(ITEMS, ensure_ascii=False, indent=2).encode('utf-8')
+    decoder = JsonArrayDecoder()
+
+    items = []
+    for start in range(0, len(data), chunk_size):
+        items.extend(decoder.feed(data[start:start + chunk_size]))
+    decoder.close()
+
+    assert items == ITEMS
+
+
+def test_feed_decodes_large_item_once():
+    item = {'text': 'x' * 100000}
+    data = json.dumps([item, item]).encode('utf-8')
+    decoder = JsonArrayDecoder()
+
+    items = []
+    with unittest.mock.patch.object(
+            decoder.json_decoder, 'raw_decode',
+            wraps=decoder.json_decoder.raw_decode) as raw_decode:
+        for start in range(0, len(data), 1000):
+            items.extend(decoder.feed(data[start:start + 1000]))
+    decoder.close()
+
+    assert items == [item, item]
+    assert raw_decode.call_count == 2
+
+
+def test_empty_array():
+    decoder = JsonArrayDecoder()
+
+    assert decoder.feed(b' [ ] ') == []
+    decoder.close()
+
+
+def test_close_raises_for_incomplete_array():
+    decoder = JsonArrayDecoder()
+    decoder.feed(b'[{"title": "TITLE"}, {"title"')
+
+    with pytest.raises(ValueError):
+        decoder.close()
+
+
+def test_feed_raises_for_other_values():
+    with pytest.raises(ValueError):
+        JsonArrayDecoder().feed(b'{"title": "TITLE"}')
@@ -0,0 +1,53 @@
+from nete.common.models import Note, NoteHeader
+import pytest
+import uuid
+
+
+@pytest.fixture
+def note():
+    return Note(id=uuid.uuid4(), revision_id=uuid.uuid4(),
+                title='TITLE', text='TEXT')
+
+
+def test_note_has_no_instance_dict(note):
+    with pytest.raises(AttributeError):
+        note.unknown_attribute = 'VALUE'
+
+
+def test_dict_contains_all_fields(note):
+    assert note.__dict__ == {
+        'id': note.id,
+        'revision_id': note.revision_id,
+        'created_at': None,
+        'updated_at': None,
+        'title': 'TITLE',
+        'text': 'TEXT',
+    }
+    assert Note(**note.__dict__) == note
+
+
+def test_header_has_no_text(note):
+    header = NoteHeader(id=note.id, revision_id=note.revision_id,
+                        title=note.title)
+
+    assert header.text is None
+    assert 'text' not in header.__dict__
+    assert Note(**header.__dict__).text is None
+
+
+def test_header_equals_note_without_text(note):
+    header = NoteHeader(id=note.id, revision_id=note.revision_id,
+                        title=note.title)
+
+    assert header != note
+    note.text = None
+    assert header == note
+    assert note == header
+
+
+def test_note_does_not_equal_other_types():
+    note = Note()
+
+    assert note != None  # noqa: E711
+    assert note != object()
+    assert note.__eq__('TEXT') is NotImplemented
@@ -0,0 +1,66 @@
+from nete.common.models import Note
+from nete.common.schemas.note_codec import (
+    HEADER_FIELDS, dumps_note, dumps_notes, iter_dumps_notes, loads_note,
+    parse_datetime)
+from nete.common.schemas.note_schema import NoteSchema
+import datetime
+import json
+import pytest
+import uuid
+
+
+@pytest.fixture
+def note():
+    return Note(
+        id=uuid.uuid4(),
+        revision_id=uuid.uuid4(),
+        created_at=datetime.datetime(
+            2018, 3, 6, 17, 35, 0, tzinfo=datetime.timezone.utc),
+        updated_at=datetime.datetime(
+            2018, 4, 7, 12, 23, 45, 123456,
+            tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+        title='TITLE',
+        text='TEXT / ÄÖÜ')
+
+
+def test_dumps_note_matches_note_schema(note):
+    assert json.loads(dumps_note(note)) == NoteSchema().dump(note)
+
+
+def test_dumps_notes_with_header_fields(note):
+    expected = NoteSchema(exclude=('text',)).dump([note], many=True)
+    assert json.loads(dumps_notes([note], HEADER_FIELDS)) == expected
+
+
+def test_loads_note_matches_note_schema(note):
+    data = NoteSchema().dumps(note)
+    assert loads_note(data) == NoteSchema().loads(data)
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('2018-03-06T17:35:00+00:00',
+     datetime.datetime(2018, 3, 6, 17, 35, tzinfo=datetime.timezone.utc)),
+    ('2018-03-06T17:35:00.5Z',
+     datetime.datetime(2018, 3, 6, 17, 35, 0, 500000,
+                       tzinfo=datetime.timezone.utc)),
+    ('2018-03-06T19:35:00+02:00',
+     datetime.datetime(2018, 3, 6, 17, 35, tzinfo=datetime.timezone.utc)),
+    ('2018-03-06T17:35:00', datetime.datetime(2018, 3, 6, 17, 35)),
+])
+def test_parse_datetime(value, expected):
+    parsed = parse_datetime(value)
+    assert parsed == expected
+    assert (parsed.tzinfo is None) == (expected.tzinfo is None)
+
+
+def test_parse_datetime_with_invalid_value():
+    with pytest.raises(ValueError):
+        parse_datetime('yesterday')
+
+
+@pytest.mark.parametrize('count', [0, 1, 2, 5])
+def test_iter_dumps_notes(note, count):
+    chunks = list(iter_dumps_notes([note] * count, batch_size=2))
+
+    expected = [json.loads(dumps_note(note))] * count
+    assert json.loads(''.join(chunks)) == expected
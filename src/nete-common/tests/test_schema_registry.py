@@ -0,0 +1,15 @@
+from nete.common.schemas.note_index_schema import NoteIndexSchema
+from nete.common.schemas.note_schema import NoteSchema
+from nete.common.schemas.registry import get_schema
+
+
+def test_get_schema_returns_shared_instance():
+    assert get_schema(NoteSchema) is get_schema(NoteSchema)
+    assert isinstance(get_schema(NoteSchema), NoteSchema)
+
+
+def test_get_schema_distinguishes_classes_and_excludes():
+    assert get_schema(NoteSchema) is not get_schema(NoteIndexSchema)
+    assert (get_schema(NoteSchema) is not
+            get_schema(NoteSchema, exclude=('text',)))
+    assert 'text' not in get_schema(NoteSchema, exclude=('text',)).fields
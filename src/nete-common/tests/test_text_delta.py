@@ -0,0 +1,32 @@
+from nete.common.text_delta import apply_delta, make_delta
+import pytest
+
+
+OLD_TEXT = ''.join('line {}\n'.format(i) for i in range(100))
+
+
+def test_delta_reproduces_new_text():
+    new_text = (OLD_TEXT.replace('line 10\n', 'changed line\n') +
+                'appended line')
+
+    delta = make_delta(OLD_TEXT, new_text)
+
+    assert delta == [[0, 10], 'changed line\n', [11, 100], 'appended line']
+    assert apply_delta(OLD_TEXT, delta) == new_text
+
+
+def test_make_delta_returns_none_unless_delta_is_smaller():
+    assert make_delta(OLD_TEXT, 'something else entirely') is None
+
+
+@pytest.mark.parametrize('delta', [
+    'not a list',
+    [[0, 101]],
+    [[5, 4]],
+    [[0, 1, 2]],
+    [['0', 1]],
+    [None],
+])
+def test_apply_delta_rejects_invalid_delta(delta):
+    with pytest.raises(ValueError):
+        apply_delta(OLD_TEXT, delta)